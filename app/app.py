@@ -1,8 +1,20 @@
 import dash 
 import dash_bootstrap_components as dbc 
 
+import support.cache_warming as cache_warming
+import support.startup as startup
+import support.tracing as tracing
+
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.COSMO])
 
 server = app.server
-app.config.suppress_callback_exceptions = True
\ No newline at end of file
+app.config.suppress_callback_exceptions = True
+
+# Warm caches of popular universes in the background, status on /warmup/status
+# In preload mode the scheduler is started in the workers after the fork (see gunicorn.conf.py)
+cache_warming.start(server, run_scheduler=not startup.PRELOAD)
+
+
+# Timing of pipeline stages per callback, histograms on /metrics
+tracing.register(server)
@@ -0,0 +1,95 @@
+"""
+Batch script: parallel and resumable batch runs of the pipeline of debugging_script over a grid of universes x
+frequencies x models x parameters
+
+The grid is a stage graph (fetch -> transform -> explore -> validate -> report, see support.batch_runner) that runs
+on a process pool. Stage artifacts are content addressed, a rerun or a resumed run only runs the missing stages.
+Reports are saved to output/batch/reports/<universe>_<freq>/, the summary of all reports to output/batch/.
+
+Run: python batch_script.py --config batch.json --workers 4
+     python batch_script.py --frequencies W-Fri BM --models Benchmark-positive ARMA --arma_orders 1,0 2,1
+
+Config (json, all keys optional): {"universes": {"name": ["ticker", ...]}, "frequencies": ["BM"],
+"models": ["Benchmark-positive", "ARMA"], "arma_orders": [[1, 0]], "validation_steps": [12],
+"start_date": "2000-01-01", "end_date": null}
+
+"""
+
+# Import libraries
+import argparse
+import json
+import os
+import sys
+import warnings
+from datetime import datetime
+
+# Import support libraries
+import support.batch_runner as batch_runner
+
+
+def log(message):
+    timestamp_format = '%Y-%m-%d %H:%M:%S'
+    now = datetime.now()
+    timestamp = now.strftime(timestamp_format)
+    print(f'{timestamp}: {message}')
+    with open('output/logfile.txt', 'a') as f: f.write(f'{timestamp}: {message}\n')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Parallel and resumable batch runs over a grid of settings')
+    parser.add_argument('--config', help='json file with the grid settings')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: number of cpus)')
+    parser.add_argument('--tickers', nargs='*', help='tickers of a single universe')
+    parser.add_argument('--frequencies', nargs='*')
+    parser.add_argument('--models', nargs='*',
+                        help='Benchmark-positive, Benchmark-negative, ARMA, Prophet, XGBoost, GARCH, Kalman')
+    parser.add_argument('--arma_orders', nargs='*', help='ARMA orders p,q')
+    parser.add_argument('--validation_steps', type=int, nargs='*')
+    parser.add_argument('--start_date')
+    parser.add_argument('--end_date')
+    return parser.parse_args()
+
+
+def get_settings(args):
+    # Default grid, overwritten by the config file and the command line
+    settings = dict(batch_runner.BATCH_SETTINGS)
+    if args.config:
+        with open(args.config) as f:
+            settings.update(json.load(f))
+    if args.tickers:
+        settings['universes'] = {'tickers': args.tickers}
+    if args.arma_orders:
+        settings['arma_orders'] = [[int(i) for i in order.split(',')] for order in args.arma_orders]
+    for k in ('frequencies', 'models', 'validation_steps', 'start_date', 'end_date'):
+        if getattr(args, k):
+            settings[k] = getattr(args, k)
+    return settings
+
+
+def main():
+    args = get_arguments()
+    warnings.filterwarnings('ignore')
+
+    # Initialise output path
+    output_path = os.getcwd() + '/output/'
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    log('Batch job started...')
+    settings = get_settings(args)
+    graph = batch_runner.get_graph(settings)
+    status = batch_runner.run(graph, workers=args.workers, log=log)
+
+    # Summary of all reports
+    summary = batch_runner.get_summary(graph, status)
+    summary.to_csv(batch_runner.get_output_path() + f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    print(summary)
+
+    counts = {s: list(status.values()).count(s) for s in ('done', 'skipped', 'failed', 'blocked')}
+    log(f'Batch job finished: {counts}')
+    if counts['failed'] or counts['blocked']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
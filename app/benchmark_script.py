@@ -0,0 +1,165 @@
+"""
+Benchmark script: offline micro-benchmarks of the pipeline on synthetic price panels (no Yahoo access required)
+
+Measures run time (min/median over repeats) and peak memory (tracemalloc, separate run) of data processing, data
+exploration, model execution and the Dash figure and table builders. Results are appended to
+output/benchmark_history.jsonl and compared with the previous run with the same settings.
+
+Run: python benchmark_script.py --tickers 20 --years 10 --gaps 0.02 --repeat 3
+
+"""
+
+# Import libraries
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+# Import support libraries
+import support.dash_processing as dash_proc
+import support.data_exploration as data_expl
+import support.data_processing as data_proc
+import support.synthetic_data as synthetic_data
+from support.pipeline import get_model_settings
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Offline micro-benchmarks on synthetic price panels')
+    parser.add_argument('--tickers', type=int, default=10, help='number of tickers')
+    parser.add_argument('--years', type=float, default=5, help='years of daily history')
+    parser.add_argument('--gaps', type=float, default=0.02, help='share of missing prices')
+    parser.add_argument('--freq', default='BM', choices=data_proc.FREQ, help='data frequency of exploration/models')
+    parser.add_argument('--validation_steps', type=int, default=12)
+    parser.add_argument('--models', nargs='*', default=['Benchmark-positive', 'ARMA'],
+                        help='models to benchmark (Benchmark-positive, Benchmark-negative, ARMA, Prophet, XGBoost,'
+                             ' GARCH, Kalman)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per benchmark')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slow down reported as regression')
+    parser.add_argument('--history', default=os.getcwd() + '/output/benchmark_history.jsonl')
+    parser.add_argument('--fail_on_regression', action='store_true', help='exit code 1 on regressions')
+    return parser.parse_args()
+
+
+def measure(func, *argv, repeat=3):
+    # Run time of repeated runs and peak memory (MB) of a separate run with tracemalloc (slows down execution)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*argv)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(*argv)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times.sort()
+    return {'time_min': times[0], 'time_median': times[len(times) // 2], 'peak_mb': peak / 2 ** 20}
+
+
+def get_benchmarks(args):
+    # Benchmark functions on the synthetic data (fixed end date: identical data between versions)
+    prices = synthetic_data.generate_prices(args.tickers, args.years, args.gaps, end_date=datetime(2023, 12, 29))
+    data = data_proc.transform(prices)
+    data_ret = data_proc.get_data_slice(data, args.freq, 'return')
+    data_level = data_proc.get_data_slice(data, args.freq, 'level')
+    data_in = data_expl.get_data_in(data, args.freq)
+    stats = data_expl.get_statistics(data_in)
+    stats.columns = stats.columns.droplevel([0, 1])
+
+    def uncached(func_create, *argv):
+        # Figure builders without the figure cache
+        def run():
+            dash_proc.figure_cache.clear()
+            return func_create(*argv)
+        return run
+
+    benchmarks = {
+        'data_processing.transform': (data_proc.transform, prices),
+        'data_processing.get_data_slice': (data_proc.get_data_slice, data, args.freq, 'return'),
+        'data_exploration.get_statistics': (data_expl.get_statistics, data_in),
+        'data_exploration.get_return_summary': (data_expl.get_return_summary, data),
+    }
+
+    dict_fc_res = dict()
+    for model in args.models:
+        name, module, argv = get_model_settings(model, 1, 0)
+        benchmarks[f'{module.__name__[8:]}.execute[{name}]'] = (module.execute, data_ret, args.validation_steps, *argv)
+        dict_fc_res[name] = module.execute(data_ret, args.validation_steps, *argv)[1]
+
+    benchmarks.update({
+        'dash_processing.create_dash_figure': (uncached(dash_proc.create_dash_figure, data_level, 'Price'), ),
+        'dash_processing.create_dash_figure (cached)': (dash_proc.create_dash_figure, data_level, 'Price'),
+        'dash_processing.create_dash_density_figure': (uncached(dash_proc.create_dash_density_figure, data_ret,
+                                                                'Density'), ),
+        'dash_processing.create_dash_table_percentage': (dash_proc.create_dash_table_percentage, stats, True),
+        'dash_processing.dataframe_formatting': (dash_proc.dataframe_formatting, stats, {'count': "{:.0f}"}),
+    })
+    if dict_fc_res:
+        benchmarks['dash_processing.create_dash_forecast_figure'] = (
+            uncached(dash_proc.create_dash_forecast_figure, dict_fc_res, data_level), )
+
+    return benchmarks
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def get_previous_run(history_path, settings):
+    # Last run in the history with the same settings
+    previous = None
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['settings'] == settings:
+                    previous = record
+    return previous
+
+
+def main():
+    args = get_arguments()
+    warnings.filterwarnings('ignore')
+    settings = {k: getattr(args, k) for k in ('tickers', 'years', 'gaps', 'freq', 'validation_steps', 'models')}
+
+    # Run benchmarks
+    results = dict()
+    for name, (func, *argv) in get_benchmarks(args).items():
+        results[name] = measure(func, *argv, repeat=args.repeat)
+        print(f"{name:<55} {results[name]['time_median'] * 1000:>10.1f} ms {results[name]['peak_mb']:>10.1f} MB")
+
+    # Compare with the previous run
+    previous = get_previous_run(args.history, settings)
+    regressions = []
+    if previous:
+        for name, res in results.items():
+            prev = previous['results'].get(name)
+            if prev and res['time_median'] > prev['time_median'] * (1 + args.threshold):
+                regressions.append(name)
+                print(f"REGRESSION {name}: {prev['time_median'] * 1000:.1f} ms -> {res['time_median'] * 1000:.1f} ms "
+                      f"(commit {previous.get('commit')})")
+
+    # Save history
+    record = {'timestamp': datetime.now().isoformat(), 'commit': get_git_commit(), 'python': platform.python_version(),
+              'settings': settings, 'results': results}
+    os.makedirs(os.path.dirname(args.history), exist_ok=True)
+    with open(args.history, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
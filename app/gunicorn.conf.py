@@ -0,0 +1,38 @@
+"""
+Gunicorn settings, run with: gunicorn -c gunicorn.conf.py index:server
+
+PRELOAD_APP=1 (default): the app, heavy model modules, layouts, warmed caches and the Stan model are loaded once in
+the master and shared copy-on-write by the workers. PRELOAD_APP=0: every worker loads the app itself and heavy modules
+are imported on first use. Startup time and memory (rss/pss/uss) per process are printed with the tag [startup].
+
+"""
+import os
+import time
+
+os.environ.setdefault('PRELOAD_APP', '1')
+os.environ['STARTUP_TIME'] = str(time.time())  # the config is loaded before the app
+
+bind = '0.0.0.0:80'
+workers = int(os.environ.get('GUNICORN_WORKERS', 5))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+preload_app = os.environ['PRELOAD_APP'] == '1'
+
+
+def when_ready(server):
+    import support.startup as startup
+    if startup.PRELOAD:
+        startup.preload()
+    startup.report('master ready', float(os.environ['STARTUP_TIME']))
+
+
+def post_fork(server, worker):
+    import support.startup as startup
+    if startup.PRELOAD:
+        import support.cache_warming as cache_warming
+        cache_warming.start_scheduler()
+
+
+def post_worker_init(worker):
+    import support.startup as startup
+    startup.report(f'worker {worker.age} ready', float(os.environ['STARTUP_TIME']))
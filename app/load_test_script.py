@@ -0,0 +1,268 @@
+"""
+Load test script: end-to-end load test of the Dash server with simulated users
+
+Starts index:server with gunicorn against the offline data provider (DATA_PROVIDER=synthetic) and replays sessions of
+N concurrent simulated users on the Dash callback endpoint (/_dash-update-component): update data, switch frequency
+and run forecasts. Reports latency percentiles, throughput, error and timeout rates per callback and the memory of the
+gunicorn workers. The report is saved to output/load_test_<timestamp>.json to compare worker/thread configurations.
+
+Run: python load_test_script.py --workers 5 --threads 1 --users 10 --sessions 3
+
+"""
+
+# Import libraries
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import numpy as np
+
+# Simulated user settings
+TICKER_POOL = ['AGN.AS', 'ASRNL.AS', 'NN.AS', 'INGA.AS', 'ABN.AS', 'PHIA.AS', 'ASML.AS', 'HEIA.AS', 'AD.AS', 'KPN.AS']
+FREQUENCIES = ['B', 'W-Fri', 'BM', 'BY']
+MODELS = ['Benchmark-positive', 'Benchmark-negative', 'ARMA']
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Load test of the Dash server with simulated users')
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--timeout', type=int, default=600, help='gunicorn worker timeout (seconds)')
+    parser.add_argument('--preload', type=int, default=1, choices=[0, 1], help='PRELOAD_APP, see gunicorn.conf.py')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--users', type=int, default=10, help='concurrent simulated users')
+    parser.add_argument('--sessions', type=int, default=3, help='sessions per user')
+    parser.add_argument('--think_time', type=float, default=1.0, help='mean pause between user actions (seconds)')
+    parser.add_argument('--request_timeout', type=float, default=600, help='client timeout per request (seconds)')
+    parser.add_argument('--shared_universe', type=float, default=0.5,
+                        help='share of sessions on the default universe (identical requests)')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def start_server(args):
+    # Start gunicorn with the offline data provider, command line settings overrule gunicorn.conf.py
+    env = dict(os.environ, DATA_PROVIDER='synthetic', CACHE_WARMING='0', PRELOAD_APP=str(args.preload))
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', f'--workers={args.workers}',
+           f'--threads={args.threads}', f'--timeout={args.timeout}', f'--bind=127.0.0.1:{args.port}', 'index:server']
+    process = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+    # Wait until the server responds
+    for _ in range(600):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{args.port}/', timeout=5)
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn stopped during startup')
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def get_children(pid):
+    # Process ids of the gunicorn workers (Linux)
+    children = []
+    for p in os.listdir('/proc'):
+        if p.isdigit():
+            try:
+                with open(f'/proc/{p}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(p))
+            except (OSError, IndexError, ValueError):
+                pass
+    return children
+
+
+def get_rss(pid):
+    # Resident memory of a process in MB
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return np.nan
+
+
+class MemorySampler(threading.Thread):
+    # Sample the memory of the gunicorn workers during the load test
+
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.pid, self.interval = pid, interval
+        self.samples = dict()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for child in get_children(self.pid):
+                self.samples.setdefault(child, []).append(get_rss(child))
+            self.stopped.wait(self.interval)
+
+    def summary(self):
+        return {str(pid): {'rss_max_mb': float(np.nanmax(v)), 'rss_mean_mb': float(np.nanmean(v))}
+                for pid, v in self.samples.items() if len(v)}
+
+
+class SimulatedUser(object):
+    # Replays dashboard sessions on the Dash callback endpoint
+
+    def __init__(self, url, args, seed, results, lock):
+        self.url, self.args = url, args
+        self.random = random.Random(seed)
+        self.results, self.lock = results, lock
+        self.n_clicks = {'update': 0, 'forecast': 0}
+
+    def request(self, callback, outputs, inputs, state):
+        # POST to /_dash-update-component, returns the response dict or None
+        payload = {
+            'output': '..' + '...'.join(f'{i}.{p}' for i, p in outputs) + '..',
+            'outputs': [{'id': i, 'property': p} for i, p in outputs],
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+            'changedPropIds': [f'{i}.{p}' for i, p, _ in inputs],
+        }
+        req = urllib.request.Request(self.url + '/_dash-update-component', data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        status, response = 'ok', None
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=self.args.request_timeout) as r:
+                response = json.loads(r.read()).get('response')
+        except socket.timeout:
+            status = 'timeout'
+        except urllib.error.URLError as e:
+            status = 'timeout' if isinstance(e.reason, socket.timeout) else 'error'
+        except Exception:
+            status = 'error'
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            self.results.append({'callback': callback, 'latency': latency, 'status': status, 'time': time.time()})
+        return response
+
+    def think(self):
+        time.sleep(self.random.expovariate(1 / self.args.think_time) if self.args.think_time > 0 else 0)
+
+    def run_session(self):
+        # Update data
+        if self.random.random() < self.args.shared_universe:
+            tickers = TICKER_POOL[:3]
+        else:
+            tickers = self.random.sample(TICKER_POOL, self.random.randint(1, 6))
+        tickers = (tickers + [''] * 6)[:6]
+        start_date = self.random.choice(['2015-01-01', '2020-01-01'])
+        end_date = datetime.now().strftime('%Y-%m-%d')
+        self.n_clicks['update'] += 1
+        response = self.request(
+            'get_data',
+            [('intermediate-value', 'children'), ('output-loading', 'children'), ('session-request', 'data')],
+            [('button-update_data', 'n_clicks', self.n_clicks['update'])],
+            [(f'input{i + 1}', 'value', t) for i, t in enumerate(tickers)] +
+            [('my-date-picker-range', 'start_date', start_date), ('my-date-picker-range', 'end_date', end_date),
+             ('radioitems-input_market', 'value', self.random.random() < 0.5), ('session-request', 'data', None)])
+        if not response:
+            return
+        json_data = response['intermediate-value']['children']
+
+        # Data exploration: initial and switched frequency
+        for freq in self.random.sample(FREQUENCIES, 2):
+            self.think()
+            self.request(
+                'update_graphs',
+                [('output-table_summary', 'children'), ('output-table_returns', 'children'),
+                 ('output-graph1', 'children'), ('output-graph2', 'children'), ('output-graph3', 'children'),
+                 ('output-graph4', 'children'), ('live-figures', 'data')],
+                [('intermediate-value', 'children', json_data)],
+                [('radioitems-frequency', 'value', freq)])
+
+        # Forecast
+        self.think()
+        self.n_clicks['forecast'] += 1
+        self.request(
+            'train_forecast_model',
+            [('output-results_forecast', 'children'), ('output-graph_forecast', 'children'),
+             ('output-results_strategy', 'children'), ('output-results_portfolio', 'children')],
+            [('button-forecast', 'n_clicks', self.n_clicks['forecast'])],
+            [('intermediate-value', 'children', json_data), ('radioitems-frequency', 'value', 'BM'),
+             ('checklist-models', 'value', self.random.sample(MODELS, self.random.randint(1, 2))),
+             ('input7', 'value', 1), ('input8', 'value', 0), ('input9', 'value', 12),
+             ('radioitems-window', 'value', 'expanding'), ('input10', 'value', 60), ('input13', 'value', 10)])
+
+    def run(self):
+        for _ in range(self.args.sessions):
+            self.run_session()
+            self.think()
+
+
+def get_report(results, duration):
+    # Latency percentiles, throughput and error/timeout rates per callback
+    report = dict()
+    for callback in sorted(set(r['callback'] for r in results)):
+        res = [r for r in results if r['callback'] == callback]
+        latency = np.array([r['latency'] for r in res if r['status'] == 'ok'])
+        report[callback] = {
+            'requests': len(res),
+            'throughput_per_s': len(res) / duration,
+            'error_rate': sum(r['status'] == 'error' for r in res) / len(res),
+            'timeout_rate': sum(r['status'] == 'timeout' for r in res) / len(res),
+        }
+        for q in (50, 90, 95, 99, 100):
+            report[callback][f'p{q}_s'] = float(np.percentile(latency, q)) if len(latency) else None
+    return report
+
+
+def main():
+    args = get_arguments()
+    url = f'http://127.0.0.1:{args.port}'
+
+    process = start_server(args)
+    sampler = MemorySampler(process.pid)
+    sampler.start()
+
+    # Run simulated users
+    results, lock = [], threading.Lock()
+    users = [SimulatedUser(url, args, args.seed + i, results, lock) for i in range(args.users)]
+    threads = [threading.Thread(target=u.run) for u in users]
+    start = time.time()
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        duration = time.time() - start
+        sampler.stopped.set()
+        process.terminate()
+        process.wait()
+
+    # Report
+    report = {'settings': vars(args), 'duration_s': duration, 'requests': len(results),
+              'throughput_per_s': len(results) / duration, 'callbacks': get_report(results, duration),
+              'worker_memory': sampler.summary()}
+    print(f"{'callback':<22}{'requests':>9}{'p50 (s)':>9}{'p95 (s)':>9}{'p99 (s)':>9}{'errors':>8}{'timeouts':>9}")
+    for k, v in report['callbacks'].items():
+        print(f"{k:<22}{v['requests']:>9}{v['p50_s'] or np.nan:>9.2f}{v['p95_s'] or np.nan:>9.2f}"
+              f"{v['p99_s'] or np.nan:>9.2f}{v['error_rate']:>8.1%}{v['timeout_rate']:>9.1%}")
+    print(f"throughput: {report['throughput_per_s']:.2f} requests/s, worker memory (max rss, MB): "
+          f"{[round(v['rss_max_mb']) for v in report['worker_memory'].values()]}")
+
+    output_path = os.path.dirname(os.path.abspath(__file__)) + '/output/'
+    os.makedirs(output_path, exist_ok=True)
+    with open(output_path + f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json", 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
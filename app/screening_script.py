@@ -0,0 +1,95 @@
+"""
+Screening script: statistics and benchmark validation of very large ticker universes in bounded memory
+
+The universe is processed in blocks of --chunk_size tickers (see support.chunked_processing). Partial results are
+written to output/chunks/<run>/, a restarted run with identical settings continues with the missing blocks. The
+summary tables are saved to output/chunked_*.csv. With --price_store the prices are read from a memory-mapped price
+store (see support.price_store), which is built from the data provider on the first run.
+
+Run: python screening_script.py --tickers_file tickers.txt --chunk_size 250 --start_date 2015-01-01
+     DATA_PROVIDER=synthetic python screening_script.py --synthetic 5000 --price_store output/price_store
+
+"""
+
+# Import libraries
+import argparse
+import os
+import warnings
+from datetime import datetime
+
+# Import support libraries
+import support.chunked_processing as chunked_proc
+import support.data_processing as data_proc
+import support.price_store as price_store
+
+
+def log(message):
+    timestamp_format = '%Y-%m-%d %H:%M:%S'
+    now = datetime.now()
+    timestamp = now.strftime(timestamp_format)
+    print(f'{timestamp}: {message}')
+    with open('output/logfile.txt', 'a') as f: f.write(f'{timestamp}: {message}\n')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Chunked screening of large ticker universes')
+    parser.add_argument('--tickers_file', help='text file with one ticker per line')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='number of synthetic tickers (DATA_PROVIDER=synthetic)')
+    parser.add_argument('--chunk_size', type=int, default=250, help='tickers per block')
+    parser.add_argument('--start_date', default='2015-01-01')
+    parser.add_argument('--end_date', default=datetime.now().strftime('%Y-%m-%d'))
+    parser.add_argument('--freq', default='W-Fri', choices=data_proc.FREQ)
+    parser.add_argument('--validation_steps', type=int, default=12)
+    parser.add_argument('--models', nargs='*', default=['Benchmark-positive'],
+                        help='models to validate (Benchmark-positive, Benchmark-negative, ARMA, Prophet, XGBoost,'
+                             ' GARCH, Kalman)')
+    parser.add_argument('--price_store', help='directory of the price store, built if it does not exist')
+    parser.add_argument('--arma_order', type=int, nargs=2, default=[1, 0], help='ARMA order p q')
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+    warnings.filterwarnings('ignore')
+
+    # Initialise output path
+    output_path = os.getcwd() + '/output/'
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    # Ticker universe
+    if args.tickers_file:
+        with open(args.tickers_file) as f:
+            index = [line.strip().upper() for line in f if line.strip()]
+    else:
+        index = [f'SYN{i:04d}' for i in range(args.synthetic)]
+    if not index:
+        raise SystemExit('Supply --tickers_file or --synthetic')
+
+    start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+
+    # Price store: prices of the universe on disk, rebuilt if tickers or dates of the request are missing
+    store = None
+    if args.price_store:
+        store = price_store.PriceStore(args.price_store)
+        if not store.covers(index, start_date, end_date):
+            log('Price store build started...')
+            store = price_store.build(args.price_store, index, start_date, end_date, args.chunk_size, log=log)
+
+    log(f'Screening of {len(index)} tickers started...')
+    stats, returns, forecast_summary = chunked_proc.execute(
+        index, start_date, end_date, freq=args.freq, chunk_size=args.chunk_size,
+        validation_steps=args.validation_steps, models=args.models, arma_order=args.arma_order, store=store, log=log)
+
+    # Print output
+    print(stats.T.describe())
+    for name, summary in forecast_summary.items():
+        print(name)
+        print(summary.T.loc[:, ['accuracy', 'payout_from_100']].astype(float).describe())
+    log('Job Finished')
+
+
+if __name__ == "__main__":
+    main()
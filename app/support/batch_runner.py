@@ -0,0 +1,194 @@
+""" Library for batch runs: stage graph of a grid of universes x frequencies x models x parameters
+Stages: fetch (extract) -> transform -> explore (statistics and returns) -> validate (model forecast and validation)
+-> report (tables per universe and frequency). The artifact of a stage is stored under a content hash of the stage
+parameters and the keys of its inputs (output/batch/artifacts/<key>.pkl), so that stages shared by grid points run
+once, reruns skip completed stages and an interrupted run resumes where it stopped. The stages run on a process pool
+as soon as their inputs are available.
+
+"""
+import os
+import pickle
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+import pandas as pd
+
+import support.caching as caching
+import support.data_exploration as data_expl
+import support.data_processing as data_proc
+from support.pipeline import INDEX_MARKET, get_model_settings
+
+# Default grid: the pipeline of debugging_script
+BATCH_SETTINGS = {
+    'universes': {'market_indices': INDEX_MARKET},
+    'frequencies': ['BM'],
+    'models': ['Benchmark-positive', 'ARMA', 'Prophet'],
+    'arma_orders': [[1, 0]],  # ARMA(p,q) orders of the ARMA model
+    'validation_steps': [12],
+    'start_date': '2000-01-01',
+    'end_date': None,  # today
+}
+
+
+def get_output_path(*subdirs):
+    output_path = os.getcwd() + '/output/batch/' + ''.join(d + '/' for d in subdirs)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path, exist_ok=True)
+    return output_path
+
+
+def get_artifact_path(key):
+    return get_output_path('artifacts') + key + '.pkl'
+
+
+def read_artifact(key):
+    with open(get_artifact_path(key), 'rb') as f:
+        return pickle.load(f)
+
+
+def write_artifact(key, value):
+    # Write to a temporary file and rename: an interrupted stage leaves no artifact
+    file_path = get_artifact_path(key)
+    with open(file_path + f'.{os.getpid()}.tmp', 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_path + f'.{os.getpid()}.tmp', file_path)
+
+
+def get_stage(stage, params, inputs=()):
+    # Stage of the graph, the key is the content hash of the stage, its parameters and its inputs
+    input_keys = [s['key'] for s in inputs]
+    return {'key': caching.hash_key(stage, params, input_keys), 'stage': stage, 'params': params,
+            'inputs': input_keys}
+
+
+def get_graph(settings):
+    # Stages of the grid in dependency order (stages shared by grid points are included once)
+    start_date = settings['start_date']
+    end_date = settings['end_date'] or datetime.now().strftime('%Y-%m-%d')
+
+    graph = dict()
+    for universe, index_list in settings['universes'].items():
+        fetch = get_stage('fetch', {'index': sorted(set(index_list)), 'start_date': start_date,
+                                    'end_date': end_date})
+        transform = get_stage('transform', dict(), [fetch])
+        graph.update({fetch['key']: fetch, transform['key']: transform})
+
+        for freq in settings['frequencies']:
+            explore = get_stage('explore', {'freq': freq}, [transform])
+            validate = []
+            for model in settings['models']:
+                for arma_order in (settings['arma_orders'] if model == 'ARMA' else [None]):
+                    for validation_steps in settings['validation_steps']:
+                        validate.append(get_stage('validate', {'freq': freq, 'model': model, 'arma_order': arma_order,
+                                                               'validation_steps': validation_steps}, [transform]))
+            report = get_stage('report', {'universe': universe, 'freq': freq}, [explore] + validate)
+            graph.update({s['key']: s for s in [explore] + validate + [report]})
+
+    return graph
+
+
+def get_label(stage):
+    params = ', '.join(f'{k}={v}' for k, v in stage['params'].items() if k != 'index')
+    return f"{stage['stage']}({params})"
+
+
+def fetch(params):
+    start_date = datetime.strptime(params['start_date'], '%Y-%m-%d')
+    end_date = datetime.strptime(params['end_date'], '%Y-%m-%d')
+    return data_proc.extract(params['index'], start_date, end_date)
+
+
+def transform(params, prices):
+    return data_proc.transform(prices)
+
+
+def explore(params, data):
+    data_in = data_expl.get_data_in(data, params['freq'])
+    return data_expl.get_statistics(data_in), data_expl.get_return_summary(data)
+
+
+def validate(params, data):
+    data_ret = data_proc.get_data_slice(data, params['freq'], 'return')
+    name, module, argv = get_model_settings(params['model'], *(params['arma_order'] or [1, 0]))
+    summary, results = module.get_model_forecast_and_validation(data_ret, params['validation_steps'], *argv)
+    return {'name': name, 'validation_steps': params['validation_steps'], 'summary': summary, 'results': results}
+
+
+def report(params, exploration, *validations):
+    # Tables per universe and frequency: statistics, returns, forecast summary and validation results of all models
+    stats, returns = exploration
+    report_path = get_output_path('reports', f"{params['universe']}_{params['freq']}")
+    stats.to_csv(report_path + 'statistics.csv')
+    returns.to_csv(report_path + 'returns.csv')
+
+    dict_summary = dict()
+    for v in validations:
+        dict_summary[(v['name'], v['validation_steps'])] = v['summary']
+        v['results'].to_csv(report_path + f"forecast_results_{v['name']}_{v['validation_steps']}.csv")
+    forecast_summary = pd.concat(dict_summary, names=['model', 'validation_steps', 'metric'])
+    forecast_summary.to_csv(report_path + 'forecast_summary.csv')
+
+    return forecast_summary
+
+
+STAGES = {'fetch': fetch, 'transform': transform, 'explore': explore, 'validate': validate, 'report': report}
+
+
+def init_worker():
+    # Worker processes of the pool: one thread per model (the pool uses the cores), set before the models are imported
+    os.environ['XGB_NTHREAD'] = '1'
+
+
+def run_stage(stage):
+    # Run a stage in a worker process: the inputs are read from their artifacts
+    inputs = [read_artifact(key) for key in stage['inputs']]
+    write_artifact(stage['key'], STAGES[stage['stage']](stage['params'], *inputs))
+    return stage['key']
+
+
+def run(graph, workers=None, log=print):
+    # Run the stages of the graph on a process pool, stages with an artifact are skipped
+    # Returns the status per stage: done, skipped (artifact of a previous run), failed or blocked (failed input)
+    status = {key: 'skipped' for key in graph if os.path.exists(get_artifact_path(key))}
+    pending = {key: stage for key, stage in graph.items() if key not in status}
+    log(f'Batch run: {len(graph)} stages, {len(status)} completed in a previous run')
+
+    running = dict()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        while pending or running:
+            # Submit stages of which all inputs are available
+            for key, stage in list(pending.items()):
+                if any(status.get(i) in ('failed', 'blocked') for i in stage['inputs']):
+                    status[key] = 'blocked'
+                    del pending[key]
+                    log(f'Stage {get_label(stage)} blocked by a failed input')
+                elif all(status.get(i) in ('done', 'skipped') for i in stage['inputs']):
+                    running[pool.submit(run_stage, stage)] = stage
+                    del pending[key]
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    future.result()
+                    status[stage['key']] = 'done'
+                    log(f"Stage {get_label(stage)} finished")
+                except Exception:
+                    status[stage['key']] = 'failed'
+                    log(f"Stage {get_label(stage)} failed:\n{traceback.format_exc()}")
+
+    return status
+
+
+def get_summary(graph, status):
+    # Forecast summary of all completed reports
+    dict_summary = dict()
+    for key, stage in graph.items():
+        if stage['stage'] == 'report' and status.get(key) in ('done', 'skipped'):
+            dict_summary[(stage['params']['universe'], stage['params']['freq'])] = read_artifact(key)
+    if not dict_summary:
+        return pd.DataFrame()
+    return pd.concat(dict_summary, names=['universe', 'freq'])
@@ -0,0 +1,139 @@
+""" Library for scheduled cache warming of popular universes
+A background thread precomputes datasets, exploration statistics and benchmark forecasts during off-hours and writes
+them into the caches of support.pipeline. Every gunicorn worker runs the scheduler, a lease per job makes sure that
+each job only runs once. The status of the warm jobs is shared via the disk cache and served on /warmup/status.
+The warmed entries are written with a time to live until the end of the warm hours of the next day (instead of
+CACHE_TTL), so that they are valid during the day. The scheduler also sweeps the disk cache (expired entries and the
+size limit, see support.caching.sweep).
+
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import jsonify
+
+import support.caching as caching
+import support.pipeline as pipeline
+
+# Default settings, can be overwritten with a json file in the environment variable CACHE_WARMING_CONFIG
+WARM_SETTINGS = {
+    'universes': {
+        'market_indices': pipeline.INDEX_MARKET,
+        'default_watchlist': ['AGN.AS', 'ASRNL.AS', 'NN.AS'] + pipeline.INDEX_MARKET,
+    },
+    'frequencies': ['B', 'W-Fri', 'BM', 'BY'],
+    'models': ['Benchmark-positive', 'Benchmark-negative'],
+    'validation_steps': 12,  # default of the dashboard
+    'arma_order': [1, 0],  # default of the dashboard
+    'start_date': '2020-01-01',  # default of the dashboard
+    'hours': [5, 6, 7],  # off-hours (local server time) in which the jobs are run
+    'poll_interval': 300,  # seconds between schedule checks
+}
+STATUS_KEY = 'cache_warming_status'
+
+_scheduler = dict()
+
+
+def get_settings():
+    settings = dict(WARM_SETTINGS)
+    config_path = os.environ.get('CACHE_WARMING_CONFIG')
+    if config_path:
+        with open(config_path) as f:
+            settings.update(json.load(f))
+    return settings
+
+
+def get_status():
+    status = caching.read(STATUS_KEY, max_age=float('inf'))
+    return dict() if status is caching.MISSING else status
+
+
+def update_status(job, **kwargs):
+    # Read-modify-write of the shared status
+    with caching.lease(STATUS_KEY, timeout=10):
+        status = get_status()
+        status.setdefault(job, dict()).update(kwargs)
+        caching.write(STATUS_KEY, status, ttl=float('inf'))
+
+
+def get_warm_ttl(settings, now=None):
+    # Seconds until the end of the warm hours of the next day: the next run has replaced the entries
+    now = datetime.now() if isinstance(now, type(None)) else now
+    end = datetime(now.year, now.month, now.day) + timedelta(days=1, hours=max(settings['hours']) + 1)
+    return (end - now).total_seconds()
+
+
+def run_job(universe, index_list, freq, settings):
+    # Precompute dataset, exploration statistics and forecasts of a universe (same keys as the dashboard callbacks)
+    start_date = datetime.strptime(settings['start_date'], "%Y-%m-%d")
+    end_date = datetime.strptime(datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+    arma_p, arma_q = settings['arma_order']
+
+    with caching.entry_ttl(get_warm_ttl(settings)):
+        data = pipeline.read_dataset(pipeline.get_dataset(index_list, start_date, end_date))
+        pipeline.get_exploration(data, freq)
+        pipeline.get_forecasts(data, freq, settings['models'], arma_p, arma_q, settings['validation_steps'])
+
+
+def run_jobs(settings=None, force=False):
+    # Run all warm jobs that did not run today
+    settings = get_settings() if isinstance(settings, type(None)) else settings
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    for universe, index_list in settings['universes'].items():
+        for freq in settings['frequencies']:
+            job = f'{universe}|{freq}'
+            if not force and get_status().get(job, dict()).get('date') == today:
+                continue
+
+            # Skip if another worker is running the job
+            with caching.lease('warm_' + caching.hash_key(job), timeout=0) as acquired:
+                if not acquired or (not force and get_status().get(job, dict()).get('date') == today):
+                    continue
+
+                start = time.time()
+                update_status(job, state='running', started=datetime.now().isoformat(), pid=os.getpid())
+                try:
+                    run_job(universe, index_list, freq, settings)
+                    update_status(job, state='done', date=today, duration=round(time.time() - start, 1), error=None)
+                except Exception as e:
+                    traceback.print_exc()
+                    update_status(job, state='failed', duration=round(time.time() - start, 1), error=repr(e))
+
+
+def scheduler_loop():
+    while True:
+        settings = get_settings()
+        try:
+            caching.sweep()
+        except Exception:
+            traceback.print_exc()
+        if datetime.now().hour in settings['hours']:
+            try:
+                run_jobs(settings)
+            except Exception:
+                traceback.print_exc()
+        time.sleep(settings['poll_interval'])
+
+
+def start_scheduler():
+    # Start the background scheduler once per process (threads do not survive a fork)
+    if os.environ.get('CACHE_WARMING', '1') == '0' or _scheduler.get('pid') == os.getpid():
+        return
+    thread = threading.Thread(target=scheduler_loop, name='cache-warming', daemon=True)
+    thread.start()
+    _scheduler.update(pid=os.getpid(), thread=thread)
+
+
+def start(server, run_scheduler=True):
+    # Register the status route on the Flask server and start the scheduler
+    @server.route('/warmup/status')
+    def warmup_status():
+        return jsonify(get_status())
+
+    if run_scheduler:
+        start_scheduler()
@@ -0,0 +1,261 @@
+""" Library for caching: content hashing, in-memory and disk caches and request coalescing """
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl  # cross-process file locks (not available on Windows)
+except ImportError:
+    fcntl = None
+
+# Disk cache settings: default time to live of results and maximum wait for an in-flight computation (seconds)
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 3600))
+LEASE_TIMEOUT = float(os.environ.get('CACHE_LEASE_TIMEOUT', 600))
+# Disk cache size limit (MB) and minimum time between sweeps of the disk cache (seconds), see sweep
+CACHE_MAX_MB = float(os.environ.get('CACHE_MAX_MB', 2048))
+SWEEP_INTERVAL = float(os.environ.get('CACHE_SWEEP_INTERVAL', 600))
+
+MISSING = object()
+_thread_locks = dict()
+_thread_locks_lock = threading.Lock()
+_local = threading.local()  # time to live of the entries written by a thread, see entry_ttl
+
+
+def hash_key(*args):
+    # Content hash of dataframes, series, arrays and parameters (used as cache key)
+    h = hashlib.sha1()
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            h.update(pd.util.hash_pandas_object(arg, index=True).values.tobytes())
+            h.update(repr(arg.columns.tolist()).encode())
+        elif isinstance(arg, pd.Series):
+            h.update(pd.util.hash_pandas_object(arg, index=True).values.tobytes())
+            h.update(repr(arg.name).encode())
+        elif isinstance(arg, np.ndarray):
+            h.update(np.ascontiguousarray(arg).tobytes())
+            h.update(repr((arg.dtype.str, arg.shape)).encode())
+        elif isinstance(arg, dict):
+            for k, v in arg.items():
+                h.update(hash_key(k, v).encode())
+        elif isinstance(arg, (list, tuple)):
+            h.update(hash_key(*arg).encode())
+        else:
+            h.update(repr(arg).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+class MemoryCache(object):
+    # Thread safe least-recently-used cache (per process)
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_cache_path():
+    # Shared by all gunicorn workers on the same host
+    cache_path = os.getcwd() + '/output/cache/'
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path, exist_ok=True)
+    return cache_path
+
+
+@contextmanager
+def entry_ttl(ttl):
+    # Time to live (seconds) of the entries written by the thread, e.g. warmed entries until the next warm run.
+    # Valid entries with an earlier expiry that are read by the thread are rewritten with the time to live
+    prev = getattr(_local, 'ttl', None)
+    _local.ttl = ttl
+    try:
+        yield
+    finally:
+        _local.ttl = prev
+
+
+def read(key, max_age=None):
+    # Read a result from the disk cache, returns MISSING if not found or expired
+    # Entries expire at the expiry of the entry (see write), max_age: maximum age since the write instead
+    file_path = get_cache_path() + key + '.pkl'
+    try:
+        if not isinstance(max_age, type(None)) and time.time() - os.path.getmtime(file_path) > max_age:
+            return MISSING
+        with open(file_path, 'rb') as f:
+            expires = pickle.load(f)
+            if not isinstance(expires, float) or (isinstance(max_age, type(None)) and time.time() > expires):
+                # Expired (or old format) entries are removed
+                os.remove(file_path)
+                return MISSING
+            value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return MISSING
+
+    ttl = getattr(_local, 'ttl', None)
+    if not isinstance(ttl, type(None)) and expires < time.time() + ttl:
+        write(key, value, ttl)
+    return value
+
+
+def write(key, value, ttl=None):
+    # Write a result to the disk cache (atomic rename, readers never see partial files)
+    # The expiry (time.time() + ttl, default: ttl of the thread or CACHE_TTL) is pickled before the value
+    ttl = (getattr(_local, 'ttl', None) or CACHE_TTL) if isinstance(ttl, type(None)) else ttl
+    file_path = get_cache_path() + key + '.pkl'
+    tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(time.time() + ttl, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, file_path)
+    return value
+
+
+@contextmanager
+def lease(key, timeout=None):
+    # Exclusive cross-process lease on a key, released when the holder exits or dies
+    # Yields False if the lease could not be acquired within the timeout
+    timeout = LEASE_TIMEOUT if isinstance(timeout, type(None)) else timeout
+    deadline = time.monotonic() + timeout
+
+    if isinstance(fcntl, type(None)):
+        with _thread_locks_lock:
+            lock = _thread_locks.setdefault(key, threading.Lock())
+        acquired = lock.acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    with open(get_cache_path() + key + '.lock', 'a') as f:
+        acquired = False
+        while True:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+        if acquired:
+            # Last use of the lock file (see sweep)
+            os.utime(f.fileno())
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def single_flight(key, func, *argv, max_age=None, cache_if=None, **kwargs):
+    # Coalesce identical requests: one caller computes, concurrent callers wait and share the result
+    # cache_if: function of the result, results for which it returns False are returned but not cached
+    # Lease timeout (the holder is still computing): the result is computed without the lease and not cached
+    value = read(key, max_age)
+    if value is not MISSING:
+        return value
+
+    with lease(key) as acquired:
+        # The result may have been written while waiting for the lease
+        value = read(key, max_age)
+        if value is MISSING:
+            value = func(*argv, **kwargs)
+            if acquired and (isinstance(cache_if, type(None)) or cache_if(value)):
+                write(key, value)
+
+    return value
+
+
+def remove_lock(file_path):
+    # Remove a lock file that is not held (the lock is held while the file is removed)
+    if isinstance(fcntl, type(None)):
+        return
+    with open(file_path, 'a') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        os.remove(file_path)
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def sweep(max_mb=CACHE_MAX_MB):
+    # Remove expired entries, temporary and lock files that were not used for LEASE_TIMEOUT and the least recently
+    # written entries above max_mb. Runs at most once per SWEEP_INTERVAL on a host, returns the removed files
+    cache_path = get_cache_path()
+    marker_path = cache_path + 'sweep.marker'
+    with lease('sweep', timeout=0) as acquired:
+        try:
+            if not acquired or time.time() - os.path.getmtime(marker_path) < SWEEP_INTERVAL:
+                return 0
+        except OSError:
+            pass
+        with open(marker_path, 'a'):
+            os.utime(marker_path)
+
+        now, removed, entries = time.time(), 0, []
+        for file_name in os.listdir(cache_path):
+            file_path = cache_path + file_name
+            try:
+                stat = os.stat(file_path)
+                if file_name.endswith('.pkl'):
+                    with open(file_path, 'rb') as f:
+                        expires = pickle.load(f)
+                    if isinstance(expires, float) and now <= expires:
+                        entries.append((stat.st_mtime, stat.st_size, file_path))
+                        continue
+                    os.remove(file_path)
+                elif file_name.endswith('.tmp') and now - stat.st_mtime > LEASE_TIMEOUT:
+                    os.remove(file_path)
+                elif file_name.endswith('.lock') and file_name != 'sweep.lock' and now - stat.st_mtime > LEASE_TIMEOUT:
+                    remove_lock(file_path)
+                else:
+                    continue
+                removed += 1
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+
+        # Size limit: least recently written entries first
+        size = sum(e[1] for e in entries)
+        for _, file_size, file_path in sorted(entries):
+            if size <= max_mb * 2 ** 20:
+                break
+            try:
+                os.remove(file_path)
+                removed += 1
+            except OSError:
+                pass
+            size -= file_size
+
+    return removed
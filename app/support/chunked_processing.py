@@ -0,0 +1,133 @@
+""" Library for chunked processing: out-of-core execution for very large ticker universes
+The universe is processed in blocks of chunk_size tickers: extract, transform, statistics and model validation per
+block. The partial results of each block are written to disk (output/chunks/<run>/), so that the memory is bounded
+by the block size and an interrupted run continues with the missing blocks. The summary tables are assembled from the
+partial results. Pooled models (module.POOLED, e.g. XGBoost) are trained per block: their forecasts differ from a
+model of the full universe.
+
+"""
+import gc
+import os
+import pickle
+
+import pandas as pd
+
+import support.data_exploration as data_expl
+import support.data_processing as data_proc
+from support.caching import hash_key
+from support.pipeline import get_model_settings
+from support.tracing import span
+
+
+def get_chunks(index, chunk_size):
+    # Blocks of tickers (sorted: identical blocks for identical universes)
+    index = sorted(set(index))
+    return [index[i:i + chunk_size] for i in range(0, len(index), chunk_size)]
+
+
+def get_run_path(run_key):
+    run_path = os.getcwd() + f'/output/chunks/{run_key}/'
+    if not os.path.exists(run_path):
+        os.makedirs(run_path, exist_ok=True)
+    return run_path
+
+
+def execute_chunk(index, start_date, end_date, freq, validation_steps, models, arma_order, store=None):
+    # Extract, transform, statistics and model validation of a block of tickers
+    # store: price store (see support.price_store), the block is a view of the stored prices instead of a download
+    chunk = {'index': index, 'statistics': None, 'returns': None, 'forecast_summary': dict(),
+             'forecast_results': dict()}
+    if not isinstance(store, type(None)):
+        data = store.select(index, start_date, end_date)
+        if not data.shape[0] or not data.shape[1]:
+            return chunk
+    else:
+        with span('extract', tickers=len(index)) as s:
+            data = data_proc.extract(index, start_date, end_date)
+            s.set(rows=data.shape[0])
+        if data.empty:
+            return chunk
+
+        with span('transform', tickers=data.shape[1], rows=data.shape[0]):
+            data = data_proc.transform(data)
+    data_in = data_expl.get_data_in(data, freq)
+    chunk['statistics'] = data_expl.get_statistics(data_in)
+    chunk['returns'] = data_expl.get_return_summary(data)
+
+    # Model validation: only the validation steps of the results are kept
+    data_ret = data_proc.get_data_slice(data, freq, 'return')
+    for model in models:
+        name, module, argv = get_model_settings(model, *arma_order)
+        summary, results = module.get_model_forecast_and_validation(data_ret, validation_steps, *argv)
+        chunk['forecast_summary'][name] = summary
+        chunk['forecast_results'][name] = results.iloc[-validation_steps:, ]
+
+    return chunk
+
+
+def assemble(chunk_paths):
+    # Summary tables of all blocks: statistics, returns and forecast summary per model
+    list_stats, list_returns, dict_summary = [], [], dict()
+    for file_path in chunk_paths:
+        with open(file_path, 'rb') as f:
+            chunk = pickle.load(f)
+        if isinstance(chunk['statistics'], type(None)):
+            continue
+        list_stats.append(chunk['statistics'])
+        list_returns.append(chunk['returns'])
+        for name, summary in chunk['forecast_summary'].items():
+            dict_summary.setdefault(name, []).append(summary)
+
+    stats = pd.concat(list_stats, axis=1) if list_stats else pd.DataFrame()
+    returns = pd.concat(list_returns, axis=1) if list_returns else pd.DataFrame()
+    forecast_summary = {name: pd.concat(v, axis=1) for name, v in dict_summary.items()}
+
+    return stats, returns, forecast_summary
+
+
+def load(stats, returns, forecast_summary):
+    # Save data
+    output_path = os.getcwd() + '/output/'
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    stats.to_csv(output_path + 'chunked_statistics.csv')
+    returns.to_csv(output_path + 'chunked_returns.csv')
+    for name, summary in forecast_summary.items():
+        summary.to_csv(output_path + f'chunked_forecast_summary_{name}.csv')
+
+    return
+
+
+def execute(index, start_date, end_date, freq='W-Fri', chunk_size=250, validation_steps=12,
+            models=('Benchmark-positive', ), arma_order=(1, 0), store=None, log=print):
+    # Process the universe in blocks of chunk_size tickers, blocks of a previous (interrupted) run are reused
+    # store: price store with the prices of the universe (see support.price_store)
+    chunks = get_chunks(index, chunk_size)
+    run_key = hash_key('chunked', sorted(set(index)), start_date, end_date, freq, chunk_size, validation_steps,
+                       list(models), arma_order, None if isinstance(store, type(None)) else store.path)
+    run_path = get_run_path(run_key)
+
+    chunk_paths = []
+    for i, chunk_index in enumerate(chunks):
+        file_path = run_path + f'chunk_{i:05d}.pkl'
+        chunk_paths.append(file_path)
+        if os.path.exists(file_path):
+            log(f'Chunk {i + 1}/{len(chunks)} found in {run_path}')
+            continue
+
+        log(f'Chunk {i + 1}/{len(chunks)} started ({len(chunk_index)} tickers)...')
+        with span('chunk', tickers=len(chunk_index)):
+            chunk = execute_chunk(chunk_index, start_date, end_date, freq, validation_steps, models, arma_order,
+                                  store)
+        with open(file_path + '.tmp', 'wb') as f:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file_path + '.tmp', file_path)
+
+        # Release the block before the next block
+        del chunk
+        gc.collect()
+
+    stats, returns, forecast_summary = assemble(chunk_paths)
+    load(stats, returns, forecast_summary)
+
+    return stats, returns, forecast_summary
@@ -0,0 +1,149 @@
+""" Library for multi-asset scenarios: Gaussian and Student-t copula simulation of the returns of all time series
+The copula is fitted on the returns of the frequency: the ranks of the returns per time series (pseudo
+observations) are transformed to normal scores, the correlation matrix of the normal scores is the pairwise-complete
+correlation (support.correlation, ragged histories) projected to the nearest positive definite correlation matrix.
+The Cholesky factor of the fit is cached and reused by all simulations of the same returns.
+Marginals: empirical (quantile grid of the returns per time series, linear interpolation) or parametric (normal).
+Joint scenarios are simulated in chunks of paths as array operations (path, step, time series): the memory of a chunk
+is bounded by COPULA_MEMORY_MB, only the portfolio values of the paths (path, step) are kept for the quantile fans.
+Every chunk has its own random generator (spawned from the seed), the scenarios do not depend on the chunk size.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri, stdtr
+
+import support.result_writer as result_writer
+from support.caching import hash_key, MemoryCache
+from support.correlation import get_pairwise, MIN_PAIRS
+from support.tracing import span
+
+COPULA = os.environ.get('COPULA', 't')  # 'gaussian' or 't'
+COPULA_DF = float(os.environ.get('COPULA_DF', 5))  # degrees of freedom of the Student-t copula
+MARGINALS = os.environ.get('COPULA_MARGINALS', 'empirical')  # 'empirical' or 'normal'
+N_PATHS = int(os.environ.get('COPULA_PATHS', 10000))
+HORIZON = int(os.environ.get('COPULA_HORIZON', 12))  # steps at the frequency of the data
+SEED = int(os.environ.get('COPULA_SEED', 0))
+MEMORY_MB = float(os.environ.get('COPULA_MEMORY_MB', 64))  # memory of the simulated arrays of a chunk
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+GRID = 201  # points of the quantile grid of the empirical marginals
+MIN_EIGENVALUE = 1e-6
+
+# Fitted copulas by content hash of the returns (per process)
+fit_cache = MemoryCache(maxsize=8)
+
+
+def get_pseudo_observations(values):
+    # Ranks / (n + 1) per column of values (date, time series), nan if the return is missing
+    valid = ~np.isnan(values)
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, np.argsort(values, axis=0), np.arange(1, values.shape[0] + 1)[:, None], axis=0)
+    return np.where(valid, ranks / (valid.sum(axis=0) + 1), np.nan)
+
+
+def get_nearest_correlation(corr):
+    # Positive definite correlation matrix: missing pairs are uncorrelated, eigenvalues are clipped
+    corr = np.where(np.isnan(corr), 0, corr)
+    np.fill_diagonal(corr, 1)
+    w, v = np.linalg.eigh(corr)
+    corr = (v * np.maximum(w, MIN_EIGENVALUE)) @ v.T
+    d = np.sqrt(np.diag(corr))
+    return corr / np.outer(d, d)
+
+
+def fit(values, marginals=MARGINALS):
+    # Copula and marginals of the returns (date, time series): Cholesky factor of the correlation of the normal scores
+    with np.errstate(invalid='ignore'):
+        z = ndtri(get_pseudo_observations(values))
+    _, _, corr = get_pairwise(z)
+    params = {'cholesky': np.linalg.cholesky(get_nearest_correlation(corr)), 'marginals': marginals}
+
+    if marginals == 'empirical':
+        params['quantiles'] = np.nanquantile(values, np.linspace(0, 1, GRID), axis=0)
+    else:
+        params['mean'], params['std'] = np.nanmean(values, axis=0), np.nanstd(values, axis=0, ddof=1)
+
+    return params
+
+
+def get_returns(params, u):
+    # Returns from the uniforms u (..., time series): inverse of the marginal distributions
+    if params['marginals'] == 'empirical':
+        q = params['quantiles']
+        pos = u * (q.shape[0] - 1)
+        i = np.clip(pos.astype(int), 0, q.shape[0] - 2)
+        col = np.arange(q.shape[1])
+        return q[i, col] + (pos - i) * (q[i + 1, col] - q[i, col])
+
+    return params['mean'] + params['std'] * ndtri(u)
+
+
+def simulate_chunk(params, seed, n_paths, horizon, weights, copula=COPULA, df=COPULA_DF):
+    # Portfolio values (path, step) of a chunk of joint scenarios, start value 100, rebalanced to weights every step
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal((n_paths, horizon, len(weights))) @ params['cholesky'].T
+    if copula == 't':
+        z /= np.sqrt(rng.chisquare(df, (n_paths, horizon, 1)) / df)
+        u = stdtr(df, z)
+    else:
+        u = ndtr(z)
+    ret = get_returns(params, u)
+
+    return 100 * np.cumprod(1 + ret @ weights, axis=1)
+
+
+def simulate(params, n_paths=N_PATHS, horizon=HORIZON, weights=None, copula=COPULA, seed=SEED):
+    # Quantiles (quantile, step) of the portfolio values of n_paths scenarios, simulated in chunks of paths
+    n_ts = params['cholesky'].shape[0]
+    weights = np.full(n_ts, 1 / n_ts) if isinstance(weights, type(None)) else np.asarray(weights, dtype=float)
+
+    # Chunks of paths: memory of the normals, uniforms and returns of a chunk
+    chunk_size = max(1, int(MEMORY_MB * 2 ** 20 / (4 * 8 * horizon * n_ts)))
+    sizes = [min(chunk_size, n_paths - i) for i in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    values = np.concatenate([simulate_chunk(params, s, n, horizon, weights, copula) for s, n in zip(seeds, sizes)])
+
+    return np.quantile(values, QUANTILES, axis=0)
+
+
+def get_future_index(index, freq, horizon):
+    # Dates of the next horizon periods of the frequency after the last date of index
+    dates = pd.date_range(index[-1], periods=horizon + 1, freq=freq)
+    return dates[dates > index[-1]][:horizon]
+
+
+def load(fan):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(data_scenarios=fan)
+
+    return
+
+
+def execute(data_ret, freq, horizon=HORIZON, n_paths=N_PATHS, copula=COPULA, marginals=MARGINALS):
+    # Quantile fan of the equal weight portfolio of the time series with at least MIN_PAIRS returns: dataframe with
+    # dimensions date x quantile (value 100 at the last date) and the portfolio value of the history (last value 100)
+    data_ret = data_ret.loc[:, data_ret.notna().sum() >= MIN_PAIRS]
+    if data_ret.shape[1] == 0:
+        return None
+    attributes = {'tickers': data_ret.shape[1], 'rows': data_ret.shape[0]}
+
+    key = hash_key('copula', data_ret, marginals)
+    params = fit_cache.get(key)
+    if isinstance(params, type(None)):
+        with span('copula.fit', **attributes):
+            params = fit_cache.put(key, fit(data_ret.values.astype(float), marginals))
+    with span('copula.simulate', paths=n_paths, steps=horizon, **attributes):
+        quantiles = simulate(params, n_paths, horizon, copula=copula)
+
+    index = get_future_index(data_ret.index, freq, horizon)
+    fan = pd.DataFrame(quantiles.T[:len(index)], index=index, columns=[f'{q:.0%}' for q in QUANTILES])
+    fan = pd.concat([pd.DataFrame(100.0, index=data_ret.index[-1:], columns=fan.columns), fan])
+
+    # History: equal weight portfolio of the same time series (rebalanced every period)
+    history = (1 + data_ret.iloc[-3 * horizon:, ].mean(axis=1).fillna(0)).cumprod()
+    history = history / history.iloc[-1] * 100
+    load(fan)
+
+    return {'fan': fan, 'history': history}
@@ -0,0 +1,111 @@
+""" Library for cross-asset statistics: correlation and covariance matrices of large universes
+Pairwise-complete statistics (per pair of time series the dates on which both have a return, ragged histories) from
+matrix products of the zero-filled returns and their valid masks, computed in blocks of columns: the temporary
+arrays are block x time series instead of time series x time series per statistic. The shrinkage covariance is the
+Ledoit-Wolf combination of the sample covariance and a scaled identity, the order of the time series for the heatmap
+follows from a hierarchical clustering of the correlation distance.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import support.result_writer as result_writer
+from support.tracing import span
+
+BLOCK_SIZE = int(os.environ.get('CORRELATION_BLOCK_SIZE', 256))  # columns per block
+MIN_PAIRS = 20  # minimum number of dates of a pair
+
+
+def get_pairwise(values, block_size=BLOCK_SIZE):
+    # Pairwise-complete number of dates, covariance and correlation of the columns of values (date, time series)
+    valid = ~np.isnan(values)
+    m = valid.astype(float)
+    x = np.where(valid, values, 0)
+    x2 = x ** 2
+    n_ts = values.shape[1]
+    n, cov, corr = np.empty((n_ts, n_ts)), np.empty((n_ts, n_ts)), np.empty((n_ts, n_ts))
+
+    for start in range(0, n_ts, block_size):
+        b = slice(start, start + block_size)
+        # Sums over the common dates of the pairs (block columns i, all columns j)
+        n_b = m[:, b].T @ m
+        sx, sy = x[:, b].T @ m, m[:, b].T @ x
+        sxx, syy = x2[:, b].T @ m, m[:, b].T @ x2
+        sxy = x[:, b].T @ x
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov_b = (sxy - sx * sy / n_b) / (n_b - 1)
+            var_x, var_y = (sxx - sx ** 2 / n_b) / (n_b - 1), (syy - sy ** 2 / n_b) / (n_b - 1)
+            corr_b = cov_b / np.sqrt(var_x * var_y)
+        few = n_b < MIN_PAIRS
+        n[b], cov[b], corr[b] = n_b, np.where(few, np.nan, cov_b), np.where(few, np.nan, np.clip(corr_b, -1, 1))
+
+    return n, cov, corr
+
+
+def get_shrinkage(values, n, cov, block_size=BLOCK_SIZE):
+    # Ledoit-Wolf shrinkage of the covariance towards mu * I (mu: mean variance), returns the shrinkage covariance
+    # and the shrinkage intensity. The dispersion of the outer products is estimated per pair (common dates)
+    valid = ~np.isnan(values)
+    y = np.where(valid, values - np.nanmean(values, axis=0), 0)
+    y2 = y ** 2
+    n_ts = values.shape[1]
+    s = np.where(np.isnan(cov), 0, cov)
+    mu = np.nanmean(np.diag(cov))
+
+    # Sum over the pairs of the variance of the outer products y_i * y_j, divided by the number of dates
+    b2 = 0
+    for start in range(0, n_ts, block_size):
+        b = slice(start, start + block_size)
+        n_b = n[b]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pi = (y2[:, b].T @ y2 - 2 * s[b] * (y[:, b].T @ y) + n_b * s[b] ** 2) / n_b
+            b2 += np.nansum(np.where(n_b >= MIN_PAIRS, pi / n_b, 0))
+    b2 /= n_ts
+    d2 = ((s - mu * np.eye(n_ts)) ** 2).sum() / n_ts
+    shrinkage = min(b2, d2) / d2 if d2 > 0 else 1.0
+
+    return shrinkage * mu * np.eye(n_ts) + (1 - shrinkage) * s, shrinkage
+
+
+def get_order(corr):
+    # Order of the time series: leaves of the hierarchical clustering (average linkage) of d = sqrt((1 - corr) / 2)
+    from scipy.cluster.hierarchy import linkage, leaves_list
+    from scipy.spatial.distance import squareform
+
+    if corr.shape[0] < 3:
+        return np.arange(corr.shape[0])
+    dist = np.sqrt(np.clip((1 - np.where(np.isnan(corr), 0, corr)) / 2, 0, 1))
+    np.fill_diagonal(dist, 0)
+    return leaves_list(linkage(squareform(dist, checks=False), method='average', optimal_ordering=True))
+
+
+def load(corr, cov_shrunk):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(data_correlation=corr, data_covariance_shrinkage=cov_shrunk)
+
+    return
+
+
+def execute(data_ret):
+    # Correlation, covariance and shrinkage covariance of the returns (date x time series) in the order of the
+    # hierarchical clustering
+    values = data_ret.values.astype(float)
+    attributes = {'tickers': data_ret.shape[1], 'rows': data_ret.shape[0]}
+    with span('correlation.pairwise', **attributes):
+        n, cov, corr = get_pairwise(values)
+    with span('correlation.shrinkage', **attributes):
+        cov_shrunk, shrinkage = get_shrinkage(values, n, cov)
+    with span('correlation.clustering', **attributes):
+        order = get_order(corr)
+
+    columns = data_ret.columns[order]
+    results = {'correlation': pd.DataFrame(corr, index=data_ret.columns, columns=data_ret.columns),
+               'covariance': pd.DataFrame(cov, index=data_ret.columns, columns=data_ret.columns),
+               'covariance_shrinkage': pd.DataFrame(cov_shrunk, index=data_ret.columns, columns=data_ret.columns)}
+    results = {k: v.loc[columns, columns] for k, v in results.items()}
+    results['shrinkage'] = shrinkage
+    load(results['correlation'], results['covariance_shrinkage'])
+
+    return results
@@ -1,21 +1,29 @@
 # Import dash libraries
+import dash
+import dash_html_components as html
 from dash.dependencies import Input, Output, State
 
 # Import app
 from app import app
 
 # Import libraries
+import time
+import numpy as np
 import pandas as pd
-from collections import OrderedDict
 from datetime import datetime
 
 # import user libraries
+import support.caching as caching
 import support.data_processing as data_proc
-import support.data_exploration as data_expl
 import support.dash_processing as dash_proc
-import support.model_arima as model_arima
-import support.model_benchmark as model_benchmark
-import support.model_prophet as model_prophet
+import support.live_feed as live_feed
+import support.memory_budget as memory_budget
+import support.pipeline as pipeline
+import support.portfolio_backtest as portfolio_backtest
+import support.rolling_analytics as rolling_analytics
+import support.strategy_metrics as strategy_metrics
+import support.tracing as tracing
+from support.walk_forward import get_validation_steps
 
 pd.options.mode.chained_assignment = None
 
@@ -27,7 +35,8 @@ See https://dash.plotly.com/basic-callbacks
 # Callback: Gather data from Yahoo Finance
 @app.callback(
     [Output('intermediate-value', 'children'),
-     Output(component_id='output-loading', component_property='children')
+     Output(component_id='output-loading', component_property='children'),
+     Output('session-request', 'data')
      ],
     [Input('button-update_data', 'n_clicks'),  # Only update on click
      State(component_id='input1', component_property='value'),
@@ -38,31 +47,35 @@ See https://dash.plotly.com/basic-callbacks
      State(component_id='input6', component_property='value'),
      State('my-date-picker-range', 'start_date'),
      State('my-date-picker-range', 'end_date'),
-     State('radioitems-input_market', 'value')])
-def get_data(n_clicks, input1, input2, input3, input4, input5, input6, start_date, end_date, market_indices):
+     State('radioitems-input_market', 'value'),
+     State('session-request', 'data')])  # previous request of the session: incremental update
+@tracing.traced('get_data')
+def get_data(n_clicks, input1, input2, input3, input4, input5, input6, start_date, end_date, market_indices,
+             session_request):
     # Initialise
     index_list = [input1, input2, input3, input4, input5, input6]
 
-    # Market indices: AEX, DAX, STOXX, S&P, Dow Jones, Nikkei, Shanghai
-    index_market = ['^AEX', '^GDAXI', '^STOXX', '^GSPC', '^DJI']
+    # Market indices: AEX, DAX, STOXX, S&P, Dow Jones
     if market_indices:
-        index_list += index_market
+        index_list += pipeline.INDEX_MARKET
 
     # Remove empty and duplicates
-    index_list = list(dict.fromkeys(index_list))
-    index_list = [i for i in index_list if i != '']
+    index_list = pipeline.normalize_index_list(index_list)
 
     #  Debug print
     print(f"Data update clicked {n_clicks} times.")
     print(index_list)
 
-    # Load data
+    # Load data (identical concurrent requests share one download), dumped to json
     start_date = datetime.strptime(start_date[:10], "%Y-%m-%d")
     end_date = datetime.strptime(end_date[:10], "%Y-%m-%d")
-    data = data_proc.execute(index=index_list, start_date=start_date, end_date=end_date)
+    try:
+        memory_budget.check_dataset(len(index_list), start_date, end_date)
+    except memory_budget.MemoryBudgetError as e:
+        return dash.no_update, str(e), dash.no_update
+    json_data = pipeline.get_dataset(index_list, start_date, end_date, previous=session_request)
 
-    # dump to json
-    return data.to_json(date_unit='ns'), ''
+    return json_data, '', pipeline.get_session_request(index_list, start_date, end_date)
 
 
 # Callback: Data exploration tables and figures
@@ -72,18 +85,29 @@ def get_data(n_clicks, input1, input2, input3, input4, input5, input6, start_dat
            Output(component_id='output-graph1', component_property='children'),
            Output(component_id='output-graph2', component_property='children'),
            Output(component_id='output-graph3', component_property='children'),
-           Output(component_id='output-graph4', component_property='children')
+           Output(component_id='output-graph4', component_property='children'),
+           Output('live-figures', 'data')
            ],
           [Input('intermediate-value', 'children'),
            State('radioitems-frequency', 'value')])
+@tracing.traced('update_graphs')
 def update_graphs(json_data, freq):
     # Get data and restructure multi index
-    data = pd.read_json(json_data)
-    multi_idx = pd.MultiIndex.from_tuples([eval(i) for i in data.columns], names=['freq', 'type', 'index'])
-    data.columns = multi_idx
+    data = pipeline.read_dataset(json_data)
 
-    # Run data exploration
-    stats, returns = data_expl.execute(data, freq=freq)
+    # Memory budget: coarser frequency if the frequency exceeds the budget
+    n_tickers = data.columns.get_level_values(2).nunique()
+    try:
+        freq_budget = memory_budget.check_exploration(n_tickers, data.shape[0], freq)
+    except memory_budget.MemoryBudgetError as e:
+        return str(e), '', '', '', '', '', None
+    note = None
+    if freq_budget != freq:
+        note = f'Frequency {freq} exceeds the memory budget, the data is shown at frequency {freq_budget}.'
+        freq = freq_budget
+
+    # Run data exploration (statistics of the previous dataset are reused for unchanged tickers)
+    stats, returns = pipeline.get_exploration(data, freq, parent=pipeline.get_parent_dataset(json_data))
     stats.columns = stats.columns.droplevel([0, 1])
 
     # Create tables
@@ -95,70 +119,235 @@ def update_graphs(json_data, freq):
     # stats.loc['count', ] = stats.loc['count', ].astype(int).astype(str)
     table1 = dash_proc.create_dash_table_percentage(stats, scrolling=True)
     table2 = dash_proc.create_dash_table_percentage(returns, scrolling=True)
+    if note:
+        table1 = [html.Div(note), table1]
 
-    graph1 = dash_proc.create_dash_figure(data_level, 'Price')
-    graph2 = dash_proc.create_dash_figure(data_index, 'Index=100')
-    graph3 = dash_proc.create_dash_figure(data_ret, 'Return')
+    graph1 = dash_proc.create_dash_figure(data_level, 'Price', graph_id='graph-price')
+    graph2 = dash_proc.create_dash_figure(data_index, 'Index=100', graph_id='graph-index')
+    graph3 = dash_proc.create_dash_figure(data_ret, 'Return', graph_id='graph-return')
     graph4 = dash_proc.create_dash_density_figure(data_ret, 'Density of returns')
 
-    # Create tables and figures
-    return table1, table2, graph1, graph2, graph3, graph4
+    # Create tables and figures, a new live session starts from the data of the figures
+    return table1, table2, graph1, graph2, graph3, graph4, {'freq': freq, 'created': time.time()}
+
+
+# Callback: Rolling analytics (frequency of the data exploration figures)
+@app.callback(
+          [Output(component_id='output-graph_rolling1', component_property='children'),
+           Output(component_id='output-graph_rolling2', component_property='children'),
+           Output(component_id='output-graph_rolling3', component_property='children'),
+           Output(component_id='output-graph_rolling4', component_property='children')
+           ],
+          [Input('live-figures', 'data'),
+           Input('input11', 'value'),
+           Input('input12', 'value'),
+           State('intermediate-value', 'children')])
+@tracing.traced('update_rolling')
+def update_rolling(live_figures, window, market, json_data):
+    if not json_data or not live_figures:
+        return '', '', '', ''
+    elif not window or window < 2:
+        return 'The rolling window requires at least 2 periods.', '', '', ''
+
+    # Rolling analytics: new dates of an updated dataset are streamed (see support.rolling_analytics)
+    data = pipeline.read_dataset(json_data)
+    market = (market or '').strip().upper()
+    results = rolling_analytics.execute(data, live_figures['freq'], int(window), market)
+
+    graph1 = dash_proc.create_dash_figure(results['volatility'], f'Rolling volatility ({window} periods, annualised)')
+    graph2 = dash_proc.create_dash_figure(results['sharpe_ratio'], f'Rolling Sharpe ratio ({window} periods)')
+    if market in data.columns.get_level_values(2):
+        graph3 = dash_proc.create_dash_figure(results['beta'], f'Rolling beta to {market} ({window} periods)')
+    else:
+        graph3 = f'Market index {market} is not in the data: enter one of the tickers for the rolling beta.'
+    graph4 = dash_proc.create_dash_figure(results['drawdown'], f'Rolling drawdown ({window} periods)')
+
+    return graph1, graph2, graph3, graph4
+
+
+# Callback: Correlation heatmap (frequency of the data exploration figures)
+@app.callback(
+          Output(component_id='output-graph_correlation', component_property='children'),
+          [Input('live-figures', 'data'),
+           Input('radioitems-correlation', 'value'),
+           State('intermediate-value', 'children')])
+@tracing.traced('update_correlation')
+def update_correlation(live_figures, matrix, json_data):
+    if not json_data or not live_figures:
+        return ''
+
+    # Correlation of the returns per dataset and frequency (identical concurrent requests share one computation)
+    data = pipeline.read_dataset(json_data)
+    results = pipeline.get_correlation(data, live_figures['freq'])
+
+    if matrix == 'covariance_shrinkage':
+        cov = results['covariance_shrinkage']
+        std = np.sqrt(np.diag(cov.values))
+        corr = cov / np.outer(std, std)
+        title = f"Correlation of the shrinkage covariance (shrinkage {results['shrinkage']:.0%})"
+    else:
+        corr = results['correlation']
+        title = 'Correlation (pairwise-complete, ordered by hierarchical clustering)'
+
+    return dash_proc.create_dash_heatmap_figure(corr, title)
+
+
+# Callback: Live mode on/off
+@app.callback(
+    Output('interval-live', 'disabled'),
+    [Input('radioitems-live', 'value')])
+def toggle_live(live):
+    return not live
+
+
+# Callback: Live mode, new prices of the feed are appended to the figures (see support.live_feed)
+@app.callback(
+          [Output('graph-price', 'extendData'),
+           Output('graph-index', 'extendData'),
+           Output('graph-return', 'extendData'),
+           Output(component_id='output-live', component_property='children'),
+           Output('live-state', 'data')
+           ],
+          [Input('interval-live', 'n_intervals'),
+           State('intermediate-value', 'children'),
+           State('live-figures', 'data'),
+           State('live-state', 'data')])
+@tracing.traced('update_live')
+def update_live(n_intervals, json_data, live_figures, live_state):
+    # Only after the figures of a dataset are created
+    if not json_data or not live_figures:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+    # Live session of the figures: a new session for new figures, shared by the workers via the disk cache
+    if not live_state or live_state['created'] != live_figures['created']:
+        live_state = dict(live_figures, key=caching.hash_key('live', json_data, live_figures))
+
+    # Poll the feed: new periods of the frequency (no update if another worker is polling the session)
+    session, data_level, data_ret = live_feed.poll_session(live_state['key'], lambda: pipeline.read_dataset(json_data),
+                                                           live_state['freq'])
+    if isinstance(session, type(None)):
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, live_state
+
+    summary = live_feed.get_summary(session)
+    summary = dash_proc.dataframe_formatting(summary, {'price': "{:.2f}", 'count': "{:.0f}"})
+    table = [html.Div(f"Last update: {session['last_date'].strftime('%Y-%m-%d')}, forecast: local level model"),
+             dash_proc.create_dash_table_percentage(summary)]
+
+    # Only points after the last point of the figures
+    if not isinstance(data_level, type(None)) and live_state.get('last_date'):
+        data_level = data_level.loc[data_level.index > live_state['last_date']]
+        data_ret = data_ret.loc[data_ret.index > live_state['last_date']]
+    if isinstance(data_level, type(None)) or data_level.empty:
+        return dash.no_update, dash.no_update, dash.no_update, table, live_state
+    live_state['last_date'] = data_level.index[-1].strftime('%Y-%m-%d')
+
+    return live_feed.get_extend_data(data_level), live_feed.get_extend_data(data_level, session['first_level']), \
+        live_feed.get_extend_data(data_ret), table, live_state
 
 
 # Callback: Train model and forecast
 @app.callback(
           [Output(component_id='output-results_forecast', component_property='children'),
-           Output(component_id='output-graph_forecast', component_property='children')],
+           Output(component_id='output-graph_forecast', component_property='children'),
+           Output(component_id='output-results_strategy', component_property='children'),
+           Output(component_id='output-results_portfolio', component_property='children')],
           [Input('button-forecast', 'n_clicks'),  # Only update on click
            State('intermediate-value', 'children'),
            State('radioitems-frequency', 'value'),
            State('checklist-models', 'value'),
            State('input7', 'value'),
            State('input8', 'value'),
-           State('input9', 'value')])
-def train_forecast_model(n_clicks, json_data, freq, models, arma_p, arma_q, val_steps):
+           State('input9', 'value'),
+           State('radioitems-window', 'value'),
+           State('input10', 'value'),
+           State('input13', 'value')])
+@tracing.traced('train_forecast_model')
+def train_forecast_model(n_clicks, json_data, freq, models, arma_p, arma_q, val_steps, window_mode, window, cost):
+    # Time budget: validation steps that are not started before the deadline are not evaluated
+    budget = pipeline.FORECAST_TIME_BUDGET
+    deadline = time.monotonic() + budget if budget > 0 else None
+
     #  Debug print
     print(f"Forecast clicked {n_clicks} times.")
     print(models)
 
     if not n_clicks:
-        return 'Forecast not started yet.', ''
+        return 'Forecast not started yet.', '', '', ''
     elif not models:
-        return 'Select at least one forecast model.', ''
+        return 'Select at least one forecast model.', '', '', ''
+    elif window_mode == 'rolling' and (not window or window < 10):
+        return 'The rolling training window requires at least 10 observations.', '', '', ''
     else:
         # Get data and restructure multi index
-        data = pd.read_json(json_data)
-        multi_idx = pd.MultiIndex.from_tuples([eval(i) for i in data.columns], names=['freq', 'type', 'index'])
-        data.columns = multi_idx
-
-        # get returns
-        data_ret = data_proc.get_data_slice(data, freq, 'return')
-
-        # Loop over models
-        dict_fc_summary, dict_fc_res = OrderedDict(), OrderedDict()
-        for model in models:
-            if model == 'Benchmark-positive':
-                dict_fc_summary[model], dict_fc_res[model] = model_benchmark.execute(data_ret, val_steps, True)
-            elif model == 'Benchmark-negative':
-                dict_fc_summary[model], dict_fc_res[model] = model_benchmark.execute(data_ret, val_steps, False)
-            elif model == 'ARMA':
-                model = f'ARMA({arma_p},{arma_q})'
-                arima_order = (arma_p, 0, arma_q)
-                dict_fc_summary[model], dict_fc_res[model] = model_arima.execute(data_ret, val_steps, arima_order)
-            elif model == 'Prophet':
-                dict_fc_summary[model], dict_fc_res[model] = model_prophet.execute(data_ret, val_steps)
+        data = pipeline.read_dataset(json_data)
+
+        # Memory budget: forecasts in chunks of tickers if all tickers exceed the budget (not for pooled models)
+        n_tickers = data.columns.get_level_values(2).nunique()
+        try:
+            pooled = pipeline.get_pooled_models(models, arma_p, arma_q)
+            chunk_size = memory_budget.check_forecast(n_tickers, data.shape[0], freq, len(models), pooled)
+        except memory_budget.MemoryBudgetError as e:
+            return str(e), '', '', ''
+
+        # Train models (identical concurrent requests share one computation)
+        parent = pipeline.get_parent_dataset(json_data)
+        window = int(window) if window_mode == 'rolling' else None
+        dict_fc_summary, dict_fc_res = pipeline.get_forecasts(data, freq, models, arma_p, arma_q, val_steps,
+                                                              parent=parent, chunk_size=chunk_size, window=window,
+                                                              deadline=deadline)
+
+        # Partial results: validation steps evaluated within the time budget
+        steps = get_validation_steps(data_proc.get_data_slice(data, freq, 'return'), val_steps)
+        partial = [f"{k}: {v.loc['validation_steps'].min():.0f} of {steps}" for k, v in dict_fc_summary.items()
+                   if (v.loc['validation_steps'] < steps).any()]
+
+        # Significance of accuracy and payout: permutation p-values and block bootstrap confidence bands
+        dict_significance = pipeline.get_significance(dict_fc_res)
+        for k, v in dict_fc_summary.items():
+            dict_fc_summary[k] = pd.concat([v, dict_significance[k].reindex(columns=v.columns)])
 
         # Forecast results summary
-        dict_fm = {'invest': "{}", 'accuracy': "{:.1%}", 'payout_from_100': "\u20ac {:.2f}"}
+        dict_fm = {'invest': "{}", 'accuracy': "{:.1%}", 'payout_from_100': "\u20ac {:.2f}",
+                   'accuracy_p_value': "{:.3f}", 'accuracy_ci_lower': "{:.1%}", 'accuracy_ci_upper': "{:.1%}",
+                   'payout_from_100_p_value': "{:.3f}", 'payout_from_100_ci_lower': "\u20ac {:.2f}",
+                   'payout_from_100_ci_upper': "\u20ac {:.2f}"}
         for k, v in dict_fc_summary.items():
             v = v.drop('validation_steps')
             dict_fc_summary[k] = dash_proc.dataframe_formatting(v, dict_fm)
         df_forecast_all = pd.concat(dict_fc_summary).reset_index(level=1).rename({'level_1': 'metric'}, axis=1)
 
         table1 = dash_proc.create_dash_table_percentage(df_forecast_all, scrolling=True)
+        if partial:
+            note = 'Time budget reached, validation steps evaluated: ' + ', '.join(partial) + \
+                   '. Forecast again to continue the validation.'
+            table1 = [html.Div(note), table1]
 
         # Forecast figure
         data_level = data_proc.get_data_slice(data, freq, 'level')
         graph1 = dash_proc.create_dash_forecast_figure(dict_fc_res, data_level)
 
-        return table1, graph1
+        # Portfolio scenarios: quantile fan of the equal weight portfolio (copula simulation of the joint returns)
+        scenarios = pipeline.get_scenarios(data, freq)
+        if not isinstance(scenarios, type(None)):
+            graph1 = [graph1, dash_proc.create_dash_fan_figure(scenarios['fan'], scenarios['history'],
+                                                               'Portfolio scenarios (equal weight, index=100)')]
+
+        # Strategy metrics of the trading rules with costs per unit of turnover
+        strategy = strategy_metrics.execute(dict_fc_res, freq, cost=(cost or 0) / 10000)
+        strategy.index = [' '.join(i) for i in strategy.index]
+        strategy = dash_proc.dataframe_formatting(strategy, {i: "{:.2f}" for i in strategy.index
+                                                             if i.endswith(('payout_from_100', 'sharpe_ratio'))})
+        table2 = dash_proc.create_dash_table_percentage(strategy, scrolling=True)
+
+        # Portfolio backtest of the signals of all time series per model and weighting scheme
+        portfolio = portfolio_backtest.execute(dict_fc_res, data_proc.get_data_slice(data, freq, 'return'), freq,
+                                               cost=(cost or 0) / 10000)
+        df_nav, df_metrics = portfolio['nav'], portfolio['metrics']
+        df_nav.columns = df_metrics.columns = [' '.join(i) for i in df_metrics.columns]
+        df_metrics = dash_proc.dataframe_formatting(df_metrics, {'payout_from_100': "\u20ac {:.2f}",
+                                                                 'sharpe_ratio': "{:.2f}"})
+        table3 = [dash_proc.create_dash_table_percentage(df_metrics),
+                  dash_proc.create_dash_figure(df_nav, 'Portfolio net asset value (start 100)',
+                                               graph_id='graph-portfolio')]
+
+        return table1, graph1, table2, table3
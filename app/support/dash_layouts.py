@@ -3,6 +3,8 @@ import dash_core_components as dcc
 import dash_html_components as html
 from datetime import datetime
 
+from support.live_feed import LIVE_INTERVAL
+
 """ Layouts
 See: https://dash-bootstrap-components.opensource.faculty.ai/docs/components/layout/
 """
@@ -44,6 +46,31 @@ button_update = dbc.Button(
 loading_update = dbc.Spinner(
     html.Div(id="output-loading"), color="primary"
 )
+radio_items_live = dbc.RadioItems(
+    options=[
+        {"label": "Off", "value": False},
+        {"label": "On", "value": True},
+    ],
+    value=False,
+    id="radioitems-live",
+    inline=True
+)
+radio_items_correlation = dbc.RadioItems(
+    options=[
+        {"label": "Pairwise-complete", "value": 'correlation'},
+        {"label": "Shrinkage", "value": 'covariance_shrinkage'},
+    ],
+    value='correlation',
+    id="radioitems-correlation",
+    inline=True
+)
+input_rolling = dbc.Row([
+    dbc.Col(dbc.Input(id='input11', value=60, type='number', min=2, max=10000, step=1), width='auto'),
+    dbc.Col(html.Div("Market index:"), width="auto", style={"margin": "10px", "margin-left": "30px"}),
+    dbc.Col(dbc.Input(id='input12', value='^GSPC', type='text'), width='auto')
+], no_gutters=True, align="center"
+)
+interval_live = dcc.Interval(id='interval-live', interval=LIVE_INTERVAL * 1000, disabled=True)
 
 # Model forecasting
 button_forecast = dbc.Button(
@@ -57,7 +84,10 @@ checklist_models = dbc.Checklist(
         {"label": "Benchmark - buy if positive", "value": "Benchmark-positive"},
         {"label": "Benchmark - buy if negative", "value": "Benchmark-negative"},
         {"label": "ARMA(p,q)", "value": "ARMA"},
-        {"label": "Prophet - additive trend/seasonality", "value": "Prophet"}
+        {"label": "Prophet - additive trend/seasonality", "value": "Prophet"},
+        {"label": "XGBoost - pooled gradient boosting", "value": "XGBoost"},
+        {"label": "GARCH(1,1) - volatility", "value": "GARCH"},
+        {"label": "Kalman filter - local level", "value": "Kalman"}
     ],
     id="checklist-models"
     # inline=True
@@ -71,6 +101,22 @@ input_val_steps = dbc.Row([
     dbc.Col(dbc.Input(id='input9', value=12, type='number', min=1, max=1000, step=1), width='auto')
 ], no_gutters=True
 )
+radio_items_window = dbc.RadioItems(
+    options=[
+        {"label": "Expanding", "value": 'expanding'},
+        {"label": "Rolling", "value": 'rolling'},
+    ],
+    value='expanding',
+    id="radioitems-window"
+)
+input_window = dbc.Row([
+    dbc.Col(dbc.Input(id='input10', value=60, type='number', min=10, max=10000, step=1), width='auto')
+], no_gutters=True
+)
+input_cost = dbc.Row([
+    dbc.Col(dbc.Input(id='input13', value=10, type='number', min=0, max=1000, step=0.5), width='auto')
+], no_gutters=True
+)
 
 """ Specify row items """
 # Data input
@@ -122,6 +168,35 @@ row_figures = html.Div([
         dbc.Col(html.Div(id='output-graph4'), width=6)
     ])
 ])
+row_live = dbc.Row([
+    dbc.Col(html.Div("Live mode:"), width=1, style={"margin": "10px"}),
+    dbc.Col(radio_items_live, width="auto", style={"margin": "10px"}),
+    dbc.Col(html.Div(id="output-live"), width=9)
+], no_gutters=False, justify="start", align="center"
+)
+row_rolling = html.Div([
+    dbc.Row([
+        dbc.Col(html.Div("Rolling window:"), width="auto", style={"margin": "10px"}),
+        dbc.Col(input_rolling, width="auto")
+    ], no_gutters=True, justify="start", align="center"),
+    dbc.Row([
+        dbc.Col(html.Div(id='output-graph_rolling1'), width=6),
+        dbc.Col(html.Div(id='output-graph_rolling2'), width=6),
+    ]),
+    dbc.Row([
+        dbc.Col(html.Div(id='output-graph_rolling3'), width=6),
+        dbc.Col(html.Div(id='output-graph_rolling4'), width=6)
+    ])
+])
+row_correlation = html.Div([
+    dbc.Row([
+        dbc.Col(html.Div("Correlation:"), width="auto", style={"margin": "10px"}),
+        dbc.Col(radio_items_correlation, width="auto", style={"margin": "10px"})
+    ], no_gutters=True, justify="start", align="center"),
+    dbc.Row([
+        dbc.Col(html.Div(id='output-graph_correlation'), width=12)
+    ])
+])
 row_tables = html.Div([
     dbc.Row([
         dbc.Col(html.Div("Summary returns: "), width=1, style={"margin": "10px"}),
@@ -137,11 +212,18 @@ row_tables = html.Div([
 row_forecast_settings = dbc.Row([
     dbc.Col(html.Div("Steps for validation:"), width="auto", style={"margin": "10px"}, align="top"),
     dbc.Col(input_val_steps, width="auto", align="top"),
+    dbc.Col(html.Div("Training window:"), width="auto", style={"textAlign": "right", "margin": "10px",
+                                                               "margin-left": "60px"}),
+    dbc.Col(radio_items_window, width="auto", style={"margin": "10px"}),
+    dbc.Col(input_window, width="auto", align="top"),
     dbc.Col(html.Div("Models:"), width="auto", style={"textAlign": "right", "margin": "10px", "margin-left": "60px"}),
     dbc.Col(checklist_models, width="auto", style={"margin": "10px"}),
     dbc.Col(html.Div("(p,q)="), width="auto", style={"textAlign": "right", "margin": "10px", "margin-bottom": "30px"},
             align="end"),
     dbc.Col(input_arma, width="auto", style={"margin-bottom": "20px"}, align="end"),
+    dbc.Col(html.Div("Costs (bp):"), width="auto", style={"textAlign": "right", "margin": "10px",
+                                                          "margin-left": "60px"}),
+    dbc.Col(input_cost, width="auto", align="top"),
 ],
     no_gutters=True, justify="start", align="center"
 )
@@ -155,6 +237,16 @@ row_forecast_tables = dbc.Row([
     dbc.Col(results_forecast, width=10, style={"margin": "10px"})
 ], no_gutters=False, justify="start",
 )
+row_strategy_tables = dbc.Row([
+    dbc.Col(html.Div("Strategy metrics: "), width=1, style={"margin": "10px"}),
+    dbc.Col(html.Div(id="output-results_strategy"), width=10, style={"margin": "10px"})
+], no_gutters=False, justify="start",
+)
+row_portfolio_tables = dbc.Row([
+    dbc.Col(html.Div("Portfolio backtest: "), width=1, style={"margin": "10px"}),
+    dbc.Col(html.Div(id="output-results_portfolio"), width=10, style={"margin": "10px"})
+], no_gutters=False, justify="start",
+)
 row_forecast_figures = html.Div([
     dbc.Row([
         dbc.Col(html.Div(id='output-graph_forecast'), width=12)
@@ -203,15 +295,26 @@ start_layout = html.Div(children=[
 
     row_subtitle('Data exploration'),
     row_figures,
+    row_live,
     row_tables,
+    row_rolling,
+    row_correlation,
     row_line,
 
     row_subtitle('Model forecasting'),
     row_forecast_settings,
     row_update_forecast,
     row_forecast_tables,
+    row_strategy_tables,
+    row_portfolio_tables,
     row_forecast_figures,
 
     # Hidden div inside the app that stores the intermediate value
-    html.Div(id='intermediate-value', style={'display': 'none'})
+    html.Div(id='intermediate-value', style={'display': 'none'}),
+    # Previous data request of the session (incremental data updates)
+    dcc.Store(id='session-request', storage_type='session'),
+    # Live mode: poll interval, figures of the data exploration and live session (see support.live_feed)
+    interval_live,
+    dcc.Store(id='live-figures'),
+    dcc.Store(id='live-state')
 ])
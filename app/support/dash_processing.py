@@ -3,12 +3,21 @@
 Process data to Dash figures and tables
 
 """
+import json
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
 import dash_table as dt
 import dash_table.FormatTemplate as FormatTemplate
 from dash_table.Format import Sign
 import dash_core_components as dcc
-import plotly.figure_factory as ff
-from plotly.subplots import make_subplots
+from plotly.utils import PlotlyJSONEncoder
+
+from support.caching import hash_key, MemoryCache
+from support.tracing import span
+
+# Figures as plain lists and dicts by content hash (per process)
+figure_cache = MemoryCache(maxsize=128)
 
 
 def create_dash_table(df):
@@ -39,7 +48,68 @@ def create_dash_table_percentage(df, scrolling=False):
         return dt.DataTable(data=data_dash, columns=columns)
 
 
-def create_dash_figure(df, title):
+def json_default(obj):
+    # Fast JSON encoding of numpy arrays, pandas objects and timestamps (non-finite values are encoded as null)
+    if isinstance(obj, (pd.Series, pd.Index)):
+        obj = obj.values
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'M':
+            return np.where(np.isnat(obj), None, np.datetime_as_string(obj, unit='s')).tolist()
+        if obj.dtype.kind == 'f':
+            return np.where(np.isfinite(obj), obj, None).tolist()
+        if obj.dtype.kind in 'biu':
+            return obj.tolist()
+        return [None if (isinstance(x, float) and not np.isfinite(x)) else
+                x if isinstance(x, (str, bool, int, float, type(None))) else json_default(x)
+                for x in obj.tolist()]
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, np.datetime64):
+        return None if np.isnat(obj) else np.datetime_as_string(obj, unit='s')
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, 'to_plotly_json'):
+        return obj.to_plotly_json()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def fast_json_dumps(obj):
+    # Serialize a (plotly) figure with the fast encoder
+    if hasattr(obj, 'to_plotly_json'):
+        obj = obj.to_plotly_json()
+    try:
+        return json.dumps(obj, default=json_default, allow_nan=False, separators=(',', ':'))
+    except ValueError:
+        # Non-finite scalar outside of an array: fall back on the plotly encoder
+        return json.dumps(obj, cls=PlotlyJSONEncoder)
+
+
+def get_cached_figure(func_figure, *argv):
+    # Figure as plain lists and dicts from cache, the figure is only build and converted if the content hash is
+    # unknown. The cached figure is shared between requests and must not be modified
+    key = hash_key(func_figure.__name__, *argv)
+    figure = figure_cache.get(key)
+    if figure is None:
+        with span('figure.build', figure=func_figure.__name__):
+            fig = func_figure(*argv)
+        with span('figure.serialize', figure=func_figure.__name__):
+            figure = figure_cache.put(key, json.loads(fast_json_dumps(fig)))
+    return figure
+
+
+def create_cached_graph(func_figure, *argv, graph_id='example-graph'):
+    # Dash graph from a cached figure: Dash only encodes plain lists and dicts (no plotly objects, numpy arrays or
+    # timestamps), the figure is not converted per request
+    graph = dcc.Graph(
+              id=graph_id,
+              figure=get_cached_figure(func_figure, *argv)
+              )
+    return graph
+
+
+def get_figure(df, title):
     def get_plot_format(df):
         list_plot = []
 
@@ -48,17 +118,17 @@ def create_dash_figure(df, title):
             list_plot.append(dic)
         return list_plot
 
-    graph = dcc.Graph(
-              id='example-graph',
-              figure={'data': get_plot_format(df),
-                      'layout': {'title': title}
-                      }
-              )
-    return graph
+    return {'data': get_plot_format(df), 'layout': {'title': title}}
 
 
-def create_dash_forecast_figure(dict_fc_res, df_level):
+def create_dash_figure(df, title, graph_id='example-graph'):
+    # graph_id: id of the graph for callbacks (live updates with extendData, see support.live_feed)
+    return create_cached_graph(get_figure, df, title, graph_id=graph_id)
+
+
+def get_forecast_figure(dict_fc_res, df_level):
     # Create forecast plots
+    from plotly.subplots import make_subplots
 
     # Initialise
     n_cols = len(dict_fc_res)  # number of models
@@ -111,25 +181,64 @@ def create_dash_forecast_figure(dict_fc_res, df_level):
     # fig.update_yaxes({'tickformat': ',.0%'})
     fig.update_layout(height=n_rows * 400, title_text="Price forecasts")
 
-    graph = dcc.Graph(
-              id='example-graph',
-              figure=fig
-              )
+    return fig
 
-    return graph
 
+def create_dash_forecast_figure(dict_fc_res, df_level):
+    return create_cached_graph(get_forecast_figure, dict_fc_res, df_level)
+
+
+def get_fan_figure(fan, history, title):
+    # Quantile fan (columns: increasing quantiles) after the history, bands between symmetric quantiles
+    n = fan.shape[1]
+    data = [{'x': history.index, 'y': history.values, 'type': 'line', 'name': 'history', 'line': {'color': '#1f77b4'}}]
+    for i in range(n // 2):
+        lower, upper = fan.columns[i], fan.columns[n - 1 - i]
+        color = f'rgba(31, 119, 180, {0.15 * (i + 1):.2f})'
+        data.append({'x': fan.index, 'y': fan[lower], 'type': 'line', 'name': lower, 'showlegend': False,
+                     'line': {'width': 0}})
+        data.append({'x': fan.index, 'y': fan[upper], 'type': 'line', 'name': f'{lower} - {upper}', 'fill': 'tonexty',
+                     'fillcolor': color, 'line': {'width': 0}})
+    if n % 2:
+        median = fan.columns[n // 2]
+        data.append({'x': fan.index, 'y': fan[median], 'type': 'line', 'name': median,
+                     'line': {'color': '#1f77b4', 'dash': 'dot'}})
+
+    return {'data': data, 'layout': {'title': title}}
+
+
+def create_dash_fan_figure(fan, history, title):
+    return create_cached_graph(get_fan_figure, fan, history, title, graph_id='graph-scenarios')
+
+
+def get_heatmap_figure(df, title):
+    # Heatmap of a square matrix (correlation), the first row at the top
+    n = df.shape[0]
+    heatmap = {'type': 'heatmap', 'z': df.values, 'x': list(df.columns), 'y': list(df.index), 'zmin': -1, 'zmax': 1,
+               'colorscale': 'RdBu'}
+    layout = {'title': title, 'yaxis': {'autorange': 'reversed'}, 'height': min(max(400, n * 15), 1200)}
+
+    return {'data': [heatmap], 'layout': layout}
+
+
+def create_dash_heatmap_figure(df, title):
+    return create_cached_graph(get_heatmap_figure, df, title)
+
+
+def get_density_figure(df, title):
+    # Heavy import on first use (fork friendly startup)
+    import plotly.figure_factory as ff
 
-def create_dash_density_figure(df, title):
     hist_data = [df[i].dropna().values for i in df.columns]
     group_labels = list(df.columns)
     fig = ff.create_distplot(hist_data, group_labels, show_hist=False)
     fig.update_layout(title_text=title)
 
-    graph = dcc.Graph(
-              id='example-graph',
-              figure=fig
-              )
-    return graph
+    return fig
+
+
+def create_dash_density_figure(df, title):
+    return create_cached_graph(get_density_figure, df, title)
 
 
 def dataframe_formatting(df, dic_formatting):
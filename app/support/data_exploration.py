@@ -1,32 +1,43 @@
 """ Library for data exploration """
-import os
 import pandas as pd
-import statsmodels.tsa.stattools as tsa
-import statsmodels.api as sm
 from dateutil.relativedelta import relativedelta
 
+import support.result_writer as result_writer
+from support.tracing import span
+
 
 def get_statistics(data):
+    # Heavy imports on first use (fork friendly startup)
+    import statsmodels.tsa.stattools as tsa
+    import statsmodels.api as sm
+
     significance = 0.05
-    stats = data.describe(percentiles=[0.005, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.995])
-    stats.loc['skew', :] = data.skew()
-    stats.loc['kurt', :] = data.kurt()
-    stats.loc['sharpe_ratio', :] = stats.loc['mean', :] / stats.loc['std', :]
+    attributes = {'tickers': data.shape[1], 'rows': data.shape[0]}
+    with span('statistics.describe', **attributes):
+        stats = data.describe(percentiles=[0.005, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.995])
+        stats.loc['skew', :] = data.skew()
+        stats.loc['kurt', :] = data.kurt()
+        stats.loc['sharpe_ratio', :] = stats.loc['mean', :] / stats.loc['std', :]
 
     acf_lags = 4
-    for i in range(1, acf_lags + 1):
-        stats.loc[f'acf_{i}', :] = data.apply(lambda x: tsa.acf(x.dropna(), nlags=i)[-1])
+    with span('statistics.acf', **attributes):
+        for i in range(1, acf_lags + 1):
+            stats.loc[f'acf_{i}', :] = data.apply(lambda x: tsa.acf(x.dropna(), nlags=i)[-1])
 
     # JB test for normality: H_0 = normal
-    stats.loc['normality', :] = data.apply(lambda x: tsa.stats.jarque_bera(x)[1] > significance)
+    with span('statistics.jarque_bera', **attributes):
+        stats.loc['normality', :] = data.apply(lambda x: tsa.stats.jarque_bera(x)[1] > significance)
 
     # LB test for autocorrelation: H_0 = no autocorrelation
-    stats.loc['autocorrelation', :] = data.apply(
-        lambda x: sm.stats.acorr_ljungbox(x.dropna(), lags=acf_lags).iloc[-1, -1] < significance)
+    with span('statistics.ljung_box', **attributes):
+        stats.loc['autocorrelation', :] = data.apply(
+            lambda x: sm.stats.acorr_ljungbox(x.dropna(), lags=acf_lags).iloc[-1, -1] < significance)
 
     # ADF test for stationarity: H_0 = non-stationary (unit root)
-    stats.loc['stationary', :] = data.apply(lambda x: tsa.adfuller(x.dropna(), regression='c')[1] < significance)
-    stats.loc['trend_stationary', :] = data.apply(lambda x: tsa.adfuller(x.dropna(), regression='ct')[1] < significance)
+    with span('statistics.adfuller', **attributes):
+        stats.loc['stationary', :] = data.apply(lambda x: tsa.adfuller(x.dropna(), regression='c')[1] < significance)
+        stats.loc['trend_stationary', :] = data.apply(
+            lambda x: tsa.adfuller(x.dropna(), regression='ct')[1] < significance)
 
     return stats
 
@@ -54,8 +65,11 @@ def get_return_summary(data):
         dict_terms[str(i) + 'Y'] = nearest_date(dates, current_date - relativedelta(years=i))
 
     # Calculate cumulative and annualised return
-    data_tmp = data.loc[:, ('B', 'level', slice(None))]
-    data_tmp.columns = data_tmp.columns.droplevel([0, 1])
+    if isinstance(data, pd.DataFrame):
+        data_tmp = data.loc[:, ('B', 'level', slice(None))]
+        data_tmp.columns = data_tmp.columns.droplevel([0, 1])
+    else:
+        data_tmp = data.get_prices()  # price store view, see support.price_store
     returns = pd.DataFrame(index=dict_terms.keys(), columns=data_tmp.columns)
     for k, v in dict_terms.items():
         returns.loc[k, :] = data_tmp.loc[current_date, ] / data_tmp.loc[v, ] - 1
@@ -67,20 +81,47 @@ def get_return_summary(data):
 
 
 def load(stats, returns):
-    # Save data
-    output_path = os.getcwd() + '/output/'
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-    stats.to_csv(output_path + 'data_statistics.csv')
-    returns.to_csv(output_path + 'data_returns.csv')
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(data_statistics=stats, data_returns=returns)
 
     return
 
 
+def get_data_in(data, freq):
+    if not isinstance(data, pd.DataFrame):
+        # Price store view (see support.price_store): returns with the multi index of the dataset
+        data_in = data.get_data_slice(freq, 'return')
+        data_in.columns = pd.MultiIndex.from_product([[freq], ['return'], data_in.columns],
+                                                     names=['freq', 'type', 'index'])
+        return data_in
+    return data.loc[:, (freq, 'return', slice(None))].dropna(how='all', axis=0).dropna(how='all', axis=1)
+
+
 def execute(data, freq='W-Fri'):
-    data_in = data.loc[:, (freq, 'return', slice(None))].dropna(how='all', axis=0).dropna(how='all', axis=1)
+    data_in = get_data_in(data, freq)
     stats = get_statistics(data_in)
-    returns = get_return_summary(data)
+    with span('statistics.return_summary', tickers=data_in.shape[1], rows=data.shape[0]):
+        returns = get_return_summary(data)
+    load(stats, returns)
+
+    return stats, returns
+
+
+def execute_incremental(data, freq, data_prev, stats_prev):
+    # Incremental version of execute for new tickers: statistics are only calculated for the new tickers
+    # The whole-sample statistics (tests) depend on all dates, a new date range requires the full calculation
+    data_in = get_data_in(data, freq)
+    data_in_prev = get_data_in(data_prev, freq)
+    columns = [ts for ts in data_in.columns if ts not in data_in_prev.columns]
+    if (not data_in.index.equals(data_in_prev.index) or not set(data_in_prev.columns) <= set(data_in.columns) or
+            not data_in.loc[:, data_in_prev.columns].equals(data_in_prev)):
+        return execute(data, freq)
+
+    stats = stats_prev.loc[:, data_in_prev.columns]
+    if columns:
+        stats = pd.concat([stats, get_statistics(data_in.loc[:, columns])], axis=1).loc[:, data_in.columns]
+    with span('statistics.return_summary', tickers=data_in.shape[1], rows=data.shape[0]):
+        returns = get_return_summary(data)
     load(stats, returns)
 
     return stats, returns
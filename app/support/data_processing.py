@@ -1,17 +1,35 @@
 """ Library for data processing """
 import os
-import pandas_datareader.data as web
 from datetime import datetime
+import numpy as np
 import pandas as pd
-import yfinance as yf
 
+import support.result_writer as result_writer
+from support.tracing import span
+
+# Data frequencies, see transform
+FREQ = ['B', 'W-Fri', 'BM', 'BY']
+
+# Data provider: 'yahoo' or 'synthetic' (offline, see support.synthetic_data)
+DATA_PROVIDER = os.environ.get('DATA_PROVIDER', 'yahoo')
 
 
 def extract(indexlist, start, end):
     # Yahoo finance data contains weekday data with some missing values
+    if DATA_PROVIDER == 'synthetic':
+        import support.synthetic_data as synthetic_data
+        return synthetic_data.extract(indexlist, start, end)
+
+    # Heavy imports on first use (fork friendly startup)
+    import pandas_datareader.data as web
+    import yfinance as yf
+
     yf.pdr_override()
     index_download = web.get_data_yahoo(indexlist, start=start, end=end)
     df_prices = index_download['Adj Close']
+    if isinstance(df_prices, pd.Series):
+        # Single ticker download
+        df_prices = df_prices.to_frame(name=indexlist[0])
     df_prices = df_prices.dropna(how='all', axis=0).dropna(how='all', axis=1)
     return df_prices
 
@@ -21,7 +39,7 @@ def transform(data, freq='D'):
     # See https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases
     # freq: B=business day frequency, W-Fri=weekly frequency Friday,
     # BM=business month end frequency, BY=business year frequency
-    freq = ['B', 'W-Fri', 'BM', 'BY']
+    freq = FREQ
 
     # Specify frequency as 'business day frequency' and add missing dates
     data = data.groupby(pd.Grouper(freq='B')).last()
@@ -29,36 +47,121 @@ def transform(data, freq='D'):
     # Replace missing value with preceding value
     data = data.fillna(method='ffill')
 
-    # Create output dataframe
+    # Create output dataframe (float: an empty dataframe has object values of several times the memory)
     multi_idx = pd.MultiIndex.from_product([freq, ('level', 'return'), data.columns], names=['freq', 'type', 'index'])
-    data_out = pd.DataFrame(index=data.index, columns=multi_idx)
+    data_out = pd.DataFrame(np.nan, index=data.index, columns=multi_idx)
 
     # Loop over frequency
     for f in freq:
-        data_tmp = data.groupby(pd.Grouper(freq=f)).last()
-        # Drop last row if current date is not equal to the last business date
-        if data.index[-1] != data_tmp.index[-1]:
-            data_tmp = data_tmp.iloc[:-1, ]
-
+        data_tmp = resample(data, f)
         data_out.loc[data_tmp.index, (f, 'level', slice(None))] = data_tmp.values
         data_out.loc[data_tmp.index, (f, 'return', slice(None))] = data_tmp.pct_change().values
 
-    data_out = data_out.astype(float)
+    return data_out
+
+
+def resample(data, f):
+    # Last value per period of frequency f from the business day grid
+    data_tmp = data.groupby(pd.Grouper(freq=f)).last()
+    # Drop last row if current date is not equal to the last business date
+    if data.index[-1] != data_tmp.index[-1]:
+        data_tmp = data_tmp.iloc[:-1, ]
+    return data_tmp
+
+
+def transform_append_rows(data, data_new, revise_last=False):
+    # Incremental transform: append new prices (from the last date of the transformed data onwards)
+    # The output is identical to the transform of all prices, returns None if the prices of the last date were
+    # revised (e.g. dividend adjustment of historic prices) or if new tickers appear
+    # revise_last: the prices of the last date may change (live prices of the current day, see support.live_feed)
+    grid = data.loc[:, ('B', 'level', slice(None))]
+    grid.columns = grid.columns.droplevel([0, 1])
+    last_date = grid.index[-1]
+
+    if data_new.empty or not set(data_new.columns) <= set(grid.columns):
+        return None
+    data_new = data_new.reindex(columns=grid.columns)
+
+    # Check the prices of the last business day (overlap with the new prices)
+    overlap = data_new.loc[data_new.index < last_date + pd.offsets.BDay(1)]
+    if overlap.empty:
+        return None
+    overlap_last = overlap.fillna(method='ffill').iloc[-1]
+    check = overlap_last.notna()
+    if not revise_last and not (overlap_last[check] == grid.loc[last_date, check]).all():
+        return None
+
+    # Business day grid: the last business day is replaced by the new prices, historic rows are already filled
+    grid = pd.concat([grid.iloc[:-1, ], data_new]).groupby(pd.Grouper(freq='B')).last()
+    grid = grid.fillna(method='ffill')
+
+    data_out = data.reindex(grid.index)
+    for f in FREQ:
+        # Periods up to the last complete period before the last date are unchanged
+        idx_f = data.loc[:, (f, 'level', slice(None))].dropna(how='all').index
+        idx_f = idx_f[idx_f < last_date]
+        grid_tail = grid.loc[grid.index > idx_f[-1]] if len(idx_f) else grid
+
+        data_tmp = resample(grid_tail, f)
+
+        # Returns relative to the last unchanged period
+        if len(idx_f):
+            level_prev = pd.DataFrame([data.loc[idx_f[-1], (f, 'level', slice(None))].values], index=idx_f[-1:],
+                                      columns=grid.columns)
+            data_ret = pd.concat([level_prev, data_tmp]).pct_change().iloc[1:, ]
+            tail = data_out.index > idx_f[-1]
+        else:
+            data_ret = data_tmp.pct_change()
+            tail = np.ones(data_out.shape[0], dtype=bool)
+
+        data_out.loc[tail, (f, 'level', slice(None))] = np.nan
+        data_out.loc[tail, (f, 'return', slice(None))] = np.nan
+        data_out.loc[data_tmp.index, (f, 'level', slice(None))] = data_tmp.values
+        data_out.loc[data_tmp.index, (f, 'return', slice(None))] = data_ret.values
+
+    return data_out
+
+
+def transform_add_columns(data, data_new):
+    # Incremental transform: add new tickers to the transformed data (same date range)
+    # The output is identical to the transform of all prices, returns None if the new prices are outside of the
+    # date range of the transformed data
+    if data_new.empty:
+        return data
+    if data_new.index[0] < data.index[0] or data_new.index[-1] >= data.index[-1] + pd.offsets.BDay(1):
+        return None
+
+    # Business day grid of the new tickers
+    grid = data_new.groupby(pd.Grouper(freq='B')).last().reindex(data.index)
+    grid = grid.fillna(method='ffill')
+
+    multi_idx = pd.MultiIndex.from_product([FREQ, ('level', 'return'), grid.columns], names=['freq', 'type', 'index'])
+    data_add = pd.DataFrame(np.nan, index=data.index, columns=multi_idx)
+    for f in FREQ:
+        data_tmp = resample(grid, f)
+        data_add.loc[data_tmp.index, (f, 'level', slice(None))] = data_tmp.values
+        data_add.loc[data_tmp.index, (f, 'return', slice(None))] = data_tmp.pct_change().values
+
+    # Tickers in download order (sorted)
+    tickers = sorted(set(data.columns.get_level_values(2)) | set(grid.columns))
+    multi_idx = pd.MultiIndex.from_product([FREQ, ('level', 'return'), tickers], names=['freq', 'type', 'index'])
+    data_out = pd.concat([data, data_add], axis=1).reindex(columns=multi_idx)
 
     return data_out
 
 
 def load(data):
-    # Save data
-    output_path = os.getcwd() + '/output/'
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-    data.to_csv(output_path + 'cleaned_data.csv')
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(cleaned_data=data)
     return data
 
 
 def get_data_slice(data, freq, type):
     # Support function: specify frequency, type and drop multi index
+    # Price store views (see support.price_store) slice the memory-mapped price grid
+    if not isinstance(data, pd.DataFrame):
+        return data.get_data_slice(freq, type)
+
     data_out = data.loc[:, (freq, type, slice(None))].dropna(how='all', axis=0).dropna(how='all', axis=1)
     data_out = data_out.asfreq(freq)
     data_out.columns = data_out.columns.droplevel([0, 1])
@@ -72,6 +175,38 @@ def execute(index=None, start_date=None, end_date=None):
     start_date = datetime(2020, 1, 1) if isinstance(start_date, type(None)) else start_date
     end_date = datetime.now() if isinstance(end_date, type(None)) else end_date
 
-    data = load(transform(extract(index, start_date, end_date)))
+    with span('extract', tickers=len(index)) as s:
+        data = extract(index, start_date, end_date)
+        s.set(rows=data.shape[0])
+    with span('transform', tickers=data.shape[1]) as s:
+        data = transform(data)
+        s.set(rows=data.shape[0])
+    with span('load', tickers=data.shape[1], rows=data.shape[0]):
+        data = load(data)
+
+    return data
+
+
+def execute_incremental(data, index, index_new, start_date, end_date_prev, end_date):
+    # Incremental version of execute for a later end date and/or new tickers, only the new prices are downloaded
+    # data: transformed data of the tickers in index from start_date until end_date_prev, returns None if the full
+    # data is required
+    if end_date > end_date_prev:
+        with span('extract', tickers=len(index)) as s:
+            data_new = extract(index, data.index[-1], end_date)
+            s.set(rows=data_new.shape[0])
+        with span('transform.append_rows', tickers=data_new.shape[1], rows=data_new.shape[0]):
+            data = transform_append_rows(data, data_new)
+
+    if not isinstance(data, type(None)) and index_new:
+        with span('extract', tickers=len(index_new)) as s:
+            data_new = extract(index_new, start_date, end_date)
+            s.set(rows=data_new.shape[0])
+        with span('transform.add_columns', tickers=data_new.shape[1], rows=data_new.shape[0]):
+            data = transform_add_columns(data, data_new)
+
+    if not isinstance(data, type(None)):
+        with span('load', tickers=data.shape[1], rows=data.shape[0]):
+            load(data)
 
     return data
@@ -0,0 +1,198 @@
+""" Library for live updates: streaming price feeds and incremental updates of a dataset
+A feed returns the prices after the last prices of a dataset (poll). LIVE_FEED selects the feed: replay (local
+stand-in, see ReplayFeed) or a feed class '<module>:<class>' with the same poll method.
+A live session holds the dataset of a dashboard session: new prices are appended to the business day grid and the
+periods of the other frequencies (data_processing.transform_append_rows), the running statistics and the one-step
+forecasts of the local level model (support.model_kalman) are updated with the new returns only. The new points of
+the figures are returned for Dash extendData.
+Sessions are kept in the disk cache shared by the gunicorn workers (support.caching) under the key of the live state
+of the dashboard: a lease serializes the polls of a session, every worker continues the same session (dataset with
+the appended prices, running statistics and filter state).
+
+"""
+import os
+import warnings
+import zlib
+from importlib import import_module
+
+import numpy as np
+import pandas as pd
+
+import support.data_processing as data_proc
+import support.caching as caching
+
+LIVE_FEED = os.environ.get('LIVE_FEED', 'replay')
+LIVE_INTERVAL = float(os.environ.get('LIVE_INTERVAL', 5))  # seconds between polls of the dashboard
+LIVE_REPLAY_FILE = os.environ.get('LIVE_REPLAY_FILE')  # prices in the format of data_processing.extract (csv)
+MAX_POINTS = 5000  # points per trace of a live figure
+
+_feed = dict()
+
+
+class ReplayFeed(object):
+    # Local stand-in for a streaming feed: one business day per poll, replayed from a price file or, without a file,
+    # a random walk from the last prices (seeded by ticker and date: every process replays the same prices)
+
+    def __init__(self, path=LIVE_REPLAY_FILE, rows_per_poll=1):
+        self.rows_per_poll = rows_per_poll
+        self.prices = None
+        if path:
+            self.prices = pd.read_csv(path, index_col=0, parse_dates=True).sort_index()
+
+    def poll(self, last_prices):
+        # New prices after the date of last_prices (series of the last price per ticker, name: last date)
+        if not isinstance(self.prices, type(None)):
+            prices = self.prices.loc[self.prices.index > last_prices.name]
+            return prices.reindex(columns=last_prices.index).iloc[:self.rows_per_poll, ]
+
+        dates = pd.bdate_range(last_prices.name + pd.offsets.BDay(1), periods=self.rows_per_poll)
+        prices = pd.DataFrame(index=dates, columns=last_prices.index, dtype=float)
+        level = last_prices.values.astype(float)
+        for date in dates:
+            for i, ticker in enumerate(last_prices.index):
+                seed = zlib.crc32(ticker.encode())
+                sigma = 0.005 + 0.025 * (seed % 1000) / 1000
+                z = np.random.default_rng([seed, date.toordinal()]).standard_normal()
+                level[i] = level[i] * np.exp(sigma * z + 0.0003 - 0.5 * sigma ** 2)
+            prices.loc[date, :] = level
+
+        return prices
+
+
+def get_feed():
+    # Feed of the process (LIVE_FEED)
+    if 'feed' not in _feed:
+        if LIVE_FEED == 'replay':
+            _feed['feed'] = ReplayFeed()
+        else:
+            module, name = LIVE_FEED.split(':')
+            _feed['feed'] = getattr(import_module(module), name)()
+    return _feed['feed']
+
+
+def get_running_statistics(values):
+    # Count, mean, sum of squared deviations (m2), minimum and maximum per time series
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(values, axis=0)
+        return {'count': (~np.isnan(values)).sum(axis=0), 'mean': mean,
+                'm2': np.nansum((values - mean) ** 2, axis=0),
+                'min': np.nanmin(values, axis=0), 'max': np.nanmax(values, axis=0)}
+
+
+def update_running_statistics(stats, values):
+    # Combine the statistics with the statistics of the new values (Chan et al. parallel variance)
+    if not values.shape[0]:
+        return stats
+    new = get_running_statistics(values)
+    n_a, n_b = stats['count'], new['count']
+    n = n_a + n_b
+    mean_a, mean_b = np.nan_to_num(stats['mean']), np.nan_to_num(new['mean'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * n_b / n, np.nan)
+        m2 = stats['m2'] + new['m2'] + np.where(n > 0, delta ** 2 * n_a * n_b / n, 0)
+    return {'count': n, 'mean': mean, 'm2': m2, 'min': np.fmin(stats['min'], new['min']),
+            'max': np.fmax(stats['max'], new['max'])}
+
+
+def start_session(data, freq):
+    # Live session of a dataset and frequency: figure columns, running statistics and filter state
+    # Heavy import on first use (fork friendly startup)
+    import support.model_kalman as model_kalman
+
+    data_level = data_proc.get_data_slice(data, freq, 'level')
+    data_ret = data_proc.get_data_slice(data, freq, 'return')
+    state, _ = model_kalman.run_filter(data_ret, model_kalman.Q_RATIO)
+
+    session = {'data': data, 'freq': freq, 'last_date': data_level.index[-1],
+               'columns_level': data_level.columns, 'columns_ret': data_ret.columns,
+               'first_level': data_level.apply(lambda x: x.dropna()[0], axis=0),
+               'stats': get_running_statistics(data_ret.values.astype(float)), 'filter': state,
+               'last_level': data_level.iloc[-1], 'last_ret': data_ret.iloc[-1]}
+
+    return session
+
+
+def update_session(session, feed=None):
+    # Poll the feed and update the session, returns the new levels and returns at the frequency of the session
+    # (empty if no period was completed)
+    import support.model_kalman as model_kalman
+    feed = get_feed() if isinstance(feed, type(None)) else feed
+    data = session['data']
+    grid = data.loc[:, ('B', 'level', slice(None))]
+    last_prices = pd.Series(grid.iloc[-1].values, index=grid.columns.get_level_values(2), name=grid.index[-1])
+    data_new = feed.poll(last_prices)
+    if data_new.empty:
+        return None, None
+
+    # Business day grid and periods: the prices of the last date are included, a new tick of the same day
+    # replaces the last prices
+    data_new = pd.concat([last_prices.to_frame().T, data_new])
+    data_out = data_proc.transform_append_rows(data, data_new, revise_last=True)
+    if isinstance(data_out, type(None)):
+        return None, None
+    session['data'] = data_out
+
+    # New periods of the frequency
+    tail = data_out.loc[data_out.index > session['last_date']]
+    level = data_proc.get_data_slice(tail, session['freq'], 'level').reindex(columns=session['columns_level'])
+    ret = data_proc.get_data_slice(tail, session['freq'], 'return').reindex(columns=session['columns_ret'])
+    if level.empty:
+        return level, ret
+
+    # Running statistics and one-step forecasts from the new returns only
+    values = ret.values.astype(float)
+    session['stats'] = update_running_statistics(session['stats'], values)
+    session['filter'], _ = model_kalman.kalman_filter(session['filter'], values, model_kalman.Q_RATIO)
+    session['last_date'] = level.index[-1]
+    session['last_level'], session['last_ret'] = level.iloc[-1], ret.iloc[-1]
+
+    return level, ret
+
+
+def poll_session(key, get_data, freq, feed=None):
+    # Poll the shared session of the key: read from the disk cache (started from the dataset get_data() if unknown),
+    # updated with the feed and written back under a lease. Returns the session, the new levels and returns, or
+    # (None, None, None) if another worker is polling the session
+    with caching.lease('live_' + key, timeout=LIVE_INTERVAL) as acquired:
+        if not acquired:
+            return None, None, None
+        session = caching.read('live_' + key)
+        started = session is caching.MISSING
+        if started:
+            session = start_session(get_data(), freq)
+        level, ret = update_session(session, feed)
+        if started or not isinstance(level, type(None)):
+            caching.write('live_' + key, session)
+
+    return session, level, ret
+
+
+def get_summary(session):
+    # Last prices, running statistics and one-step forecast (local level model) per time series
+    import support.model_kalman as model_kalman
+    stats = session['stats']
+    columns = session['columns_ret']
+    mean, var = model_kalman.get_prediction(session['filter'], model_kalman.Q_RATIO)
+    lower, upper = model_kalman.get_interval(mean, var)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(stats['m2'] / (stats['count'] - 1))
+
+    summary = pd.DataFrame([session['last_level'].reindex(columns).values, session['last_ret'].values,
+                            stats['count'], stats['mean'], std, stats['min'], stats['max'], mean, lower, upper],
+                           index=['price', 'return', 'count', 'mean', 'std', 'min', 'max', 'forecast', 'ci_lower',
+                                  'ci_upper'], columns=columns)
+
+    return summary
+
+
+def get_extend_data(df, first=None):
+    # Dash extendData of a figure with one trace per column: ({x, y}, trace indices, maximum points)
+    # first: values of the first date (index figure, index=100), dates as in dash_processing.json_default
+    if not isinstance(first, type(None)):
+        df = df / first * 100
+    x = [np.datetime_as_string(df.index.values, unit='s').tolist()] * df.shape[1]
+    y = [[None if np.isnan(v) else v for v in df[col].values.astype(float)] for col in df.columns]
+
+    return [{'x': x, 'y': y}, list(range(df.shape[1])), MAX_POINTS]
@@ -0,0 +1,96 @@
+""" Library for memory budgets: estimated peak memory of a request (tickers x rows x models)
+Requests whose estimate exceeds MEMORY_BUDGET_MB are degraded (MEMORY_BUDGET_MODE=degrade: coarser frequency for
+the data exploration, forecasts in chunks of tickers) or rejected with a message, instead of an out of memory kill
+of the gunicorn worker. The bytes per value are rough estimates (not measured by a calibration run): compare them
+with the peak memory per callback on /metrics (dashboard_callback_peak_memory_megabytes) of a deployment and adjust
+them if the budget rejects too much or too little.
+
+"""
+import os
+
+import pandas as pd
+
+# Memory budget per request (MB, 0: no budget) and mode: 'degrade' or 'reject'
+MEMORY_BUDGET_MB = float(os.environ.get('MEMORY_BUDGET_MB', 1024))
+MEMORY_BUDGET_MODE = os.environ.get('MEMORY_BUDGET_MODE', 'degrade')
+
+# Estimated peak bytes per value: dataset (transform, json dump and parse), exploration (statistics, tables and
+# figures), forecast (walk-forward validation and forecast figure, per model) and forecast_results (validation results
+# that are kept for all tickers in chunked forecasts)
+BYTES_PER_VALUE = {'dataset': 120, 'exploration': 400, 'forecast': 250, 'forecast_results': 64}
+
+# Periods per year of the data frequencies (see data_processing.FREQ)
+PERIODS_PER_YEAR = {'B': 261, 'W-Fri': 52, 'BM': 12, 'BY': 1}
+
+
+class MemoryBudgetError(Exception):
+    # Request exceeds the memory budget (message is shown in the dashboard)
+    pass
+
+
+def get_rows(n_rows, freq):
+    # Number of rows at frequency freq of a business day dataset with n_rows
+    return max(1, int(n_rows * PERIODS_PER_YEAR[freq] / PERIODS_PER_YEAR['B']))
+
+
+def estimate_dataset(n_tickers, start_date, end_date):
+    # Peak memory (MB) of downloading and transforming the dataset: all frequencies and types per ticker
+    n_rows = len(pd.bdate_range(start_date, end_date))
+    return n_tickers * n_rows * 2 * len(PERIODS_PER_YEAR) * BYTES_PER_VALUE['dataset'] / 2 ** 20
+
+
+def estimate_exploration(n_tickers, n_rows, freq):
+    # Peak memory (MB) of the data exploration at frequency freq, n_rows: business days of the dataset
+    return n_tickers * get_rows(n_rows, freq) * BYTES_PER_VALUE['exploration'] / 2 ** 20
+
+
+def estimate_forecast(n_tickers, n_rows, freq, n_models):
+    # Peak memory (MB) of the forecasts at frequency freq, n_rows: business days of the dataset
+    return n_models * n_tickers * get_rows(n_rows, freq) * BYTES_PER_VALUE['forecast'] / 2 ** 20
+
+
+def exceeds(estimate):
+    return MEMORY_BUDGET_MB > 0 and estimate > MEMORY_BUDGET_MB
+
+
+def get_message(request, estimate):
+    return (f'The {request} request exceeds the memory budget (estimated {estimate:.0f} MB, budget '
+            f'{MEMORY_BUDGET_MB:.0f} MB). Select fewer tickers or a shorter date range.')
+
+
+def check_dataset(n_tickers, start_date, end_date):
+    # The dataset is the input of all other requests: not degraded
+    estimate = estimate_dataset(n_tickers, start_date, end_date)
+    if exceeds(estimate):
+        raise MemoryBudgetError(get_message('data', estimate))
+
+
+def check_exploration(n_tickers, n_rows, freq):
+    # Frequency of the data exploration within the budget: freq or a coarser frequency (degrade mode)
+    estimate = estimate_exploration(n_tickers, n_rows, freq)
+    if not exceeds(estimate):
+        return freq
+    if MEMORY_BUDGET_MODE == 'degrade':
+        freq_list = list(PERIODS_PER_YEAR)
+        for f in freq_list[freq_list.index(freq) + 1:]:
+            if not exceeds(estimate_exploration(n_tickers, n_rows, f)):
+                return f
+    raise MemoryBudgetError(get_message('data exploration', estimate))
+
+
+def check_forecast(n_tickers, n_rows, freq, n_models, pooled=()):
+    # Number of tickers per chunk of the forecasts within the budget: all tickers or fewer (degrade mode)
+    # pooled: names of the selected pooled models, they always run on all tickers (not degraded)
+    estimate = estimate_forecast(n_tickers, n_rows, freq, n_models)
+    if not exceeds(estimate):
+        return n_tickers
+    if pooled:
+        raise MemoryBudgetError(f"{get_message('forecast', estimate)} The pooled models ({', '.join(pooled)}) are "
+                                f"trained on all tickers at once and can not run in chunks of tickers.")
+    if MEMORY_BUDGET_MODE == 'degrade':
+        # The validation results of all chunks are kept
+        retained = estimate * BYTES_PER_VALUE['forecast_results'] / BYTES_PER_VALUE['forecast']
+        chunk_size = int(n_tickers * (MEMORY_BUDGET_MB - retained) / estimate)
+        if chunk_size >= 1:
+            return chunk_size
+    raise MemoryBudgetError(get_message('forecast', estimate))
@@ -0,0 +1,127 @@
+""" Library for model training: garch
+GARCH(1,1) volatility model with a constant mean: r_t = mu + e_t, s2_t = omega + alpha * e2_t-1 + beta * s2_t-1.
+The forecast is the mean return, the confidence interval follows from the variance forecast. The variance recursion,
+the likelihood and its analytic gradient are array operations over all time series at once (loop over dates only),
+the parameters of all time series are estimated in one bounded L-BFGS-B optimization. Variance targeting:
+omega = var(e) * (1 - alpha - beta), with alpha = persistence * share and beta = persistence * (1 - share).
+The estimation of every walk-forward step starts from START_PARAMS: the forecasts only depend on the training data
+(not on the order of the steps or on earlier estimations of the process).
+
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.stats import norm
+
+import support.result_writer as result_writer
+import support.walk_forward as walk_forward
+from support.walk_forward import model_validation, model_validation_summary
+
+START_PARAMS = (0.95, 0.1)  # persistence, share of alpha
+MAX_PERSISTENCE = 0.999
+MIN_OBS = 20  # time series with fewer observations have a constant variance
+
+
+def get_variance(e2, valid, s2, alpha, beta):
+    # Variance recursion and derivatives to alpha and beta, arrays with dimensions (date, time series)
+    # Missing observations (valid=False) carry the variance forward
+    n_obs, n_ts = e2.shape
+    sigma2, d_alpha, d_beta = np.empty((n_obs + 1, n_ts)), np.zeros((n_obs + 1, n_ts)), np.zeros((n_obs + 1, n_ts))
+    sigma2[0] = s2
+    omega = s2 * (1 - alpha - beta)
+    for t in range(n_obs):
+        update = valid[t]
+        sigma2[t + 1] = np.where(update, omega + alpha * e2[t] + beta * sigma2[t], sigma2[t])
+        d_alpha[t + 1] = np.where(update, e2[t] - s2 + beta * d_alpha[t], d_alpha[t])
+        d_beta[t + 1] = np.where(update, sigma2[t] - s2 + beta * d_beta[t], d_beta[t])
+    return sigma2, d_alpha, d_beta
+
+
+def negative_log_likelihood(x, e2, valid, s2):
+    # Gaussian negative log likelihood (per observation) of all time series and its gradient to x
+    # x: persistence of all time series followed by the share of alpha of all time series
+    n_ts = e2.shape[1]
+    persistence, share = x[:n_ts], x[n_ts:]
+    alpha, beta = persistence * share, persistence * (1 - share)
+    sigma2, d_alpha, d_beta = get_variance(e2, valid, s2, alpha, beta)
+    sigma2, d_alpha, d_beta = sigma2[:-1], d_alpha[:-1], d_beta[:-1]
+
+    n = max(valid.sum(), 1)
+    nll = 0.5 * np.where(valid, np.log(sigma2) + e2 / sigma2, 0).sum() / n
+    g = 0.5 * np.where(valid, 1 / sigma2 - e2 / sigma2 ** 2, 0) / n
+    g_alpha, g_beta = (g * d_alpha).sum(axis=0), (g * d_beta).sum(axis=0)
+    grad = np.concatenate([g_alpha * share + g_beta * (1 - share), (g_alpha - g_beta) * persistence])
+
+    return nll, grad
+
+
+def fit(data_in):
+    # Estimate mean, unconditional variance and GARCH parameters, returns the variance of the next date
+    # Time series without variance are excluded from the likelihood (forecast nan or constant)
+    values = data_in.values.astype(float)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mu = np.nanmean(values, axis=0)
+        s2 = np.nanvar(values, axis=0)
+        valid = ~np.isnan(values) & (s2 > 0)
+        s2_fit = np.where(s2 > 0, s2, 1)
+    e2 = np.where(valid, values - mu, 0) ** 2
+    n_ts = values.shape[1]
+
+    x0 = np.repeat(np.array(START_PARAMS, dtype=float)[:, None], n_ts, axis=1).reshape(-1)
+    bounds = [(0, MAX_PERSISTENCE)] * n_ts + [(0, 1)] * n_ts
+    x = minimize(negative_log_likelihood, x0, args=(e2, valid, s2_fit), jac=True, method='L-BFGS-B', bounds=bounds).x
+
+    persistence, share = x[:n_ts], x[n_ts:]
+    persistence = np.where(valid.sum(axis=0) < MIN_OBS, 0, persistence)
+    sigma2 = get_variance(e2, valid, s2_fit, persistence * share, persistence * (1 - share))[0]
+
+    with np.errstate(invalid='ignore'):
+        return mu, s2, persistence, np.where(s2 > 0, sigma2[-1], s2)
+
+
+def model_forecast(data_in, steps):
+    # Perform h-step ahead forecast with the GARCH(1,1) model: mean return and confidence interval of the return
+
+    # Initialise
+    alpha = 0.05  # CI = [0.025, 0.975]
+    results = pd.DataFrame(index=['forecast', 'ci_lower', 'ci_upper'], columns=data_in.columns)
+
+    # Fit all time series at once
+    mu, s2, persistence, sigma2_next = fit(data_in)
+
+    # Variance forecast h steps ahead: mean reversion to the unconditional variance
+    sigma2_h = s2 + persistence ** (steps - 1) * (sigma2_next - s2)
+    z = norm.ppf(1 - alpha / 2)
+    results.loc['forecast', :] = mu
+    results.loc['ci_lower', :] = mu - z * np.sqrt(sigma2_h)
+    results.loc['ci_upper', :] = mu + z * np.sqrt(sigma2_h)
+
+    results = pd.concat([(results.loc[['forecast'], ] > 0).rename({'forecast': 'invest'}), results])
+
+    return results
+
+
+def load(forecast_summary, forecast_results):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(model_garch_forecast_summary=forecast_summary, model_garch_forecast_results=forecast_results)
+
+    return
+
+
+def get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs):
+    # Perform model forecast (1 step ahead) and validation, see support.walk_forward
+    return walk_forward.get_model_forecast_and_validation(data_in, validation_steps, model_forecast, *argv, **kwargs)
+
+
+def execute(data_in, validation_steps=24, *argv, **kwargs):
+    # The model_forecast parameters are supplied with argv
+    # Forecasts of a previous run can be reused with kwargs prev_forecast and prev_results (see support.walk_forward)
+
+    forecast_summary, forecast_results = get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs)
+
+    load(forecast_summary, forecast_results)
+
+    return forecast_summary, forecast_results
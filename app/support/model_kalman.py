@@ -0,0 +1,155 @@
+""" Library for model training: kalman
+Local level model (random walk plus noise): r_t = level_t + e_t, level_t = level_t-1 + u_t, var(u) = q * var(e).
+The Kalman filter updates the state (level and its variance) one observation at a time for all time series at once,
+var(e) is estimated from the prediction errors of the filter (concentrated likelihood). The one-step-ahead
+predictions of the filter are the walk-forward forecasts: validation over all steps costs one filter pass instead of
+one fit per step. The filter state and predictions are checkpointed per time series in the disk cache (shared by the
+gunicorn workers), a data update with unchanged history only filters the new observations.
+
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+import support.caching as caching
+import support.result_writer as result_writer
+import support.walk_forward as walk_forward
+from support.caching import hash_key
+from support.tracing import span
+from support.walk_forward import model_validation, model_validation_summary
+
+Q_RATIO = 0.01  # signal to noise ratio: variance of the level changes relative to the observation variance
+
+
+def init_state(n_ts):
+    # Filter state: level, variance of the level prediction and sum of squared standardized prediction errors (all
+    # variances relative to var(e)), nan level until the first observation
+    return {'level': np.full(n_ts, np.nan), 'p': np.full(n_ts, np.nan), 'ssr': np.zeros(n_ts), 'n': np.zeros(n_ts)}
+
+
+def get_prediction(state, q_ratio, steps=1):
+    # Prediction of the observation steps ahead: mean and variance
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(state['n'] > 0, state['ssr'] / state['n'], np.nan)
+    return state['level'], (state['p'] + (steps - 1) * q_ratio + 1) * scale
+
+
+def update(state, y, q_ratio):
+    # Filter update with the observations y of all time series (nan: missing, the level variance grows)
+    level, p = state['level'], state['p']
+    started = ~np.isnan(level)
+    valid = ~np.isnan(y) & started
+    first = ~np.isnan(y) & ~started
+
+    f = p + 1
+    v = np.where(valid, y - level, 0)
+    k = np.where(valid, p / f, 0)
+    return {'level': np.where(first, y, level + k * v),
+            'p': np.where(first, 1 + q_ratio, p * (1 - k) + q_ratio),
+            'ssr': state['ssr'] + np.where(valid, v ** 2 / f, 0),
+            'n': state['n'] + valid}
+
+
+def kalman_filter(state, values, q_ratio):
+    # Filter the observations (date, time series), returns the state and the one-step-ahead predictions before each
+    # observation with dimensions (date, time series, mean / variance)
+    pred = np.empty(values.shape + (2, ))
+    for t in range(values.shape[0]):
+        pred[t, :, 0], pred[t, :, 1] = get_prediction(state, q_ratio)
+        state = update(state, values[t], q_ratio)
+    return state, pred
+
+
+def run_filter(data_in, q_ratio):
+    # Filter all observations, continue from the checkpoint if the history of the checkpoint is unchanged
+    values = data_in.values.astype(float)
+    # Checkpoint per time series and q: filtered dates, data hash, filter state and one-step-ahead predictions
+    key = 'kalman_' + hash_key(list(data_in.columns), q_ratio)
+    checkpoint = caching.read(key)
+    start, state, pred = 0, init_state(values.shape[1]), np.empty((0, values.shape[1], 2))
+    if checkpoint is not caching.MISSING:
+        n = len(checkpoint['index'])
+        if n <= len(data_in.index) and data_in.index[:n].equals(checkpoint['index']) and \
+                hash_key(data_in.iloc[:n, ]) == checkpoint['hash']:
+            start, state, pred = n, checkpoint['state'], checkpoint['pred']
+
+    if start < len(data_in.index):
+        with span('model_kalman.filter', tickers=values.shape[1], rows=values.shape[0] - start):
+            state, pred_new = kalman_filter(state, values[start:], q_ratio)
+        pred = np.concatenate([pred, pred_new])
+        caching.write(key, {'index': data_in.index, 'hash': hash_key(data_in), 'state': state, 'pred': pred})
+
+    return state, pred
+
+
+def get_interval(mean, var):
+    # Confidence interval of the prediction
+    alpha = 0.05  # CI = [0.025, 0.975]
+    z = norm.ppf(1 - alpha / 2)
+    return mean - z * np.sqrt(var), mean + z * np.sqrt(var)
+
+
+def get_forecast_results(columns, mean, var):
+    # Forecast results: invest, forecast and confidence interval
+    results = pd.DataFrame(index=['forecast', 'ci_lower', 'ci_upper'], columns=columns)
+    results.loc['forecast', :] = mean
+    results.loc['ci_lower', :], results.loc['ci_upper', :] = get_interval(mean, var)
+
+    return pd.concat([(results.loc[['forecast'], ] > 0).rename({'forecast': 'invest'}), results])
+
+
+def model_forecast(data_in, steps, q_ratio=Q_RATIO):
+    # Perform h-step ahead forecast with the local level model (filter without checkpoint, e.g. per rolling window)
+    state, _ = kalman_filter(init_state(data_in.shape[1]), data_in.values.astype(float), q_ratio)
+    return get_forecast_results(data_in.columns, *get_prediction(state, q_ratio, steps))
+
+
+def load(forecast_summary, forecast_results):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(model_kalman_forecast_summary=forecast_summary, model_kalman_forecast_results=forecast_results)
+
+    return
+
+
+def get_model_forecast_and_validation(data_in, validation_steps, q_ratio=Q_RATIO, prev_forecast=None,
+                                      prev_results=None, desc=None, window=None, deadline=None):
+    # Perform model forecast (1 step ahead) and validation in one filter pass
+    # Previous runs are reused with the filter checkpoint (prev_forecast and prev_results are not required), a single
+    # pass does not need a deadline. With a rolling window the filter is restarted per validation step (see
+    # support.walk_forward)
+    if not isinstance(window, type(None)):
+        return walk_forward.get_model_forecast_and_validation(data_in, validation_steps, model_forecast, q_ratio,
+                                                              prev_forecast=prev_forecast, prev_results=prev_results,
+                                                              desc=desc, window=window, deadline=deadline)
+
+    # Initialise max validation steps: at least 10 observations required
+    steps = walk_forward.get_validation_steps(data_in, validation_steps)
+    n_obs, n_ts = data_in.shape
+
+    # Filter: the state after the last observation is the forecast, the predictions are the validation forecasts
+    state, pred = run_filter(data_in, q_ratio)
+    res_forecast = get_forecast_results(data_in.columns, *get_prediction(state, q_ratio))
+
+    values = np.full((n_obs, n_ts, len(walk_forward.FORECAST_TYPES)), np.nan)
+    values[:, :, 0] = data_in.values
+    if steps > 0:
+        values[-steps:, :, 1] = pred[-steps:, :, 0]
+        values[-steps:, :, 2], values[-steps:, :, 3] = get_interval(pred[-steps:, :, 0], pred[-steps:, :, 1])
+    res_validation, res_val_summary = walk_forward.get_validation_results(data_in, values)
+
+    results = pd.concat([res_forecast, res_val_summary])
+    results.loc['training_window', :] = walk_forward.get_window_label(window)
+    results.loc['validation_steps', :] = max(steps, 0)
+
+    return results, res_validation
+
+
+def execute(data_in, validation_steps=24, *argv, **kwargs):
+    # The model_forecast parameters are supplied with argv
+    # Filter state of a previous run is reused with the checkpoint (see run_filter)
+
+    forecast_summary, forecast_results = get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs)
+
+    load(forecast_summary, forecast_results)
+
+    return forecast_summary, forecast_results
@@ -5,23 +5,10 @@ from plotly.subplots import make_subplots
 from prophet import Prophet
 from prophet.diagnostics import cross_validation
 from prophet.plot import plot_plotly, plot_components_plotly
-from tqdm import tqdm
 
-
-def get_model_forecast_and_validation(data_in, validation_steps, *argv):
-    # Perform model forecast (1 step ahead) and validation
-
-    # Initialise max validation steps: at least 10 observations required
-    actual_val_steps = min(data_in.dropna().shape[0] - 10, validation_steps)
-
-    # forecast and validation
-    res_forecast = model_forecast(data_in, 1, *argv)
-    res_validation, res_val_summary = model_validation(data_in, actual_val_steps, model_forecast, *argv)
-
-    results = pd.concat([res_forecast, res_val_summary])
-    results.loc['validation_steps', :] = actual_val_steps
-
-    return results, res_validation
+import support.result_writer as result_writer
+import support.walk_forward as walk_forward
+from support.walk_forward import model_validation, model_validation_summary
 
 
 def model_forecast(data_in, steps, *argv):
@@ -90,58 +77,6 @@ class suppress_stdout_stderr(object):
     #      p = Propet(*kwargs).fit(training_data)
 
 
-def model_validation(data_in, steps, func_model_forecast, *argv):
-    # Perform rolling window forecast (generic function)
-    # The model_forecast parameters are supplied with argv
-
-    # Initialise
-    multi_idx = pd.MultiIndex.from_product([data_in.columns, ('actual', 'forecast', 'ci_lower', 'ci_upper')],
-                                           names=['index', 'type'])
-    results = pd.DataFrame(index=data_in.index, columns=multi_idx)
-    results.loc[:, (slice(None), 'actual')] = data_in.values
-
-    # Loop over steps
-    n_obs = data_in.shape[0]
-    for count in tqdm(range(n_obs - steps, n_obs), desc='Validating Prophet model'):  # debug with tqdm
-        # Initialise train test split
-        train = data_in.iloc[:count, ]
-        test = data_in.iloc[[count],]
-
-        # Forecast
-        forecast_res = func_model_forecast(train, 1, *argv)
-
-        # Save results
-        results.loc[test.index, (slice(None), 'forecast')] = forecast_res.loc['forecast',].values
-        results.loc[test.index, (slice(None), 'ci_lower')] = forecast_res.loc['ci_lower',].values
-        results.loc[test.index, (slice(None), 'ci_upper')] = forecast_res.loc['ci_upper',].values
-    results_summary = model_validation_summary(results)
-
-    return results, results_summary
-
-
-def model_validation_summary(forecast_results):
-    # Calculate summary statistics from the rolling forecast (generic function)
-    # accuracy: correct forecast of positive and negative returns
-    # payout: payout for following strategy with 100 EUR (excl. transaction fees and bid-ask spread)
-
-    res = forecast_results.dropna()
-    results = pd.DataFrame(index=['accuracy', 'payout_from_100'], columns=res.columns.levels[0])
-
-    # Calculate accuracy
-    pos_ret_act = res.loc[:, (slice(None), 'actual')] > 0
-    pos_ret_for = res.loc[:, (slice(None), 'forecast')] > 0
-    accuracy = (pos_ret_act.values == pos_ret_for.values).sum(axis=0) / res.shape[0]
-
-    # Calculate payout
-    ret_act = res.loc[:, (slice(None), 'actual')]
-    payout = (ret_act.values * pos_ret_for.values + 1).prod(axis=0) * 100
-
-    results.loc['accuracy',] = accuracy
-    results.loc['payout_from_100',] = payout
-
-    return results
-
-
 def plot_validation(forecast_results, title='', data_level=None):
     # Create forecast plots
     # Plot levels if supplied
@@ -200,20 +135,23 @@ def plot_validation(forecast_results, title='', data_level=None):
 
 
 def load(forecast_summary, forecast_results):
-    # Save data
-    output_path = os.getcwd() + '/output/'
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-    forecast_summary.to_csv(output_path + 'model_prophet_forecast_summary.csv')
-    forecast_results.to_csv(output_path + 'model_prophet_forecast_results.csv')
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(model_prophet_forecast_summary=forecast_summary, model_prophet_forecast_results=forecast_results)
 
     return
 
 
-def execute(data_in, validation_steps=24, *argv):
+def get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs):
+    # Perform model forecast (1 step ahead) and validation, see support.walk_forward
+    return walk_forward.get_model_forecast_and_validation(data_in, validation_steps, model_forecast, *argv,
+                                                          desc='Validating Prophet model', **kwargs)
+
+
+def execute(data_in, validation_steps=24, *argv, **kwargs):
     # The model_forecast parameters are supplied with argv
+    # Forecasts of a previous run can be reused with kwargs prev_forecast and prev_results (see support.walk_forward)
 
-    forecast_summary, forecast_results = get_model_forecast_and_validation(data_in, validation_steps, *argv)
+    forecast_summary, forecast_results = get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs)
 
     load(forecast_summary, forecast_results)
 
@@ -0,0 +1,157 @@
+""" Library for model training: xgboost
+Pooled gradient boosting model for all time series: the return is forecasted from the lagged returns and their
+rolling mean and standard deviation. The lagged features are strided sliding window views of the returns (no copy
+until the design matrix is passed to xgboost). Between walk-forward steps the model is warm started: boosting rounds
+are added to the model of the previous training period instead of training from zero.
+The warm start chains are anchored at fixed training lengths (multiples of CHAIN_LENGTH): the model of a training
+period is trained from zero on the anchor period and updated once per later period. The model only depends on the
+training data, not on the order of the validation steps or on the models cached by the process: a missing model of
+the chain is rebuilt (and cached) from the anchor. With a rolling training window the models are trained from zero.
+
+"""
+import os
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from numpy.lib.stride_tricks import sliding_window_view
+
+import support.result_writer as result_writer
+import support.walk_forward as walk_forward
+from support.caching import hash_key, MemoryCache
+from support.walk_forward import model_validation, model_validation_summary
+
+# Histogram trees
+XGB_PARAMS = {'objective': 'reg:squarederror', 'tree_method': 'hist', 'max_depth': 3, 'eta': 0.1, 'subsample': 0.8}
+# Threads per training: the cores are shared by the gunicorn workers (1 in the process pool of support.batch_runner)
+XGB_NTHREAD = int(os.environ.get('XGB_NTHREAD', max(1, os.cpu_count() // int(os.environ.get('GUNICORN_WORKERS', 5)))))
+N_ROUNDS = 100  # boosting rounds of a model trained from zero
+N_ROUNDS_UPDATE = 10  # boosting rounds added to a warm started model
+MAX_ROUNDS = 300  # maximum number of rounds of a warm started model
+CHAIN_LENGTH = (MAX_ROUNDS - N_ROUNDS) // N_ROUNDS_UPDATE + 1  # training periods per warm start chain
+N_LAGS = 5
+POOLED = True  # one model for all time series: no chunks of tickers or reuse per ticker, see support.pipeline
+
+# Warm start chains by content hash of the anchor period and parameters: {training length: (data hash, model)}
+# (per process)
+model_cache = MemoryCache(maxsize=32)
+
+
+def get_features(windows):
+    # Features from the lag windows (..., n_lags): lagged returns, rolling mean and rolling standard deviation
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(windows, axis=-1)[..., None]
+        std = np.nanstd(windows, axis=-1)[..., None]
+    return np.concatenate([windows, mean, std], axis=-1)
+
+
+def get_design_matrix(values, n_lags):
+    # Pooled design matrix of all time series: values (date, time series) -> rows (date x time series, features)
+    # The windows are a view of the values with dimensions (date, time series, n_lags + 1)
+    windows = sliding_window_view(values, n_lags + 1, axis=0)
+    x = get_features(windows[:, :, :-1])
+    y = windows[:, :, -1]
+    return x.reshape(-1, x.shape[-1]), y.reshape(-1)
+
+
+def train(values, n_lags, booster=None):
+    # Train from zero or add boosting rounds to the booster (xgboost continues on a copy of the booster)
+    x, y = get_design_matrix(values, n_lags)
+    dtrain = xgb.DMatrix(x[~np.isnan(y)], label=y[~np.isnan(y)], nthread=XGB_NTHREAD)
+    params = dict(XGB_PARAMS, nthread=XGB_NTHREAD)
+    if isinstance(booster, type(None)):
+        return xgb.train(params, dtrain, num_boost_round=N_ROUNDS)
+    return xgb.train(params, dtrain, num_boost_round=N_ROUNDS_UPDATE, xgb_model=booster)
+
+
+def get_anchor(n_obs, n_lags):
+    # Training length of the start of the warm start chain (n_obs: trained from zero)
+    anchor = n_obs - n_obs % CHAIN_LENGTH
+    return anchor if anchor > n_lags + 10 else n_obs
+
+
+def fit(data_in, n_lags, warm_start=True):
+    # Model of the training data: warm started along the chain from the anchor period, see module description
+    values = data_in.values.astype(float)
+    n_obs = values.shape[0]
+    anchor = get_anchor(n_obs, n_lags) if warm_start else n_obs
+    if anchor == n_obs:
+        return train(values, n_lags)
+
+    # Latest model of the chain with the same history (the chain is copied: concurrent requests)
+    key = hash_key('xgboost', data_in.iloc[:anchor, ], n_lags, XGB_PARAMS)
+    chain = dict(model_cache.get(key) or {})
+    start, booster = anchor, None
+    for n in sorted((n for n in chain if n <= n_obs), reverse=True):
+        if chain[n][0] == hash_key(data_in.iloc[:n, ]):
+            start, booster = n, chain[n][1]
+            break
+    if isinstance(booster, type(None)):
+        booster = train(values[:anchor], n_lags)
+        chain[anchor] = (hash_key(data_in.iloc[:anchor, ]), booster)
+
+    # One update per training period after the latest model
+    for n in range(start + 1, n_obs + 1):
+        booster = train(values[:n], n_lags, booster)
+        chain[n] = (hash_key(data_in.iloc[:n, ]), booster)
+    model_cache.put(key, chain)
+
+    return booster
+
+
+def model_forecast(data_in, steps, n_lags=N_LAGS, warm_start=True):
+    # Perform h-step ahead forecast with the pooled xgboost model (recursive for h > 1)
+
+    # Initialise
+    alpha = 0.05  # CI = [0.025, 0.975]
+    results = pd.DataFrame(index=['forecast', 'ci_lower', 'ci_upper'], columns=data_in.columns)
+    values = data_in.values.astype(float)
+    n_obs, n_ts = values.shape
+
+    # Train pooled model
+    x, y = get_design_matrix(values, n_lags)
+    booster = fit(data_in, n_lags, warm_start)
+
+    # Confidence interval from the quantiles of the residuals per time series
+    residuals = (y - booster.predict(xgb.DMatrix(x, nthread=XGB_NTHREAD))).reshape(n_obs - n_lags, n_ts)
+    with np.errstate(invalid='ignore'):
+        ci = np.nanquantile(residuals, [alpha / 2, 1 - alpha / 2], axis=0)
+
+    # Forecast: features of the last n_lags returns
+    lags = values[-n_lags:].T.copy()
+    for _ in range(steps):
+        forecast = booster.predict(xgb.DMatrix(get_features(lags), nthread=XGB_NTHREAD))
+        lags = np.concatenate([lags[:, 1:], forecast[:, None]], axis=1)
+
+    results.loc['forecast', :] = forecast
+    results.loc['ci_lower', :] = forecast + ci[0]
+    results.loc['ci_upper', :] = forecast + ci[1]
+    results = pd.concat([(results.loc[['forecast'], ] > 0).rename({'forecast': 'invest'}), results])
+
+    return results
+
+
+def load(forecast_summary, forecast_results):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(model_xgboost_forecast_summary=forecast_summary,
+                       model_xgboost_forecast_results=forecast_results)
+
+    return
+
+
+def get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs):
+    # Perform model forecast (1 step ahead) and validation, see support.walk_forward
+    # Rolling training window: the training periods do not extend each other, no warm start
+    if not isinstance(kwargs.get('window'), type(None)):
+        argv = (argv[0] if argv else N_LAGS, False)
+    return walk_forward.get_model_forecast_and_validation(data_in, validation_steps, model_forecast, *argv, **kwargs)
+
+
+def execute(data_in, validation_steps=24, *argv, **kwargs):
+    # The model_forecast parameters are supplied with argv
+    # Forecasts of a previous run can be reused with kwargs prev_forecast and prev_results (see support.walk_forward)
+
+    forecast_summary, forecast_results = get_model_forecast_and_validation(data_in, validation_steps, *argv, **kwargs)
+
+    load(forecast_summary, forecast_results)
+
+    return forecast_summary, forecast_results
@@ -0,0 +1,305 @@
+""" Library for the dashboard pipeline: cached and coalesced data, exploration and forecast requests
+Identical requests (normalized ticker list, date range and model parameters) from different gunicorn workers share
+one computation via the disk cache lease in support.caching. The cache is also filled by support.cache_warming.
+Datasets derived from the previous dataset of a session (later end date or new tickers) are computed incrementally,
+the exploration statistics and forecasts of the previous dataset are reused where the data did not change.
+
+"""
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from importlib import import_module
+import pandas as pd
+
+import support.caching as caching
+import support.data_exploration as data_expl
+import support.data_processing as data_proc
+import support.memory_budget as memory_budget
+from support.walk_forward import get_validation_steps
+
+# Market indices: AEX, DAX, STOXX, S&P, Dow Jones
+INDEX_MARKET = ['^AEX', '^GDAXI', '^STOXX', '^GSPC', '^DJI']
+
+# Parsed datasets by content hash of the json (per process)
+dataset_cache = caching.MemoryCache(maxsize=8)
+
+# Time budget of a forecast request (seconds, 0: no budget), below the gunicorn timeout
+FORECAST_TIME_BUDGET = float(os.environ.get('FORECAST_TIME_BUDGET', 480))
+
+
+def normalize_index_list(index_list):
+    # Remove empty and duplicates, Yahoo tickers are case insensitive and downloaded in sorted order
+    index_list = [i.strip().upper() for i in index_list if i and i.strip()]
+    return sorted(set(index_list))
+
+
+def get_dataset_key(index_list, start_date, end_date):
+    return caching.hash_key('dataset', normalize_index_list(index_list), start_date, end_date)
+
+
+def get_session_request(index_list, start_date, end_date):
+    # Dataset request of a session (stored in the browser, supplied as previous request with the next request)
+    return {'index_list': normalize_index_list(index_list), 'start_date': start_date.strftime("%Y-%m-%d"),
+            'end_date': end_date.strftime("%Y-%m-%d")}
+
+
+def get_dataset(index_list, start_date, end_date, previous=None):
+    # Download and transform data, dumped to json
+    # previous: previous request of the session, see get_session_request
+    index_list = normalize_index_list(index_list)
+    key = get_dataset_key(index_list, start_date, end_date)
+
+    return caching.single_flight(key, _get_dataset_json, index_list, start_date, end_date, previous)
+
+
+def _get_dataset_json(index_list, start_date, end_date, previous=None):
+    data, parent_key = None, None
+    if previous:
+        prev_index = normalize_index_list(previous['index_list'])
+        prev_start = datetime.strptime(previous['start_date'], "%Y-%m-%d")
+        prev_end = datetime.strptime(previous['end_date'], "%Y-%m-%d")
+        parent_key = get_dataset_key(prev_index, prev_start, prev_end)
+        data = get_dataset_incremental(index_list, start_date, end_date, prev_index, prev_start, prev_end)
+
+    if isinstance(data, type(None)):
+        data = data_proc.execute(index=index_list, start_date=start_date, end_date=end_date)
+
+    # Keep the transformed data (full precision) for incremental updates
+    key = get_dataset_key(index_list, start_date, end_date)
+    caching.write('frame_' + key, data)
+    json_data = data.to_json(date_unit='ns')
+    if parent_key and parent_key != key:
+        caching.write('parent_' + caching.hash_key('json', json_data), parent_key)
+
+    return json_data
+
+
+def get_dataset_incremental(index_list, start_date, end_date, prev_index, prev_start, prev_end):
+    # Only download and transform the new dates and/or new tickers, returns None if the full dataset is required
+    if start_date != prev_start or end_date < prev_end or not set(prev_index) <= set(index_list):
+        return None
+    data = caching.read('frame_' + get_dataset_key(prev_index, prev_start, prev_end))
+    if data is caching.MISSING:
+        return None
+
+    index_new = [i for i in index_list if i not in prev_index]
+    return data_proc.execute_incremental(data, prev_index, index_new, start_date, prev_end, end_date)
+
+
+def get_parent_dataset(json_data):
+    # Previous dataset of the session from which the dataset was derived, None if unknown
+    parent_key = caching.read('parent_' + caching.hash_key('json', json_data))
+    if parent_key is caching.MISSING:
+        return None
+    parent_json = caching.read(parent_key)
+    if parent_json is caching.MISSING:
+        return None
+
+    return read_dataset(parent_json)
+
+
+def read_dataset(json_data):
+    # Get data from json and restructure multi index
+    key = caching.hash_key('json', json_data)
+    data = dataset_cache.get(key)
+    if isinstance(data, type(None)):
+        data = pd.read_json(json_data)
+        multi_idx = pd.MultiIndex.from_tuples([eval(i) for i in data.columns], names=['freq', 'type', 'index'])
+        data.columns = multi_idx
+        dataset_cache.put(key, data)
+
+    return data
+
+
+def get_exploration(data, freq, parent=None):
+    # Data exploration statistics and return summary
+    # parent: previous dataset, its statistics are reused for unchanged tickers
+    key = caching.hash_key('exploration', data, freq)
+
+    return caching.single_flight(key, _get_exploration, data, freq, parent)
+
+
+def _get_exploration(data, freq, parent=None):
+    if not isinstance(parent, type(None)):
+        prev = caching.read(caching.hash_key('exploration', parent, freq))
+        if prev is not caching.MISSING:
+            return data_expl.execute_incremental(data, freq, parent, prev[0])
+
+    return data_expl.execute(data, freq)
+
+
+def get_correlation(data, freq):
+    # Correlation, covariance and shrinkage covariance of the returns (see support.correlation)
+    key = caching.hash_key('correlation', data, freq)
+
+    return caching.single_flight(key, _get_correlation, data, freq)
+
+
+def _get_correlation(data, freq):
+    import support.correlation as correlation
+    return correlation.execute(data_proc.get_data_slice(data, freq, 'return'))
+
+
+def get_scenarios(data, freq):
+    # Quantile fan of the equal weight portfolio from copula scenarios (see support.copula)
+    key = caching.hash_key('scenarios', data, freq)
+
+    return caching.single_flight(key, _get_scenarios, data, freq)
+
+
+def _get_scenarios(data, freq):
+    import support.copula as copula
+    return copula.execute(data_proc.get_data_slice(data, freq, 'return'), freq)
+
+
+def get_significance(dict_fc_res):
+    # Permutation p-values and bootstrap confidence bands of the validation results per model (see
+    # support.significance). Each model is cached separately under the content hash of its validation results (a
+    # partial validation continued by a later request has other results)
+    dict_significance = OrderedDict()
+    for name, res in dict_fc_res.items():
+        key = caching.hash_key('significance', name, res)
+        dict_significance[name] = caching.single_flight(key, _get_significance, name, res)
+
+    return dict_significance
+
+
+def _get_significance(name, res):
+    import support.significance as significance
+    return significance.execute({name: res})[name]
+
+
+def get_model_settings(model, arma_p, arma_q):
+    # Model name, model module and model_forecast parameters (argv) of a model option
+    # Model modules (statsmodels, prophet) are imported on first use
+    if model == 'Benchmark-positive':
+        return model, import_module('support.model_benchmark'), (True, )
+    elif model == 'Benchmark-negative':
+        return model, import_module('support.model_benchmark'), (False, )
+    elif model == 'ARMA':
+        return f'ARMA({arma_p},{arma_q})', import_module('support.model_arima'), ((arma_p, 0, arma_q), )
+    elif model == 'Prophet':
+        return model, import_module('support.model_prophet'), ()
+    elif model == 'XGBoost':
+        return model, import_module('support.model_xgboost'), ()
+    elif model == 'GARCH':
+        return model, import_module('support.model_garch'), ()
+    elif model == 'Kalman':
+        return model, import_module('support.model_kalman'), ()
+    raise ValueError(f'Unknown model: {model}')
+
+
+def get_pooled_models(models, arma_p, arma_q):
+    # Names of the pooled models (module.POOLED, one model for all tickers) of the model options
+    settings = [get_model_settings(model, arma_p, arma_q) for model in models]
+    return [name for name, module, _ in settings if getattr(module, 'POOLED', False)]
+
+
+def get_forecasts(data, freq, models, arma_p, arma_q, val_steps, parent=None, chunk_size=None, window=None,
+                  deadline=None):
+    # Train models and forecast, returns summary and validation results per model
+    # Each model is cached separately, so results are shared between different model selections
+    # parent: previous dataset, its forecasts are reused for unchanged tickers and validation steps
+    # chunk_size: number of tickers per model run (memory budget, see support.memory_budget), all tickers if None.
+    # Pooled models (module.POOLED, one model for all tickers) can not run in chunks: MemoryBudgetError
+    # window: training window of the models, expanding (None) or rolling (number of observations)
+    # deadline: time.monotonic() after which no further validation steps are started, each model gets an equal share
+    # of the remaining time (time not used by a model is left to the next models). Partial results are not cached
+    # as results, they are kept to continue the validation with the next identical request
+    data_ret = data_proc.get_data_slice(data, freq, 'return')
+    data_key = caching.hash_key(data_ret)
+    if not isinstance(parent, type(None)):
+        parent_ret = data_proc.get_data_slice(parent, freq, 'return')
+        parent_key = caching.hash_key(parent_ret)
+
+    # Loop over models
+    dict_fc_summary, dict_fc_res = OrderedDict(), OrderedDict()
+    for i, model in enumerate(models):
+        name, module, argv = get_model_settings(model, arma_p, arma_q)
+        key = caching.hash_key('forecast', data_key, module.__name__, argv, val_steps, window)
+
+        pooled = getattr(module, 'POOLED', False)
+        kwargs = {'window': window, 'deadline': get_model_deadline(deadline, len(models) - i)}
+        partial = caching.read('partial_' + key)
+        if partial is not caching.MISSING:
+            kwargs.update(get_reuse_kwargs(data_ret, data_ret, partial, pooled))
+        elif not isinstance(parent, type(None)):
+            prev = caching.read(caching.hash_key('forecast', parent_key, module.__name__, argv, val_steps, window))
+            kwargs.update(get_reuse_kwargs(data_ret, parent_ret, prev, pooled))
+
+        def is_complete(result):
+            return (result[0].loc['validation_steps'] >= get_validation_steps(data_ret, val_steps)).all()
+
+        if not isinstance(chunk_size, type(None)) and chunk_size < data_ret.shape[1] and pooled:
+            raise memory_budget.MemoryBudgetError(f'{name} is trained on all tickers at once and can not run in '
+                                                  f'chunks of {chunk_size} tickers (memory budget).')
+        if isinstance(chunk_size, type(None)) or chunk_size >= data_ret.shape[1]:
+            result = caching.single_flight(key, module.execute, data_ret, val_steps, *argv, cache_if=is_complete,
+                                           **kwargs)
+        else:
+            result = caching.single_flight(key, execute_chunked, module, data_ret, val_steps, chunk_size, argv,
+                                           kwargs, cache_if=is_complete)
+        if not is_complete(result):
+            caching.write('partial_' + key, result)
+        dict_fc_summary[name], dict_fc_res[name] = result
+
+    return dict_fc_summary, dict_fc_res
+
+
+def get_model_deadline(deadline, n_models):
+    # Deadline of the next of n_models models: equal share of the remaining time
+    if isinstance(deadline, type(None)):
+        return None
+    now = time.monotonic()
+    return now + max(deadline - now, 0) / n_models
+
+
+def execute_chunked(module, data_ret, val_steps, chunk_size, argv, kwargs):
+    # Model execute in chunks of tickers, the results are identical to the execute of all tickers: the models are
+    # fitted per ticker (not for pooled models), the validation steps and the validation summary are determined for
+    # all tickers
+    val_steps = get_validation_steps(data_ret, val_steps)
+    list_summary, list_res = [], []
+    for i in range(0, data_ret.shape[1], chunk_size):
+        columns = data_ret.columns[i:i + chunk_size]
+        kwargs_chunk = {k: v for k, v in kwargs.items() if k not in ('prev_results', 'prev_forecast')}
+        if 'prev_results' in kwargs:
+            prev_results = kwargs['prev_results']
+            kwargs_chunk['prev_results'] = prev_results.loc[:, prev_results.columns.get_level_values(0).isin(columns)]
+        if 'prev_forecast' in kwargs:
+            prev_forecast = kwargs['prev_forecast']
+            kwargs_chunk['prev_forecast'] = prev_forecast.loc[:, prev_forecast.columns.isin(columns)]
+        summary, res = module.get_model_forecast_and_validation(data_ret.loc[:, columns], val_steps, *argv,
+                                                                **kwargs_chunk)
+        list_summary.append(summary)
+        list_res.append(res)
+
+    forecast_summary, forecast_results = pd.concat(list_summary, axis=1), pd.concat(list_res, axis=1)
+    res_val_summary = module.model_validation_summary(forecast_results)
+    forecast_summary.loc[res_val_summary.index, :] = res_val_summary
+    module.load(forecast_summary, forecast_results)
+
+    return forecast_summary, forecast_results
+
+
+def get_reuse_kwargs(data_ret, prev_ret, prev, pooled=False):
+    # Forecasts of the previous dataset that can be reused (see support.walk_forward)
+    # Validation forecasts are reused for tickers with unchanged history, the 1 step ahead forecast only if no
+    # dates were added. Pooled models (one model for all tickers): only if the history of all tickers is unchanged
+    if prev is caching.MISSING:
+        return dict()
+    prev_summary, prev_results = prev
+    n_prev = prev_ret.shape[0]
+    if data_ret.shape[0] < n_prev or not data_ret.index[:n_prev].equals(prev_ret.index):
+        return dict()
+
+    history = [ts for ts in prev_ret.columns
+               if ts in data_ret.columns and data_ret[ts].iloc[:n_prev].equals(prev_ret[ts])]
+    if pooled and set(history) != set(data_ret.columns):
+        return dict()
+    kwargs = {'prev_results': prev_results.loc[:, (history, slice(None))]}
+    if data_ret.shape[0] == n_prev:
+        kwargs['prev_forecast'] = prev_summary.loc[['invest', 'forecast', 'ci_lower', 'ci_upper'], history]
+
+    return kwargs
@@ -0,0 +1,118 @@
+""" Library for portfolio backtests: one portfolio per model from the walk-forward forecasts of all time series
+The signals of a model (invest: forecast > 0) are combined in a long-only portfolio that is rebalanced every step
+of the frequency. Weighting schemes of the invested time series: equal weights, inverse volatility (standard deviation
+of the last VOL_WINDOW returns before the step) and signal strength (forecast / width of the confidence interval);
+without invested time series the portfolio is in cash. Costs are charged per unit of turnover from the drifted
+weights of the previous step to the new weights.
+The schemes are evaluated one at a time on arrays with dimensions (model, time series, step) of the validation
+results (support.strategy_metrics.get_arrays), the net asset values and risk metrics are array operations over all
+models and steps.
+
+"""
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import support.result_writer as result_writer
+from support.memory_budget import PERIODS_PER_YEAR
+from support.strategy_metrics import get_arrays, STRATEGY_COST
+
+VOL_WINDOW = int(os.environ.get('PORTFOLIO_VOL_WINDOW', 20))  # returns of the inverse volatility weights
+MIN_PERIODS = 5  # minimum number of returns of the volatility
+SCHEMES = ('equal', 'inverse_volatility', 'signal_strength')
+METRICS = ('payout_from_100', 'annual_return', 'volatility', 'sharpe_ratio', 'max_drawdown', 'value_at_risk',
+           'turnover', 'exposure')
+VAR_LEVEL = 0.05  # historical value at risk of the step returns
+
+
+def get_weights(values, vol, scheme):
+    # Weights with dimensions (model, time series, step), the weights of a step sum to 1 (or 0: cash)
+    actual, forecast = values[..., 0], values[..., 1]
+    signal = ~np.isnan(actual) & (forecast > 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if scheme == 'equal':
+            strength = signal.astype(float)
+        elif scheme == 'inverse_volatility':
+            # Time series without volatility: mean inverse volatility of the step (equal weights if none)
+            inv = np.where(vol > 0, 1 / vol, np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                inv_mean = np.nanmean(np.where(signal, inv, np.nan), axis=1, keepdims=True)
+            inv = np.where(np.isnan(inv), np.where(np.isnan(inv_mean), 1, inv_mean), inv)
+            strength = np.where(signal, inv, 0)
+        elif scheme == 'signal_strength':
+            width = values[..., 3] - values[..., 2]
+            strength = np.where(signal, np.where(width > 0, forecast / width, forecast), 0)
+        else:
+            raise ValueError(f'Unknown weighting scheme: {scheme}')
+
+        total = strength.sum(axis=1, keepdims=True)
+        return np.where(total > 0, strength / total, 0)
+
+
+def calculate(values, vol, schemes=SCHEMES, cost=STRATEGY_COST, periods_per_year=12):
+    # Net asset values (scheme, model, step) and metrics (dictionary of arrays with dimensions (scheme, model))
+    actual = np.nan_to_num(values[..., 0])
+    nav, metrics = [], {m: [] for m in METRICS}
+    for scheme in schemes:
+        weights = get_weights(values, vol, scheme)
+
+        # Portfolio return, drifted weights at the end of the step and turnover from the drifted weights
+        port = (weights * actual).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            drift = np.nan_to_num(weights * (1 + actual) / (1 + port[:, None, :]))
+        prev = np.concatenate([np.zeros(drift.shape[:-1] + (1, )), drift[..., :-1]], axis=-1)
+        turnover = np.abs(weights - prev).sum(axis=1)
+        ret = port - cost * turnover
+
+        nav_s = 100 * np.cumprod(1 + ret, axis=-1)
+        drawdown = nav_s / np.maximum.accumulate(np.maximum(nav_s, 100), axis=-1) - 1
+        n = ret.shape[-1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = ret.std(axis=-1, ddof=1) if n > 1 else np.full(ret.shape[:-1], np.nan)
+            last = nav_s[..., -1] if n else np.full(ret.shape[:-1], 100.0)
+            metrics['payout_from_100'].append(last)
+            metrics['annual_return'].append((last / 100) ** (periods_per_year / max(n, 1)) - 1)
+            metrics['volatility'].append(std * np.sqrt(periods_per_year))
+            metrics['sharpe_ratio'].append(ret.mean(axis=-1) / std * np.sqrt(periods_per_year))
+            metrics['max_drawdown'].append(drawdown.min(axis=-1, initial=0))
+            metrics['value_at_risk'].append(-np.quantile(ret, VAR_LEVEL, axis=-1) if n else np.full(std.shape, np.nan))
+            metrics['turnover'].append(turnover.mean(axis=-1))
+            metrics['exposure'].append(weights.sum(axis=1).mean(axis=-1))
+        nav.append(nav_s)
+
+    # Models without validation steps (time budget): no metrics
+    steps = (~np.isnan(values[..., 0]) & ~np.isnan(values[..., 1])).any(axis=1).sum(axis=-1)
+    return np.stack(nav), {k: np.where(steps > 0, np.stack(v), np.nan) for k, v in metrics.items()}
+
+
+def get_volatility(data_ret, index, tickers):
+    # Standard deviation of the last VOL_WINDOW returns before the steps: array with dimensions (time series, step)
+    vol = data_ret.rolling(VOL_WINDOW, min_periods=MIN_PERIODS).std().shift(1)
+    return vol.reindex(index=index, columns=tickers).values.astype(float).T
+
+
+def load(nav, metrics):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(portfolio_nav=nav, portfolio_metrics=metrics)
+
+    return
+
+
+def execute(dict_fc_res, data_ret, freq, schemes=SCHEMES, cost=STRATEGY_COST):
+    # Portfolio backtest of the validation results per model and weighting scheme: net asset values (date x (model,
+    # scheme)) and metrics (rows metric, columns (model, scheme))
+    values, tickers, index = get_arrays(dict_fc_res)
+    vol = get_volatility(data_ret, index, tickers)
+    nav, metrics = calculate(values, vol, schemes, cost, PERIODS_PER_YEAR[freq])
+
+    # Arrays (scheme, model, ...) -> columns (model, scheme)
+    multi_idx = pd.MultiIndex.from_product([list(dict_fc_res), list(schemes)], names=['model', 'scheme'])
+    df_nav = pd.DataFrame(nav.transpose(1, 0, 2).reshape(-1, len(index)).T, index=index, columns=multi_idx)
+    df_metrics = pd.DataFrame([metrics[m].T.reshape(-1) for m in METRICS], index=list(METRICS), columns=multi_idx)
+    load(df_nav, df_metrics)
+
+    return {'nav': df_nav, 'metrics': df_metrics}
@@ -0,0 +1,163 @@
+""" Library for the price store: memory-mapped daily price grid on disk
+The business day grid of extract/transform (last price per business day, forward filled) is stored as a fixed dtype
+matrix (prices.npy, dates x tickers, column major: the prices of a ticker are contiguous) with a small metadata index
+(meta.json: first date, number of dates, tickers and their first and last row). Views of selected tickers and dates
+are zero-copy slices of the memory map, only the pages of the selected prices are read from disk. Views are accepted
+by data_processing.get_data_slice and the data exploration and model functions.
+
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import support.data_processing as data_proc
+
+DTYPE = np.float64
+
+
+class PriceView(object):
+    # Prices of selected tickers and dates: values is a view of the memory map (a copy for non-adjacent tickers)
+
+    def __init__(self, values, index, columns):
+        self.values, self.index, self.columns = values, index, columns
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def get_prices(self):
+        # Business day prices (dataframe on the values, no copy)
+        return pd.DataFrame(self.values, index=self.index, columns=self.columns, copy=False)
+
+    def get_data_slice(self, freq, type):
+        # See data_processing.get_data_slice: level or return of frequency freq
+        data_out = self.get_prices()
+        if freq != 'B':
+            data_out = data_proc.resample(data_out, freq)
+        if type == 'return':
+            data_out = data_out.pct_change()
+
+        # Drop leading and trailing dates without prices (slices of the view)
+        rows = np.flatnonzero(data_out.notna().values.any(axis=1))
+        if not len(rows):
+            return data_out.iloc[:0, :0]
+        data_out = data_out.iloc[rows[0]:rows[-1] + 1, ]
+        if data_out.isna().values.all(axis=0).any():
+            data_out = data_out.dropna(how='all', axis=1)
+        if freq != 'B':
+            data_out = data_out.asfreq(freq)
+
+        return data_out
+
+
+class PriceStore(object):
+    # Memory-mapped price grid in directory path
+
+    def __init__(self, path):
+        self.path = path if path.endswith('/') else path + '/'
+        self.meta, self._values = None, None
+        if os.path.exists(self.path + 'meta.json'):
+            with open(self.path + 'meta.json') as f:
+                self.meta = json.load(f)
+
+    def exists(self):
+        return not isinstance(self.meta, type(None))
+
+    @property
+    def dates(self):
+        return pd.bdate_range(self.meta['start'], periods=self.meta['n_dates'], name='Date')
+
+    @property
+    def tickers(self):
+        return self.meta['tickers']
+
+    def covers(self, tickers, start_date, end_date):
+        # All tickers and the business days from start_date until end_date (exclusive) are in the price grid
+        if not self.exists() or not set(tickers) <= set(self.tickers):
+            return False
+        dates, requested = self.dates, pd.bdate_range(start_date, pd.Timestamp(end_date) - pd.offsets.Day(1))
+        return len(requested) == 0 or (requested[0] >= dates[0] and requested[-1] <= dates[-1])
+
+    def get_positions(self, tickers):
+        positions = {ts: i for i, ts in enumerate(self.tickers)}
+        return np.array([positions[ts] for ts in tickers], dtype=int)
+
+    @property
+    def values(self):
+        # Read-only memory map of the price grid (opened on first use)
+        if isinstance(self._values, type(None)):
+            self._values = np.load(self.path + 'prices.npy', mmap_mode='r')
+        return self._values
+
+    def create(self, tickers, start_date, end_date):
+        # Allocate the price grid (missing values) for the business days from start_date until end_date (exclusive)
+        os.makedirs(self.path, exist_ok=True)
+        dates = pd.bdate_range(start_date, pd.Timestamp(end_date) - pd.offsets.Day(1))
+        tickers = sorted(set(tickers))
+        values = np.lib.format.open_memmap(self.path + 'prices.npy', mode='w+', dtype=DTYPE,
+                                           shape=(len(dates), len(tickers)), fortran_order=True)
+        values[:] = np.nan
+        values.flush()
+        self.meta = {'start': dates[0].strftime('%Y-%m-%d'), 'n_dates': len(dates), 'tickers': tickers,
+                     'first_row': [-1] * len(tickers), 'last_row': [-1] * len(tickers)}
+        self._values = None
+        self.write_meta()
+
+    def write_prices(self, data):
+        # Write prices of extract (tickers in columns) to the grid: last price per business day, forward filled
+        data = data.groupby(pd.Grouper(freq='B')).last().reindex(self.dates)
+        valid = data.notna().values
+        data = data.fillna(method='ffill')
+        positions = self.get_positions(data.columns)
+        values = np.load(self.path + 'prices.npy', mmap_mode='r+')
+        for i, (pos, ts) in enumerate(zip(positions, data.columns)):
+            values[:, pos] = data[ts].values
+            rows = np.flatnonzero(valid[:, i])
+            self.meta['first_row'][pos] = int(rows[0]) if len(rows) else -1
+            self.meta['last_row'][pos] = int(rows[-1]) if len(rows) else -1
+        values.flush()
+        self.write_meta()
+
+    def write_meta(self):
+        with open(self.path + 'meta.json.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self.path + 'meta.json.tmp', self.path + 'meta.json')
+
+    def select(self, tickers=None, start_date=None, end_date=None):
+        # View of tickers (all tickers with prices if None) from start_date until end_date (exclusive)
+        tickers = [ts for ts, last in zip(self.tickers, self.meta['last_row']) if last >= 0] \
+            if isinstance(tickers, type(None)) else sorted(set(tickers) & set(self.tickers))
+        positions = self.get_positions(tickers)
+
+        # The dates start at the first and end at the last date with prices, as the business day grid of transform
+        dates = self.dates
+        row_start = 0 if isinstance(start_date, type(None)) else dates.searchsorted(pd.Timestamp(start_date))
+        row_end = len(dates) if isinstance(end_date, type(None)) else dates.searchsorted(pd.Timestamp(end_date))
+        first_row = [self.meta['first_row'][p] for p in positions if self.meta['first_row'][p] >= 0]
+        if first_row:
+            row_start = max(row_start, min(first_row))
+            row_end = min(row_end, max(self.meta['last_row'][p] for p in positions) + 1)
+        rows = slice(row_start, max(row_start, row_end))
+
+        if len(positions) and (np.diff(positions) == 1).all():
+            values = self.values[rows, positions[0]:positions[-1] + 1]  # adjacent tickers: view
+        else:
+            values = self.values[rows][:, positions]
+
+        return PriceView(values, dates[rows], pd.Index(tickers))
+
+
+def build(path, index, start_date, end_date, chunk_size=250, log=print):
+    # Extract the prices of the tickers in blocks of chunk_size tickers and write them to the price store
+    store = PriceStore(path)
+    store.create(index, start_date, end_date)
+    for i in range(0, len(store.tickers), chunk_size):
+        tickers = store.tickers[i:i + chunk_size]
+        log(f'Price store: tickers {i + 1}-{i + len(tickers)} of {len(store.tickers)}...')
+        data = data_proc.extract(tickers, start_date, end_date)
+        if not data.empty:
+            store.write_prices(data)
+
+    return store
@@ -0,0 +1,116 @@
+""" Library for asynchronous result persistence: the load() functions of the modules
+Results are queued and written by a background thread (per process), so that requests do not wait on writing the
+results of the load() functions (the disk cache of support.caching is still written on the request path). The writer
+drains the queue in batches, with policy 'latest' only the last result per file of a batch is written (the earlier
+results are counted as superseded).
+OUTPUT_POLICY: none (no output), latest (output/<name>.pkl, overwritten) or history (output/history/<time>_<name>.pkl)
+OUTPUT_FORMAT: pickle (compact binary, pandas.read_pickle) or csv
+Results are dropped (and counted) if the queue is full. The queue is flushed at the exit of the process.
+
+"""
+import atexit
+import os
+import queue
+import threading
+import traceback
+from datetime import datetime
+
+OUTPUT_POLICY = os.environ.get('OUTPUT_POLICY', 'latest')
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'pickle')
+QUEUE_SIZE = int(os.environ.get('OUTPUT_QUEUE_SIZE', 64))
+FLUSH_TIMEOUT = 30  # seconds
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_writer = dict()
+_writer_lock = threading.Lock()
+_stats = {'queued': 0, 'written': 0, 'superseded': 0, 'dropped': 0, 'failed': 0}
+
+
+def save(**frames):
+    # Queue dataframes for writing, the keyword is the file name: save(data_statistics=stats)
+    if OUTPUT_POLICY == 'none':
+        return
+    start_writer()
+    timestamp = datetime.now()
+    for name, frame in frames.items():
+        try:
+            # Shallow copy: later changes of the index or columns by the caller are not written
+            _queue.put_nowait((timestamp, name, frame.copy(deep=False)))
+            _stats['queued'] += 1
+        except queue.Full:
+            _stats['dropped'] += 1
+
+
+def start_writer():
+    # Start the writer thread once per process (gunicorn workers are forked after the import)
+    # A forked process gets a new queue: the queue of the parent may be locked by the writer of the parent
+    global _queue
+    pid = os.getpid()
+    if _writer.get('pid') == pid:
+        return
+    with _writer_lock:
+        if _writer.get('pid') != pid:
+            _queue = queue.Queue(maxsize=QUEUE_SIZE)
+            thread = threading.Thread(target=writer_loop, name='result-writer', daemon=True)
+            thread.start()
+            _writer.update({'pid': pid, 'thread': thread})
+
+
+def writer_loop():
+    while True:
+        batch = [_queue.get()]
+        while True:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if OUTPUT_POLICY == 'latest':
+            # Only the last result per file name is written
+            latest = {name: (timestamp, name, frame) for timestamp, name, frame in batch}
+            _stats['superseded'] += len(batch) - len(latest)
+            items = latest.values()
+        else:
+            items = batch
+        for timestamp, name, frame in items:
+            try:
+                write(timestamp, name, frame)
+                _stats['written'] += 1
+            except Exception:
+                _stats['failed'] += 1
+                traceback.print_exc()
+        for _ in batch:
+            _queue.task_done()
+
+
+def get_file_path(timestamp, name):
+    output_path = os.getcwd() + '/output/'
+    if OUTPUT_POLICY == 'history':
+        output_path += 'history/'
+        name = timestamp.strftime('%Y%m%d_%H%M%S_%f_') + name
+    if not os.path.exists(output_path):
+        os.makedirs(output_path, exist_ok=True)
+    return output_path + name + ('.csv' if OUTPUT_FORMAT == 'csv' else '.pkl')
+
+
+def write(timestamp, name, frame):
+    # Write to a temporary file and rename: readers never see a partial file
+    file_path = get_file_path(timestamp, name)
+    tmp_path = file_path + f'.{os.getpid()}.tmp'
+    if OUTPUT_FORMAT == 'csv':
+        frame.to_csv(tmp_path)
+    else:
+        frame.to_pickle(tmp_path, compression=None)
+    os.replace(tmp_path, file_path)
+
+
+def flush(timeout=FLUSH_TIMEOUT):
+    # Wait until the queued results are written (scripts, exit of the process)
+    if _writer.get('pid') != os.getpid():
+        return
+    done = threading.Event()
+    threading.Thread(target=lambda: (_queue.join(), done.set()), daemon=True).start()
+    done.wait(timeout)
+
+
+atexit.register(flush)
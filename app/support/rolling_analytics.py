@@ -0,0 +1,179 @@
+""" Library for rolling analytics: rolling volatility, Sharpe ratio, beta and drawdown of all time series
+The statistics of a window of the last window periods follow from running sums: the batch calculation uses
+cumulative sums (window sum = difference of two cumulative sums) and the rolling maximum of van Herk/Gil-Werman
+(prefix and suffix maxima of blocks of window rows), both vectorized over all time series. New periods are added
+with the streaming state (ring buffer of the last window returns with running sums and a monotonic deque of the
+levels per time series): O(1) per period and time series. The results are checkpointed (per process), a dataset with
+new dates and unchanged history only streams the new periods.
+
+"""
+import threading
+import warnings
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import support.data_processing as data_proc
+from support.caching import hash_key, MemoryCache
+from support.memory_budget import PERIODS_PER_YEAR
+from support.tracing import span
+
+MIN_PERIODS = 0.8  # minimum share of valid returns in a window
+METRICS = ('volatility', 'sharpe_ratio', 'beta', 'drawdown')
+
+# Checkpoints per time series, frequency, window and market index: dates, data hash, streaming state and results
+rolling_cache = MemoryCache(maxsize=8)
+_checkpoint_lock = threading.Lock()  # the streaming state of a checkpoint is updated in place
+
+# Running sums of a window: returns (r), market index returns (m) and pairs of valid returns and market returns (p)
+SUMS = ('n_r', 'r', 'r2', 'n_p', 'p_r', 'p_m', 'p_m2', 'p_rm')
+
+
+def get_terms(ret, market):
+    # Terms of the running sums per period, missing values are zero terms
+    valid_r = ~np.isnan(ret)
+    valid_p = valid_r & ~np.isnan(market)
+    r = np.where(valid_r, ret, 0)
+    p_r, p_m = np.where(valid_p, ret, 0), np.where(valid_p, market, 0)
+    return {'n_r': valid_r.astype(float), 'r': r, 'r2': r ** 2, 'n_p': valid_p.astype(float), 'p_r': p_r,
+            'p_m': p_m, 'p_m2': p_m ** 2, 'p_rm': p_r * p_m}
+
+
+def get_metrics(sums, level, max_level, window, freq):
+    # Annualised volatility and Sharpe ratio, beta and drawdown from the running sums of the windows
+    ann = np.sqrt(PERIODS_PER_YEAR[freq])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_r, n_p = sums['n_r'], sums['n_p']
+        mean = sums['r'] / n_r
+        std = np.sqrt(np.maximum(sums['r2'] - sums['r'] * mean, 0) / (n_r - 1))
+        cov = (sums['p_rm'] - sums['p_r'] * sums['p_m'] / n_p) / (n_p - 1)
+        var_m = (sums['p_m2'] - sums['p_m'] ** 2 / n_p) / (n_p - 1)
+
+        metrics = {'volatility': np.where(n_r >= MIN_PERIODS * window, std * ann, np.nan),
+                   'sharpe_ratio': np.where(n_r >= MIN_PERIODS * window, mean / std * ann, np.nan),
+                   'beta': np.where(n_p >= MIN_PERIODS * window, cov / var_m, np.nan),
+                   'drawdown': level / max_level - 1}
+    return metrics
+
+
+def window_sum(x, window):
+    # Sum of the last window rows (fewer at the start) from the cumulative sum
+    cs = np.concatenate([np.zeros((1, ) + x.shape[1:]), np.cumsum(x, axis=0)])
+    idx = np.arange(1, x.shape[0] + 1)
+    return cs[idx] - cs[np.maximum(idx - window, 0)]
+
+
+def rolling_max(x, window):
+    # Maximum of the last window rows (van Herk/Gil-Werman), missing values are ignored
+    n_obs = x.shape[0]
+    pad = np.full(((-n_obs) % window, ) + x.shape[1:], np.nan)
+    blocks = np.concatenate([x, pad]).reshape((-1, window) + x.shape[1:])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        prefix = np.fmax.accumulate(blocks, axis=1).reshape((-1, ) + x.shape[1:])[:n_obs]
+        suffix = np.fmax.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape((-1, ) + x.shape[1:])[:n_obs]
+    out = prefix.copy()
+    out[window - 1:] = np.fmax(suffix[:n_obs - window + 1], prefix[window - 1:])
+    return out
+
+
+def calculate(level, ret, market, window, freq):
+    # Batch calculation for arrays with dimensions (date, time series), market: (date, )
+    terms = get_terms(ret, market[:, None])
+    sums = {k: window_sum(v, window) for k, v in terms.items()}
+    return get_metrics(sums, level, rolling_max(level, window), window, freq)
+
+
+def init_state(level, ret, market, window):
+    # Streaming state from the last window periods of the batch calculation
+    n_obs, n_ts = ret.shape
+    buffer_r, buffer_m = np.full((window, n_ts), np.nan), np.full(window, np.nan)
+    tail = min(window, n_obs)
+    buffer_r[window - tail:], buffer_m[window - tail:] = ret[n_obs - tail:], market[n_obs - tail:]
+    terms = get_terms(buffer_r, buffer_m[:, None])
+
+    # Monotonic deques: (period, level) with decreasing levels, the front is the maximum of the window
+    deques = [deque() for _ in range(n_ts)]
+    for t in range(n_obs - tail, n_obs):
+        for i in np.flatnonzero(~np.isnan(level[t])):
+            push(deques[i], t, level[t, i], window)
+
+    return {'buffer_r': buffer_r, 'buffer_m': buffer_m, 'pos': 0, 't': n_obs, 'window': window,
+            'sums': {k: v.sum(axis=0) for k, v in terms.items()}, 'deques': deques}
+
+
+def push(dq, t, value, window):
+    # Add a value to the monotonic deque and remove the values outside of the window
+    while dq and dq[-1][1] <= value:
+        dq.pop()
+    dq.append((t, value))
+    while dq[0][0] <= t - window:
+        dq.popleft()
+
+
+def update(state, level, ret, market, freq):
+    # Add the period (level and return of all time series, market return): returns the metrics of the period
+    window, pos, t = state['window'], state['pos'], state['t']
+    old = get_terms(state['buffer_r'][pos], state['buffer_m'][pos])
+    new = get_terms(ret, market)
+    for k in SUMS:
+        state['sums'][k] = state['sums'][k] - old[k] + new[k]
+    state['buffer_r'][pos], state['buffer_m'][pos] = ret, market
+    state['pos'], state['t'] = (pos + 1) % window, t + 1
+
+    max_level = np.full(len(level), np.nan)
+    for i, dq in enumerate(state['deques']):
+        if not np.isnan(level[i]):
+            push(dq, t, level[i], window)
+        while dq and dq[0][0] <= t - window:
+            dq.popleft()
+        if dq:
+            max_level[i] = dq[0][1]
+
+    return get_metrics(state['sums'], level, max_level, window, freq)
+
+
+def get_inputs(data, freq, market):
+    # Levels and returns with the same dates and columns, returns of the market index (nan if not in the data)
+    level = data_proc.get_data_slice(data, freq, 'level')
+    ret = data_proc.get_data_slice(data, freq, 'return').reindex(index=level.index, columns=level.columns)
+    market_ret = ret[market] if market in ret.columns else pd.Series(np.nan, index=ret.index)
+    return level, ret, market_ret
+
+
+def get_results(values, index, columns):
+    return {m: pd.DataFrame(values[m], index=index, columns=columns) for m in METRICS}
+
+
+def execute(data, freq, window, market):
+    # Rolling analytics per metric (dataframes with dimensions date x time series), continued from the checkpoint if
+    # the history of the checkpoint is unchanged
+    level, ret, market_ret = get_inputs(data, freq, market)
+    key = hash_key('rolling', list(level.columns), freq, window, market)
+    with _checkpoint_lock:
+        checkpoint = rolling_cache.get(key)
+        if not isinstance(checkpoint, type(None)):
+            n = len(checkpoint['index'])
+            if n <= len(level.index) and level.index[:n].equals(checkpoint['index']) and \
+                    hash_key(level.iloc[:n, ]) == checkpoint['hash']:
+                results, state = checkpoint['results'], checkpoint['state']
+                if n < len(level.index):
+                    # Stream the new periods
+                    with span('rolling.update', tickers=level.shape[1], rows=len(level.index) - n):
+                        rows = [update(state, *v, freq) for v in zip(level.values[n:], ret.values[n:],
+                                                                      market_ret.values[n:])]
+                    new = {m: np.array([r[m] for r in rows]) for m in METRICS}
+                    results = {m: pd.concat([results[m], df]) for m, df in
+                               get_results(new, level.index[n:], level.columns).items()}
+                    rolling_cache.put(key, {'index': level.index, 'hash': hash_key(level), 'state': state,
+                                            'results': results})
+                return results
+
+    with span('rolling.calculate', tickers=level.shape[1], rows=level.shape[0]):
+        values = calculate(level.values, ret.values, market_ret.values, window, freq)
+        state = init_state(level.values, ret.values, market_ret.values, window)
+    results = get_results(values, level.index, level.columns)
+    rolling_cache.put(key, {'index': level.index, 'hash': hash_key(level), 'state': state, 'results': results})
+
+    return results
@@ -0,0 +1,134 @@
+""" Library for significance tests of the walk-forward validation results: accuracy and payout_from_100
+Permutation test: the positions (invest if forecast > 0) are permuted over the validation steps, the p-value is the
+share of permutations with an accuracy (payout) of at least the accuracy (payout) of the forecasts: H_0 = the timing
+of the forecasts has no value. Moving block bootstrap: blocks of validation steps are resampled (autocorrelation of
+the returns is kept), the 2.5% and 97.5% quantiles are the confidence band.
+The resamples only permute and resample the valid steps of a model and time series (the steps with an actual return
+and a forecast): the series with the same number of valid steps are evaluated together as array operations in chunks
+of resamples, the memory of the chunks in flight on the thread pool is bounded by SIGNIFICANCE_MEMORY_MB. Every block
+of RESAMPLE_BLOCK resamples has its own random generator (spawned from the seed and the number of valid steps): the
+results of a series do not depend on the other models and time series, the chunk size or the number of threads.
+
+"""
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from support.strategy_metrics import get_arrays
+
+N_RESAMPLES = int(os.environ.get('SIGNIFICANCE_RESAMPLES', 2000))
+SEED = int(os.environ.get('SIGNIFICANCE_SEED', 0))
+MEMORY_MB = float(os.environ.get('SIGNIFICANCE_MEMORY_MB', 64))  # memory of the resampled arrays of all threads
+ALPHA = 0.05  # confidence band = [0.025, 0.975]
+RESAMPLE_BLOCK = 50  # resamples per random generator
+# Arrays (series, resample, step) of 8 bytes in resample_chunk and get_statistics: resampled actual and positions,
+# valid mask and comparisons, filled copies, products and the factors of the payout
+TEMPORARIES = 12
+
+
+def get_statistics(actual, pos):
+    # Accuracy (sign of the return forecasted correctly) and payout from 100 over the last axis, nan: no forecast
+    valid = ~np.isnan(actual) & ~np.isnan(pos)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accuracy = (valid & ((actual > 0) == (pos > 0))).sum(axis=-1) / valid.sum(axis=-1)
+    payout = np.prod(1 + np.where(valid, np.nan_to_num(actual) * np.nan_to_num(pos), 0), axis=-1) * 100
+    return accuracy, payout
+
+
+def get_block_indices(rng, n_resamples, n_steps, block_length):
+    # Moving block bootstrap: indices with dimensions (resample, step) of consecutive blocks with random starts
+    n_blocks = -(-n_steps // block_length)
+    starts = rng.integers(0, n_steps - block_length + 1, (n_resamples, n_blocks))
+    return (starts[:, :, None] + np.arange(block_length)).reshape(n_resamples, -1)[:, :n_steps]
+
+
+def get_resample_indices(seeds, sizes, n_steps, block_length):
+    # Permutations and moving block bootstrap indices (resample, step) of blocks of resamples with their own generator
+    perm, idx = [], []
+    for seed, size in zip(seeds, sizes):
+        rng = np.random.default_rng(seed)
+        perm.append(rng.permuted(np.tile(np.arange(n_steps), (size, 1)), axis=1))
+        idx.append(get_block_indices(rng, size, n_steps, block_length))
+    return np.concatenate(perm), np.concatenate(idx)
+
+
+def resample_chunk(actual, pos, observed, seeds, sizes, block_length):
+    # Permutation counts and bootstrap statistics of a chunk of resamples (arrays (..., resample))
+    perm, idx = get_resample_indices(seeds, sizes, actual.shape[-1], block_length)
+    acc_perm, pay_perm = get_statistics(actual[..., None, :], pos[..., perm])
+    with np.errstate(invalid='ignore'):
+        counts = ((acc_perm >= observed[0][..., None]).sum(axis=-1), (pay_perm >= observed[1][..., None]).sum(axis=-1))
+
+    boot = get_statistics(actual[..., idx], pos[..., idx])
+
+    return counts, boot
+
+
+def calculate(values, n_resamples=N_RESAMPLES, seed=SEED, workers=None):
+    # P-values and confidence bands of accuracy and payout, values: array (..., step, type), see FORECAST_TYPES
+    actual = values[..., 0].reshape(-1, values.shape[-2])
+    pos = np.where(np.isnan(values[..., 1]), np.nan, (values[..., 1] > 0).astype(float)).reshape(actual.shape)
+    valid = ~np.isnan(actual) & ~np.isnan(pos)
+    n_valid = valid.sum(axis=-1)
+    names = [s + k for s in ('accuracy', 'payout_from_100') for k in ('_p_value', '_ci_lower', '_ci_upper')]
+    results = {k: np.full(actual.shape[0], np.nan) for k in names}
+
+    # Series with the same number of valid steps: arrays (series, valid step) of the valid steps
+    workers = workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for n_steps in np.unique(n_valid[n_valid >= 2]):
+            rows = np.flatnonzero(n_valid == n_steps)
+            shape = (len(rows), n_steps)
+            res = calculate_group(actual[rows][valid[rows]].reshape(shape), pos[rows][valid[rows]].reshape(shape),
+                                  n_resamples, seed, pool, workers)
+            for k in names:
+                results[k][rows] = res[k]
+
+    return {k: v.reshape(values.shape[:-2]) for k, v in results.items()}
+
+
+def calculate_group(actual, pos, n_resamples, seed, pool, workers):
+    # P-values and confidence bands of series without missing steps, arrays (series, step)
+    observed = get_statistics(actual, pos)
+    n_steps = actual.shape[-1]
+    block_length = max(1, int(round(n_steps ** (1 / 3))))
+
+    # Blocks of resamples with their own generator, chunks of blocks: the temporary arrays of the chunks that run at
+    # once are within the memory budget (at least one block per chunk and one chunk in flight)
+    blocks = [min(RESAMPLE_BLOCK, n_resamples - i) for i in range(0, n_resamples, RESAMPLE_BLOCK)]
+    seeds = np.random.SeedSequence([seed, int(n_steps)]).spawn(len(blocks))
+    block_bytes = TEMPORARIES * 8 * max(actual.size, 1) * RESAMPLE_BLOCK
+    chunk_size = max(1, int(MEMORY_MB * 2 ** 20 / (workers * block_bytes)))
+    in_flight = max(1, min(workers, int(MEMORY_MB * 2 ** 20 / (chunk_size * block_bytes))))
+    args = [(seeds[i:i + chunk_size], blocks[i:i + chunk_size]) for i in range(0, len(blocks), chunk_size)]
+    chunks = []
+    for i in range(0, len(args), in_flight):
+        chunks += pool.map(lambda a: resample_chunk(actual, pos, observed, *a, block_length), args[i:i + in_flight])
+
+    results = dict()
+    for i, name in enumerate(('accuracy', 'payout_from_100')):
+        count = sum(c[0][i] for c in chunks)
+        boot = np.concatenate([c[1][i] for c in chunks], axis=-1)
+        with np.errstate(invalid='ignore'):
+            results[name + '_p_value'] = np.where(np.isnan(observed[i]), np.nan, (1 + count) / (1 + n_resamples))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            results[name + '_ci_lower'] = np.nanquantile(boot, ALPHA / 2, axis=-1)
+            results[name + '_ci_upper'] = np.nanquantile(boot, 1 - ALPHA / 2, axis=-1)
+
+    return results
+
+
+def execute(dict_fc_res, n_resamples=N_RESAMPLES, seed=SEED):
+    # Significance of the validation results per model: rows p-values and confidence bands, columns time series
+    values, tickers, _ = get_arrays(dict_fc_res)
+    results = calculate(values, n_resamples, seed)
+
+    dict_significance = dict()
+    for m, model in enumerate(dict_fc_res):
+        dict_significance[model] = pd.DataFrame([v[m] for v in results.values()], index=list(results),
+                                                columns=tickers)
+    return dict_significance
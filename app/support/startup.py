@@ -0,0 +1,93 @@
+""" Library for fork friendly startup
+Heavy modules (prophet, statsmodels, plotly figure factory, yfinance) are imported on first use. In preload mode
+(PRELOAD_APP=1, see gunicorn.conf.py) they are imported once in the gunicorn master together with the layouts, the
+warmed caches and the Stan model, so that the workers share this state copy-on-write.
+
+"""
+import gc
+import os
+import time
+import traceback
+from datetime import datetime
+from importlib import import_module
+
+PRELOAD = os.environ.get('PRELOAD_APP', '0') == '1'
+PROCESS_START = time.time()
+
+HEAVY_MODULES = ['support.model_benchmark', 'support.model_arima', 'support.model_prophet', 'support.model_xgboost',
+                 'support.model_garch', 'support.model_kalman', 'statsmodels.api', 'statsmodels.tsa.stattools',
+                 'plotly.figure_factory', 'plotly.subplots', 'pandas_datareader.data', 'yfinance']
+
+
+def get_memory_usage():
+    # Resident memory of the current process in MB (Linux): rss, pss (shared pages divided over the processes)
+    # and uss (private pages)
+    usage = dict()
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['rss'] = int(line.split()[1]) / 1024
+        with open('/proc/self/smaps_rollup') as f:
+            private = 0
+            for line in f:
+                key, value = line.split()[:2]
+                if key == 'Pss:':
+                    usage['pss'] = int(value) / 1024
+                elif key in ('Private_Clean:', 'Private_Dirty:'):
+                    private += int(value) / 1024
+            usage['uss'] = private
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def report(stage, start=None):
+    # Print the elapsed startup time and memory usage of the current process
+    start = PROCESS_START if isinstance(start, type(None)) else start
+    usage = ', '.join(f'{k}={v:.0f}MB' for k, v in get_memory_usage().items())
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f'{timestamp}: [startup] {stage} (pid {os.getpid()}): {time.time() - start:.2f}s, {usage}', flush=True)
+
+
+def preload_stan_model():
+    # Load the Stan backend once (the compiled model is read from disk on each Prophet instance otherwise)
+    try:
+        from prophet import Prophet
+        Prophet()
+    except Exception:
+        traceback.print_exc()
+
+
+def preload_caches():
+    # Parse the warmed datasets into the in-memory dataset cache
+    import support.cache_warming as cache_warming
+    import support.caching as caching
+    import support.pipeline as pipeline
+
+    settings = cache_warming.get_settings()
+    start_date = datetime.strptime(settings['start_date'], "%Y-%m-%d")
+    end_date = datetime.strptime(datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+    for index_list in settings['universes'].values():
+        json_data = caching.read(pipeline.get_dataset_key(index_list, start_date, end_date))
+        if json_data is not caching.MISSING:
+            pipeline.read_dataset(json_data)
+
+
+def preload():
+    # Initialise shared read-only state in the gunicorn master (before the workers are forked)
+    start = time.time()
+    for module in HEAVY_MODULES:
+        try:
+            import_module(module)
+        except ImportError:
+            traceback.print_exc()
+    import_module('support.dash_layouts')
+    preload_stan_model()
+    preload_caches()
+
+    # Move all objects to the permanent generation: the garbage collector of the workers does not touch (and copy)
+    # the shared pages
+    gc.collect()
+    gc.freeze()
+    report('preload finished', start)
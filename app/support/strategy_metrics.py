@@ -0,0 +1,105 @@
+""" Library for strategy metrics: trading rules on the walk-forward forecasts of all models and time series
+The validation results of all models are stacked in one array with dimensions (model, time series, step). A trading
+rule sets the position per step from the forecast: long if forecast > threshold, short if forecast < -threshold (rules
+with short positions) and flat otherwise. All rules are evaluated at once on an array with dimensions (rule, model,
+time series, step). Costs are charged per unit of turnover (transaction fees and half the bid-ask spread).
+Steps without an actual return or a forecast are skipped (no return, no costs): the turnover of a step is the change
+from the position of the previous valid step, all metrics are computed over the valid steps.
+Metrics: hit rate (share of invested steps with a positive return), payout from 100, annualised Sharpe ratio, maximum
+drawdown and turnover (mean position change per step).
+Without costs, the payout of rule long_flat is the payout_from_100 of support.walk_forward.model_validation_summary
+(if all time series have forecasts on the same steps).
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import support.result_writer as result_writer
+from support.memory_budget import PERIODS_PER_YEAR
+from support.walk_forward import FORECAST_TYPES
+
+# Costs per unit of turnover and threshold of the thresholded rule (returns)
+STRATEGY_COST = float(os.environ.get('STRATEGY_COST', 0.001))
+STRATEGY_THRESHOLD = float(os.environ.get('STRATEGY_THRESHOLD', 0.002))
+
+# Rules: (threshold, short positions)
+RULES = {'long_flat': (0.0, False), 'long_short': (0.0, True), 'threshold': (STRATEGY_THRESHOLD, True)}
+METRICS = ('hit_rate', 'payout_from_100', 'sharpe_ratio', 'max_drawdown', 'turnover')
+
+
+def get_arrays(dict_fc_res):
+    # Validation results of all models: array with dimensions (model, time series, step, type), see FORECAST_TYPES
+    # Steps: dates with a forecast of at least one model and time series
+    tickers = sorted(set().union(*[res.columns.get_level_values(0) for res in dict_fc_res.values()]))
+    index = sorted(set().union(*[res.loc[:, (slice(None), 'forecast')].dropna(how='all').index
+                                 for res in dict_fc_res.values()]))
+    multi_idx = pd.MultiIndex.from_product([tickers, FORECAST_TYPES])
+
+    values = np.stack([res.reindex(index=index, columns=multi_idx).values.astype(float)
+                       .reshape(len(index), len(tickers), len(FORECAST_TYPES)).transpose(1, 0, 2)
+                       for res in dict_fc_res.values()])
+
+    return values, tickers, pd.DatetimeIndex(index)
+
+
+def get_positions(forecast, rules):
+    # Positions of all rules: array with dimensions (rule, model, time series, step)
+    threshold = np.array([r[0] for r in rules.values()])[:, None, None, None]
+    short = np.array([r[1] for r in rules.values()])[:, None, None, None]
+    return np.where(forecast > threshold, 1.0, np.where(short & (forecast < -threshold), -1.0, 0.0))
+
+
+def calculate(values, rules=None, cost=STRATEGY_COST, periods_per_year=12):
+    # Metrics of all rules, models and time series: dictionary of arrays with dimensions (rule, model, time series)
+    rules = RULES if isinstance(rules, type(None)) else rules
+    actual, forecast = values[..., 0], values[..., 1]
+    valid = ~np.isnan(actual) & ~np.isnan(forecast)
+
+    # Positions (flat without forecast), turnover from the position of the previous valid step (flat before the first
+    # valid step): the position is held over the steps without forecast
+    pos = np.where(valid, get_positions(forecast, rules), 0)
+    last = np.maximum.accumulate(np.where(valid, np.arange(valid.shape[-1]), 0), axis=-1)
+    held = np.take_along_axis(pos, np.broadcast_to(last, pos.shape), axis=-1)
+    turnover = np.where(valid, np.abs(np.diff(held, axis=-1, prepend=0)), 0)
+    ret = np.where(valid, pos * np.nan_to_num(actual) - cost * turnover, 0)
+
+    # Net asset value and drawdown
+    nav = np.cumprod(1 + ret, axis=-1)
+    drawdown = nav / np.maximum.accumulate(np.maximum(nav, 1), axis=-1) - 1
+
+    n = valid.sum(axis=-1)
+    invested = (pos != 0) & valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = ret.sum(axis=-1) / n
+        std = np.sqrt(((ret - mean[..., None]) ** 2 * valid).sum(axis=-1) / (n - 1))
+        metrics = {'hit_rate': (invested & (ret > 0)).sum(axis=-1) / invested.sum(axis=-1),
+                   'payout_from_100': nav[..., -1] * 100 if nav.shape[-1] else np.full(n.shape, 100.0),
+                   'sharpe_ratio': mean / std * np.sqrt(periods_per_year),
+                   'max_drawdown': drawdown.min(axis=-1, initial=0),
+                   'turnover': turnover.sum(axis=-1) / n}
+
+    return {k: np.where(n > 0, v, np.nan) for k, v in metrics.items()}
+
+
+def load(strategy_metrics):
+    # Save data (asynchronous, see support.result_writer)
+    result_writer.save(strategy_metrics=strategy_metrics)
+
+    return
+
+
+def execute(dict_fc_res, freq, rules=None, cost=STRATEGY_COST):
+    # Strategy metrics of the validation results per model: rows (model, rule, metric), columns time series
+    rules = RULES if isinstance(rules, type(None)) else rules
+    values, tickers, _ = get_arrays(dict_fc_res)
+    metrics = calculate(values, rules, cost, PERIODS_PER_YEAR[freq])
+
+    # Array (metric, rule, model, time series) -> rows (model, rule, metric)
+    stacked = np.stack([metrics[m] for m in METRICS]).transpose(2, 1, 0, 3).reshape(-1, len(tickers))
+    multi_idx = pd.MultiIndex.from_product([list(dict_fc_res), list(rules), METRICS], names=['model', 'rule', 'metric'])
+    results = pd.DataFrame(stacked, index=multi_idx, columns=tickers)
+    load(results)
+
+    return results
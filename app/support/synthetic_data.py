@@ -0,0 +1,61 @@
+""" Library for synthetic market data: generated price panels for offline runs and benchmarks
+The prices have the format of data_processing.extract: adjusted close prices on business days with missing values
+(gaps) and tickers that are listed at different dates (ragged histories).
+
+"""
+import zlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Start of the synthetic history of extract
+ORIGIN = datetime(1990, 1, 1)
+
+
+def generate_prices(n_tickers=10, years=5, gaps=0.02, listing=0.2, end_date=None, seed=0):
+    # n_tickers: number of tickers, years: length of the history, gaps: share of missing prices,
+    # listing: share of tickers that are listed after the start date, seed: random seed
+    end_date = datetime.now() if isinstance(end_date, type(None)) else end_date
+    dates = pd.bdate_range(end=pd.Timestamp(end_date).normalize(), periods=int(years * 261))
+    tickers = [f'SYN{i:04d}' for i in range(n_tickers)]
+    rng = np.random.default_rng(seed)
+
+    # Geometric Brownian motion with random drift and volatility (daily)
+    mu = rng.normal(0.0003, 0.0002, n_tickers)
+    sigma = rng.uniform(0.005, 0.03, n_tickers)
+    log_ret = rng.standard_normal((len(dates), n_tickers)) * sigma + mu - 0.5 * sigma ** 2
+    prices = 100 * np.exp(np.cumsum(log_ret, axis=0))
+
+    # Gaps (holidays, missing quotes) and later listing dates
+    prices[rng.random(prices.shape) < gaps] = np.nan
+    listed = rng.random(n_tickers) < listing
+    first_obs = np.where(listed, rng.integers(0, len(dates) // 2, n_tickers), 0)
+    prices[np.arange(len(dates))[:, None] < first_obs[None, :]] = np.nan
+
+    data = pd.DataFrame(prices, index=dates, columns=tickers)
+    data.index.name = 'Date'
+    data.columns.name = None
+
+    return data.dropna(how='all', axis=0)
+
+
+def extract(indexlist, start, end, gaps=0.02):
+    # Offline replacement of data_processing.extract (DATA_PROVIDER=synthetic): the prices of a ticker are
+    # deterministic (seeded by the ticker name), so that any date range of a ticker is consistent
+    dates = pd.bdate_range(ORIGIN, pd.Timestamp(end).normalize())
+    dates = dates[dates < pd.Timestamp(end)]  # end date is exclusive, as for Yahoo finance
+
+    data = pd.DataFrame(index=dates, columns=sorted(indexlist), dtype=float)  # download order
+    for ticker in indexlist:
+        seed = zlib.crc32(ticker.encode())
+        rng_ret, rng_gap = np.random.default_rng(seed), np.random.default_rng(seed + 1)
+        sigma = 0.005 + 0.025 * (seed % 1000) / 1000
+        log_ret = rng_ret.standard_normal(len(dates)) * sigma + 0.0003 - 0.5 * sigma ** 2
+        prices = 100 * np.exp(np.cumsum(log_ret))
+        prices[rng_gap.random(len(dates)) < gaps] = np.nan
+        data[ticker] = prices
+
+    data.index.name = 'Date'
+    data = data.loc[data.index >= pd.Timestamp(start)]
+
+    return data.dropna(how='all', axis=0).dropna(how='all', axis=1)
@@ -0,0 +1,290 @@
+""" Library for tracing: timed spans around pipeline stages
+The durations are aggregated in histograms per stage and served on /metrics (Prometheus text format). Every gunicorn
+worker writes its histograms to output/metrics/<pid>.json from a background thread (every METRICS_INTERVAL seconds if
+changed, not on the request path), the /metrics route merges the files of all workers. Files of processes that no
+longer run (or of an earlier process with the same pid) are removed.
+With TRACE_LOG=1 the spans of every callback (per-request breakdown) are printed to the log.
+The peak memory of every callback (resident memory above the memory at the start, sampled) is aggregated in
+histograms per callback as well. The resident memory is per process: concurrent requests of a worker with multiple
+threads are included in each other's peak.
+
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf'))
+MEMORY_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, float('inf'))  # MB
+MEMORY_INTERVAL = 0.02  # sample interval of the resident memory (seconds)
+TRACE_LOG = os.environ.get('TRACE_LOG', '0') == '1'
+METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', 5))  # seconds between snapshots of the histograms
+
+_histograms = dict()
+_memory_histograms = dict()
+_lock = threading.Lock()
+_local = threading.local()
+_writer = {'pid': None, 'changed': threading.Event()}
+
+
+class Span(object):
+    # Timed stage with attributes (e.g. tickers and rows)
+
+    def __init__(self, name, attributes, depth, start):
+        self.name, self.attributes, self.depth, self.start = name, attributes, depth, start
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    # Time a stage: with span('transform', tickers=5) as s: ... s.set(rows=100)
+    depth = getattr(_local, 'depth', 0)
+    s = Span(name, attributes, depth, time.perf_counter())
+    _local.depth = depth + 1
+    try:
+        yield s
+    finally:
+        _local.depth = depth
+        s.duration = time.perf_counter() - s.start
+        observe(s)
+        trace = getattr(_local, 'trace', None)
+        if not isinstance(trace, type(None)):
+            trace.append(s)
+
+
+def observe(s):
+    # Add a finished span to the histograms (cumulative buckets)
+    with _lock:
+        h = _histograms.setdefault(s.name, {'buckets': [0] * len(BUCKETS), 'sum': 0., 'count': 0, 'tickers': 0,
+                                            'rows': 0})
+        for i, bucket in enumerate(BUCKETS):
+            if s.duration <= bucket:
+                h['buckets'][i] += 1
+        h['sum'] += s.duration
+        h['count'] += 1
+        h['tickers'] += s.attributes.get('tickers', 0)
+        h['rows'] += s.attributes.get('rows', 0)
+
+
+def observe_memory(name, peak):
+    # Add the peak memory (MB) of a callback to the memory histograms
+    with _lock:
+        h = _memory_histograms.setdefault(name, {'buckets': [0] * len(MEMORY_BUCKETS), 'sum': 0., 'count': 0,
+                                                 'max': 0.})
+        for i, bucket in enumerate(MEMORY_BUCKETS):
+            if peak <= bucket:
+                h['buckets'][i] += 1
+        h['sum'] += peak
+        h['count'] += 1
+        h['max'] = max(h['max'], peak)
+
+
+def get_rss():
+    # Resident memory of the current process in MB (Linux), None if unknown
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakMemory(threading.Thread):
+    # Sample the resident memory until stopped, peak: maximum above the memory at the start (MB)
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_rss = get_rss()
+        self.peak = 0.
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(MEMORY_INTERVAL)
+
+    def sample(self):
+        rss = get_rss()
+        if not isinstance(rss, type(None)):
+            self.peak = max(self.peak, rss - self.start_rss)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return self.peak
+
+
+def traced(name):
+    # Decorator for Dash callbacks: request span, peak memory, per-request breakdown and metrics snapshot
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*argv, **kwargs):
+            _local.trace = []
+            memory = PeakMemory()
+            if not isinstance(memory.start_rss, type(None)):
+                memory.start()
+            try:
+                with span('callback.' + name) as s:
+                    return func(*argv, **kwargs)
+            finally:
+                if memory.is_alive():
+                    s.set(peak_mb=round(memory.stop()))
+                    observe_memory('callback.' + name, memory.peak)
+                trace, _local.trace = _local.trace, None
+                if TRACE_LOG:
+                    log_trace(trace)
+                request_snapshot()
+        return wrapper
+    return decorator
+
+
+def log_trace(trace):
+    # Print the spans of a request in start order, indented by depth
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for s in sorted(trace, key=lambda x: x.start):
+        attributes = ', '.join(f'{k}={v}' for k, v in s.attributes.items())
+        print(f"{timestamp}: [trace] {'  ' * s.depth}{s.name} {s.duration:.3f}s {attributes}".rstrip(), flush=True)
+
+
+def get_metrics_path():
+    metrics_path = os.getcwd() + '/output/metrics/'
+    if not os.path.exists(metrics_path):
+        os.makedirs(metrics_path, exist_ok=True)
+    return metrics_path
+
+
+def get_process_start(pid):
+    # Start time of a process (clock ticks since boot, Linux), None if unknown
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def is_running(pid, start):
+    # True if the process of a snapshot still runs: the pid exists and (if known) has the same start time
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return isinstance(start, type(None)) or get_process_start(pid) == start
+
+
+def request_snapshot():
+    # Mark the histograms as changed, the snapshot writer of the process (started on first use, threads do not
+    # survive a fork) writes them
+    if _writer['pid'] != os.getpid():
+        with _lock:
+            if _writer['pid'] != os.getpid():
+                _writer.update(pid=os.getpid(), changed=threading.Event())
+                threading.Thread(target=snapshot_loop, args=(_writer['changed'], ), name='metrics-writer',
+                                 daemon=True).start()
+    _writer['changed'].set()
+
+
+def snapshot_loop(changed):
+    while True:
+        changed.wait()
+        changed.clear()
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+        time.sleep(METRICS_INTERVAL)
+
+
+def write_snapshot():
+    # Histograms of this process for the /metrics route of any worker
+    with _lock:
+        snapshot = json.dumps({'pid': os.getpid(), 'start': get_process_start(os.getpid()), 'duration': _histograms,
+                               'memory': _memory_histograms})
+    file_path = get_metrics_path() + f'{os.getpid()}.json'
+    with open(file_path + '.tmp', 'w') as f:
+        f.write(snapshot)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def get_histograms():
+    # Merge the histograms of all running processes: duration and memory histograms
+    histograms, memory_histograms = dict(), dict()
+    metrics_path = get_metrics_path()
+    for file_name in os.listdir(metrics_path):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(metrics_path + file_name) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        pid = snapshot.get('pid', int(file_name[:-5]) if file_name[:-5].isdigit() else None)
+        if isinstance(pid, type(None)) or pid <= 0 or not is_running(pid, snapshot.get('start')):
+            try:
+                os.remove(metrics_path + file_name)
+            except OSError:
+                pass
+            continue
+        for name, h in snapshot.get('duration', dict()).items():
+            total = histograms.setdefault(name, {'buckets': [0] * len(BUCKETS), 'sum': 0., 'count': 0, 'tickers': 0,
+                                                 'rows': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], h['buckets'])]
+            for k in ('sum', 'count', 'tickers', 'rows'):
+                total[k] += h[k]
+        for name, h in snapshot.get('memory', dict()).items():
+            total = memory_histograms.setdefault(name, {'buckets': [0] * len(MEMORY_BUCKETS), 'sum': 0., 'count': 0,
+                                                        'max': 0.})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], h['buckets'])]
+            total['sum'] += h['sum']
+            total['count'] += h['count']
+            total['max'] = max(total['max'], h['max'])
+    return histograms, memory_histograms
+
+
+def get_metrics_text():
+    # Prometheus text format
+    lines = ['# HELP dashboard_stage_duration_seconds Duration of pipeline stages.',
+             '# TYPE dashboard_stage_duration_seconds histogram']
+    histograms, memory_histograms = get_histograms()
+    for name, h in sorted(histograms.items()):
+        for bucket, count in zip(BUCKETS, h['buckets']):
+            le = '+Inf' if bucket == float('inf') else repr(bucket)
+            lines.append(f'dashboard_stage_duration_seconds_bucket{{stage="{name}",le="{le}"}} {count}')
+        lines.append(f'dashboard_stage_duration_seconds_sum{{stage="{name}"}} {h["sum"]}')
+        lines.append(f'dashboard_stage_duration_seconds_count{{stage="{name}"}} {h["count"]}')
+    for attribute in ('tickers', 'rows'):
+        lines += [f'# HELP dashboard_stage_{attribute}_total Sum of the {attribute} processed by pipeline stages.',
+                  f'# TYPE dashboard_stage_{attribute}_total counter']
+        lines += [f'dashboard_stage_{attribute}_total{{stage="{name}"}} {h[attribute]}'
+                  for name, h in sorted(histograms.items())]
+
+    lines += ['# HELP dashboard_callback_peak_memory_megabytes Peak resident memory of callbacks above the start.',
+              '# TYPE dashboard_callback_peak_memory_megabytes histogram']
+    for name, h in sorted(memory_histograms.items()):
+        for bucket, count in zip(MEMORY_BUCKETS, h['buckets']):
+            le = '+Inf' if bucket == float('inf') else repr(bucket)
+            lines.append(f'dashboard_callback_peak_memory_megabytes_bucket{{stage="{name}",le="{le}"}} {count}')
+        lines.append(f'dashboard_callback_peak_memory_megabytes_sum{{stage="{name}"}} {h["sum"]}')
+        lines.append(f'dashboard_callback_peak_memory_megabytes_count{{stage="{name}"}} {h["count"]}')
+    lines += ['# HELP dashboard_callback_peak_memory_max_megabytes Maximum peak resident memory of callbacks.',
+              '# TYPE dashboard_callback_peak_memory_max_megabytes gauge']
+    lines += [f'dashboard_callback_peak_memory_max_megabytes{{stage="{name}"}} {h["max"]}'
+              for name, h in sorted(memory_histograms.items())]
+
+    return '\n'.join(lines) + '\n'
+
+
+def register(server):
+    # Register the /metrics route on the Flask server
+    from flask import Response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(get_metrics_text(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,166 @@
+""" Library for model validation: walk-forward one-step-ahead forecasts (generic functions for all models)
+The model_forecast function of a model is supplied as func_model_forecast, its parameters are supplied with argv.
+Forecasts of a previous run (prev_forecast, prev_results) are reused for time series whose history did not change,
+so that only new time series and new validation steps are computed.
+The models are trained on an expanding window (all observations before the forecast date, window=None) or on a
+rolling window of the last window observations, which bounds the cost per validation step.
+Without a deadline the validation steps are computed in chronological order. With a deadline (time.monotonic) the
+validation steps are computed from the most recent step backwards and stop when the deadline is reached, the summary
+reports the completed steps (validation_steps). The forecasts of a step must not depend on the order of the steps
+(warm starts, see support.model_xgboost).
+
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from support.tracing import span
+
+FORECAST_TYPES = ('actual', 'forecast', 'ci_lower', 'ci_upper')
+
+
+def get_model_forecast_and_validation(data_in, validation_steps, func_model_forecast, *argv, prev_forecast=None,
+                                      prev_results=None, desc=None, window=None, deadline=None):
+    # Perform model forecast (1 step ahead) and validation
+    # window: training window, expanding (None) or rolling window of the last window observations
+    # deadline: time.monotonic() after which no further validation steps are started
+
+    # Initialise max validation steps: at least 10 observations required
+    actual_val_steps = get_validation_steps(data_in, validation_steps)
+
+    # forecast and validation
+    res_forecast = model_forecast(data_in, func_model_forecast, *argv, prev_forecast=prev_forecast, window=window)
+    res_validation, res_val_summary, steps_done = model_validation(data_in, actual_val_steps, func_model_forecast,
+                                                                   *argv, prev_results=prev_results, desc=desc,
+                                                                   window=window, deadline=deadline)
+
+    results = pd.concat([res_forecast, res_val_summary])
+    results.loc['training_window', :] = get_window_label(window)
+    results.loc['validation_steps', :] = steps_done
+
+    return results, res_validation
+
+
+def model_forecast(data_in, func_model_forecast, *argv, prev_forecast=None, window=None):
+    # Perform 1 step ahead forecast, reuse the forecast of time series in prev_forecast
+    name = get_model_name(func_model_forecast) + '.forecast'
+    if not isinstance(window, type(None)):
+        data_in = data_in.iloc[-window:, ]
+    if isinstance(prev_forecast, type(None)):
+        with span(name, tickers=data_in.shape[1], rows=data_in.shape[0]):
+            return func_model_forecast(data_in, 1, *argv)
+
+    columns = [ts for ts in data_in.columns if ts not in prev_forecast.columns]
+    list_res = [prev_forecast.loc[:, [ts for ts in data_in.columns if ts in prev_forecast.columns]]]
+    if columns:
+        with span(name, tickers=len(columns), rows=data_in.shape[0]):
+            list_res.append(func_model_forecast(data_in.loc[:, columns], 1, *argv))
+
+    return pd.concat(list_res, axis=1).loc[:, data_in.columns]
+
+
+def get_validation_steps(data_in, validation_steps):
+    # Validation steps: at least 10 observations of all time series are required for training
+    return min(data_in.dropna().shape[0] - 10, validation_steps)
+
+
+def model_validation(data_in, steps, func_model_forecast, *argv, prev_results=None, desc=None, window=None,
+                     deadline=None):
+    # Perform rolling window forecast (generic function)
+    # The model_forecast parameters are supplied with argv, window and deadline: see
+    # get_model_forecast_and_validation. Returns the results, the summary and the number of completed steps
+
+    # Initialise: array with dimensions (date, time series, type)
+    n_obs, n_ts = data_in.shape
+    values = np.full((n_obs, n_ts, len(FORECAST_TYPES)), np.nan)
+    values[:, :, 0] = data_in.values
+
+    # Forecasts from a previous run (only supplied for time series with unchanged history)
+    reuse = np.zeros((n_obs, n_ts), dtype=bool)
+    if not isinstance(prev_results, type(None)):
+        multi_idx = pd.MultiIndex.from_product([data_in.columns, FORECAST_TYPES[1:]])
+        prev_values = prev_results.reindex(index=data_in.index, columns=multi_idx).values.astype(float)
+        prev_values = prev_values.reshape(n_obs, n_ts, len(FORECAST_TYPES) - 1)
+        reuse = ~np.isnan(prev_values[:, :, 0])
+        values[:, :, 1:][reuse] = prev_values[reuse]
+
+    # Loop over steps: with a deadline the most recent step first, the completed steps are the last steps if the
+    # deadline is reached
+    name = get_model_name(func_model_forecast) + '.validation_step'
+    counts = range(n_obs - steps, n_obs)
+    if not isinstance(deadline, type(None)):
+        counts = counts[::-1]
+    steps_done = 0
+    for count in (tqdm(counts, desc=desc) if desc else counts):  # debug with tqdm
+        columns = ~reuse[count]
+        if not columns.any():
+            steps_done += 1
+            continue
+        if not isinstance(deadline, type(None)) and time.monotonic() > deadline:
+            break
+
+        # Initialise train test split
+        train = data_in.iloc[:count, columns] if isinstance(window, type(None)) else \
+            data_in.iloc[max(0, count - window):count, columns]
+
+        # Forecast
+        with span(name, tickers=train.shape[1], rows=train.shape[0]):
+            forecast_res = func_model_forecast(train, 1, *argv)
+
+        # Save results
+        values[count, columns, 1:] = forecast_res.loc[['forecast', 'ci_lower', 'ci_upper'], ].values.T
+        steps_done += 1
+
+    # Forecasts outside the completed validation steps are not part of the results
+    values[:n_obs - steps_done, :, 1:] = np.nan
+    results, results_summary = get_validation_results(data_in, values)
+
+    return results, results_summary, steps_done
+
+
+def get_validation_results(data_in, values):
+    # Results and summary from the array with dimensions (date, time series, type), see FORECAST_TYPES
+    n_obs, n_ts = data_in.shape
+    multi_idx = pd.MultiIndex.from_product([data_in.columns, FORECAST_TYPES], names=['index', 'type'])
+    results = pd.DataFrame(values.reshape(n_obs, n_ts * len(FORECAST_TYPES)), index=data_in.index, columns=multi_idx)
+    results_summary = model_validation_summary(results)
+
+    return results, results_summary
+
+
+def get_window_label(window):
+    # Training window in the forecast summary
+    return 'expanding' if isinstance(window, type(None)) else f'rolling {window}'
+
+
+def get_model_name(func_model_forecast):
+    # Stage name of the model for tracing, e.g. model_arima
+    return func_model_forecast.__module__.split('.')[-1]
+
+
+def model_validation_summary(forecast_results):
+    # Calculate summary statistics from the rolling forecast (generic function)
+    # accuracy: correct forecast of positive and negative returns
+    # payout: payout for following strategy with 100 EUR (excl. transaction fees and bid-ask spread)
+    # Without validation steps (time budget) the metrics are empty
+
+    res = forecast_results.dropna()
+    results = pd.DataFrame(index=['accuracy', 'payout_from_100'], columns=res.columns.levels[0])
+    if res.shape[0] == 0:
+        return results
+
+    # Calculate accuracy
+    pos_ret_act = res.loc[:, (slice(None), 'actual')] > 0
+    pos_ret_for = res.loc[:, (slice(None), 'forecast')] > 0
+    accuracy = (pos_ret_act.values == pos_ret_for.values).sum(axis=0) / res.shape[0]
+
+    # Calculate payout
+    ret_act = res.loc[:, (slice(None), 'actual')]
+    payout = (ret_act.values * pos_ret_for.values + 1).prod(axis=0) * 100
+
+    results.loc['accuracy', ] = accuracy
+    results.loc['payout_from_100', ] = payout
+
+    return results